@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import clock
+from storage import (
+    create_laundry_booking,
+    enqueue_notifications,
+    get_available_machines,
+    get_booked_laundry_slots,
+    get_laundry_booking_counts,
+    get_laundry_slot_template,
+    write_async
+)
+from schedule import ADMISSION_LOTTERY, LAUNDRY_SLOT_MINUTES, BookingWindow, free_slot_starts
+from utils import minutes_to_time, time_to_minutes
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRequest(NamedTuple):
+    """Запрос на запись, поступивший в первые секунды после открытия даты"""
+    user_id: int
+    machine_number: int
+    booking_date: str
+    start_time: str
+    ticket: float
+    idempotency_key: Optional[str] = None
+
+
+class AdmissionQueue:
+    """
+    Очередь допуска на открытие записи.
+
+    Запросы на только что открывшуюся дату не идут в БД сразу: они собираются в очередь
+    до конца окна допуска, затем обрабатываются по порядку поступления (FIFO) или по
+    случайным билетам (лотерея) против заранее прогретого снимка свободных слотов.
+    Победители записываются одной групповой фиксацией, результат приходит сообщением.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, List[AdmissionRequest]] = {}
+        self._snapshots: Dict[str, Dict[int, Set[int]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._rng = random.SystemRandom()
+
+    def snapshot(self, booking_date: str) -> Dict[int, Set[int]]:
+        """Свободные минуты начала слотов по машинкам (строится один раз на открытие)"""
+        if booking_date not in self._snapshots:
+            day = datetime.strptime(booking_date, '%Y-%m-%d').date()
+            template = get_laundry_slot_template(day)
+            booked = get_booked_laundry_slots(day)
+            self._snapshots[booking_date] = {
+                machine: set(free_slot_starts(template, booked.get(machine, set())))
+                for machine in get_available_machines()
+            }
+        return self._snapshots[booking_date]
+
+    def free_slots(self, booking_date: str, machine_number: int) -> List[str]:
+        """Свободные слоты машинки по снимку (для показа во время всплеска без запросов к БД)"""
+        return [minutes_to_time(slot) for slot in sorted(self.snapshot(booking_date).get(machine_number, ()))]
+
+    def prewarm(self, window: BookingWindow, now: datetime, lead_seconds: int):
+        """Строит снимок для даты, запись на которую откроется в ближайшие lead_seconds секунд"""
+        if not window.enabled:
+            return
+        day = now.date() + timedelta(days=window.days)
+        seconds_left = (window.opens_at(day) - now).total_seconds()
+        if 0 < seconds_left <= lead_seconds:
+            booking_date = day.strftime('%Y-%m-%d')
+            # Снимок строится заново перед открытием, чтобы учесть изменения за день
+            self._snapshots.pop(booking_date, None)
+            self.snapshot(booking_date)
+
+    def enqueue(self, window: BookingWindow, user_id: int, machine_number: int,
+                booking_date: str, start_time: str, idempotency_key: Optional[str] = None) -> Tuple[int, int]:
+        """
+        Ставит запрос в очередь открытия даты.
+
+        Возвращает (позиция, всего в очереди). При лотерее позиция — номер билета,
+        итоговый порядок определяется розыгрышем по окончании окна.
+        """
+        queue = self._queues.get(booking_date)
+        if queue is None:
+            queue = self._queues[booking_date] = []
+            self.snapshot(booking_date)
+            day = datetime.strptime(booking_date, '%Y-%m-%d').date()
+            closes_at = window.opens_at(day) + timedelta(seconds=window.surge_seconds)
+            delay = max((closes_at - clock.now()).total_seconds(), 0)
+            task = asyncio.create_task(self._process_later(booking_date, window.mode, delay))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        for position, request in enumerate(queue, start=1):
+            if request.user_id == user_id and request.start_time == start_time:
+                return position, len(queue)
+
+        queue.append(AdmissionRequest(
+            user_id, machine_number, booking_date, start_time, self._rng.random(), idempotency_key
+        ))
+        return len(queue), len(queue)
+
+    async def _process_later(self, booking_date: str, mode: str, delay: float):
+        await clock.sleep(delay)
+        try:
+            await self.process(booking_date, mode)
+        except Exception as e:
+            logger.error(f"Ошибка обработки очереди открытия записи на {booking_date}: {e}")
+
+    async def process(self, booking_date: str, mode: str):
+        """
+        Распределяет слоты по очереди и уведомляет участников.
+
+        Дневной лимит (2 записи) учитывает записи пользователя на дату и слоты, уже выданные
+        ему в этой очереди. Слоты, запись на которые не удалась, заново распределяются между
+        оставшимися участниками. Подтверждение ставится в очередь уведомлений вместе с самой
+        записью, отказы — одной транзакцией после распределения.
+        """
+        requests = self._queues.pop(booking_date, [])
+        if mode == ADMISSION_LOTTERY:
+            requests.sort(key=lambda request: request.ticket)
+
+        date_display = datetime.strptime(booking_date, '%Y-%m-%d').strftime('%d.%m.%Y')
+        free = self.snapshot(booking_date)
+        bookings_per_user = get_laundry_booking_counts(booking_date)
+        booked = 0
+        failed = []
+        over_limit = []
+        rejected = []
+        pending = requests
+        while pending:
+            granted = []
+            rejected = []
+            for request in pending:
+                if bookings_per_user.get(request.user_id, 0) >= 2:
+                    over_limit.append(request)
+                    continue
+                start_min = time_to_minutes(request.start_time)
+                # Желаемая машинка, иначе любая другая, свободная в это же время
+                machines = [request.machine_number] + sorted(m for m in free if m != request.machine_number)
+                machine = next((m for m in machines if start_min in free.get(m, ())), None)
+                if machine is None:
+                    rejected.append(request)
+                    continue
+                free[machine].discard(start_min)
+                bookings_per_user[request.user_id] = bookings_per_user.get(request.user_id, 0) + 1
+                granted.append((request, machine))
+
+            if not granted:
+                break
+
+            end_times = {
+                request: minutes_to_time(time_to_minutes(request.start_time) + LAUNDRY_SLOT_MINUTES)
+                for request, _ in granted
+            }
+            results = await asyncio.gather(*(
+                write_async(
+                    create_laundry_booking, request.user_id, machine, booking_date,
+                    request.start_time, end_times[request], request.idempotency_key,
+                    f"✅ Очередь открытия записи: вы записаны на машинку №{machine}\n"
+                    f"📅 Дата: {date_display}\n"
+                    f"⏰ Время: {request.start_time}-{end_times[request]}"
+                )
+                for request, machine in granted
+            ), return_exceptions=True)
+
+            round_failed = [request for (request, _), result in zip(granted, results) if result is not True]
+            booked += len(granted) - len(round_failed)
+            if not round_failed:
+                break
+            # Запись в обход очереди или гонка с лимитом: освободившиеся слоты берутся
+            # из нового снимка и достаются оставшимся участникам по тому же порядку
+            for request in round_failed:
+                bookings_per_user[request.user_id] -= 1
+            failed.extend(round_failed)
+            self._snapshots.pop(booking_date, None)
+            free = self.snapshot(booking_date)
+            pending = rejected
+        self._snapshots.pop(booking_date, None)
+
+        notifications: List[Tuple[int, str, str]] = []
+        for request in failed:
+            notifications.append((
+                request.user_id,
+                f"❌ Очередь открытия записи: не удалось записать вас на {date_display} "
+                f"{request.start_time} (слот занят или у вас уже 2 записи на этот день).",
+                'admission'
+            ))
+        for request in over_limit:
+            notifications.append((
+                request.user_id,
+                f"❌ Очередь открытия записи: слот {date_display} {request.start_time} не выдан — "
+                f"у вас уже 2 записи на этот день.",
+                'admission'
+            ))
+        for request in rejected:
+            notifications.append((
+                request.user_id,
+                f"❌ Очередь открытия записи: слот {date_display} {request.start_time} достался другим участникам.",
+                'admission'
+            ))
+
+        logger.info(
+            f"Очередь открытия {booking_date} ({mode}): {len(requests)} запросов, записано {booked}"
+        )
+        if notifications:
+            await write_async(enqueue_notifications, notifications)
+
+    def queued_count(self, booking_date: str) -> int:
+        return len(self._queues.get(booking_date, ()))
+
+
+def admission_message(window: BookingWindow, position: int, total: int) -> str:
+    """Ответ пользователю, поставленному в очередь открытия записи"""
+    if window.mode == ADMISSION_LOTTERY:
+        order = f"Вы участвуете в розыгрыше очереди (билет №{position}, участников: {total})."
+    else:
+        order = f"Ваше место в очереди: №{position}."
+    return (
+        f"⏳ Запись на эту дату только что открылась, запросы первых {window.surge_seconds} сек. "
+        f"обрабатываются по очереди.\n{order}\n\n"
+        f"Результат придет сообщением сразу после закрытия очереди."
+    )
+
+
+admission_queue = AdmissionQueue()
@@ -0,0 +1,250 @@
+"""
+Аналитика загрузки по истории записей.
+
+История за период читается одним запросом в массив NumPy и разворачивается в занятость
+день × 30-минутный слот × машинка. Загрузка по дням недели и часам, пиковые часы и доля
+неявок считаются векторно, без цикла по записям, поэтому отчет за год строится за доли
+секунды. Тепловая карта кодируется в PNG напрямую (zlib), без графических библиотек.
+
+NumPy — необязательная зависимость: без него бот работает как раньше, а отчеты
+недоступны (ANALYTICS_AVAILABLE = False).
+"""
+import os
+import struct
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import clock
+from storage import get_all_machines, get_booking_history
+from utils import RESTROOM_RESOURCE, date_to_day_number, to_minute_stamp
+
+ANALYTICS_AVAILABLE = np is not None
+
+# Период отчета по умолчанию, дней
+HEATMAP_DAYS = int(os.getenv('DORM_BOT_HEATMAP_DAYS', '365'))
+
+# Загрузка, начиная с которой час считается насыщенным
+SATURATION_THRESHOLD = 0.9
+
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+SLOTS_PER_HOUR = 60 // SLOT_MINUTES
+
+# Столбцы истории записей (database.get_booking_history)
+DAY, MACHINE, START, END, CANCELLED, NO_SHOW = range(6)
+
+# Тепловая карта: размер клетки и поля под подписи, пикселей
+HEATMAP_CELL = 20
+HEATMAP_MARGIN = 24
+
+# Цвета шкалы загрузки: 0 — светло-серый, 0.5 — желтый, 1 — красный
+HEATMAP_STOPS = (0.0, 0.5, 1.0)
+HEATMAP_COLORS = ((245, 245, 245), (255, 200, 0), (200, 0, 0))
+HEATMAP_TEXT_COLOR = (60, 60, 60)
+
+# Цифры 3 × 5 для подписей часов и дней недели
+DIGIT_GLYPHS = {
+    '0': ('111', '101', '101', '101', '111'),
+    '1': ('010', '110', '010', '010', '111'),
+    '2': ('111', '001', '111', '100', '111'),
+    '3': ('111', '001', '111', '001', '111'),
+    '4': ('101', '101', '111', '001', '001'),
+    '5': ('111', '100', '111', '001', '111'),
+    '6': ('111', '100', '111', '101', '111'),
+    '7': ('111', '001', '001', '001', '001'),
+    '8': ('111', '101', '111', '101', '111'),
+    '9': ('111', '101', '111', '001', '111')
+}
+GLYPH_SCALE = 2
+
+
+def load_history(booking_type: str, first_day: int, last_day: int,
+                 machine_number: Optional[int] = None) -> 'np.ndarray':
+    """История записей периода: целочисленный массив N × 6 (столбцы DAY … NO_SHOW)"""
+    rows = get_booking_history(booking_type, first_day, last_day, machine_number)
+    return np.array(rows, dtype=np.int64).reshape(-1, 6)
+
+
+def weekdays(first_day: int, days: int) -> 'np.ndarray':
+    """Дни недели (0 — понедельник) для номеров дней first_day … first_day + days - 1"""
+    return (np.arange(first_day, first_day + days) - 1) % 7
+
+
+def occupancy_array(history: 'np.ndarray', first_day: int, days: int, machines: List[int]) -> 'np.ndarray':
+    """
+    Занятость день × слот × машинка (bool) по неотмененным записям.
+
+    Каждая запись разворачивается в свои 30-минутные слоты одной операцией над массивами.
+    """
+    machine_ids = np.array(sorted(machines), dtype=np.int64)
+    occupancy = np.zeros((days, SLOTS_PER_DAY, len(machine_ids)), dtype=bool)
+
+    rows = history[
+        (history[:, CANCELLED] == 0)
+        & np.isin(history[:, MACHINE], machine_ids)
+        & (history[:, DAY] >= first_day) & (history[:, DAY] < first_day + days)
+    ]
+    first_slot = rows[:, START] // SLOT_MINUTES
+    end_slot = np.minimum(-(-rows[:, END] // SLOT_MINUTES), SLOTS_PER_DAY)
+    counts = np.maximum(end_slot - first_slot, 0)
+
+    booking = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    occupancy[
+        rows[booking, DAY] - first_day,
+        first_slot[booking] + offsets,
+        np.searchsorted(machine_ids, rows[booking, MACHINE])
+    ] = True
+    return occupancy
+
+
+def hourly_utilization(occupancy: 'np.ndarray', first_day: int) -> 'np.ndarray':
+    """Средняя загрузка по дням недели и часам: массив 7 × 24 долей от 0 до 1"""
+    days = occupancy.shape[0]
+    per_day = occupancy.reshape(days, 24, SLOTS_PER_HOUR * occupancy.shape[2]).mean(axis=2)
+
+    day_of_week = weekdays(first_day, days)
+    totals = np.zeros((7, 24))
+    np.add.at(totals, day_of_week, per_day)
+    counts = np.bincount(day_of_week, minlength=7)[:, None]
+    return np.divide(totals, counts, out=np.zeros_like(totals), where=counts > 0)
+
+
+def no_show_rates(history: 'np.ndarray', now_stamp: int) -> Tuple[Optional[float], 'np.ndarray']:
+    """
+    Доля неявок среди неотмененных записей, которые уже начались.
+
+    Возвращает (доля за весь период или None, массив 7 × 24 по дню недели и часу начала;
+    NaN там, где записей не было).
+    """
+    started = history[
+        (history[:, CANCELLED] == 0) & (history[:, DAY] * 1440 + history[:, START] <= now_stamp)
+    ]
+    if not len(started):
+        return None, np.full((7, 24), np.nan)
+
+    cell = ((started[:, DAY] - 1) % 7) * 24 + started[:, START] // 60
+    total = np.bincount(cell, minlength=7 * 24)
+    no_shows = np.bincount(cell, weights=started[:, NO_SHOW], minlength=7 * 24)
+    rates = np.divide(no_shows, total, out=np.full(7 * 24, np.nan), where=total > 0)
+    return float(started[:, NO_SHOW].mean()), rates.reshape(7, 24)
+
+
+def peak_hours(utilization: 'np.ndarray', top: int = 3) -> List[Tuple[int, int, float]]:
+    """Самые загруженные часы: [(день недели, час, загрузка), ...] по убыванию"""
+    order = np.argsort(utilization, axis=None, kind='stable')[::-1][:top]
+    return [
+        (int(index // 24), int(index % 24), float(utilization.flat[index]))
+        for index in order if utilization.flat[index] > 0
+    ]
+
+
+def heatmap_colors(values: 'np.ndarray') -> 'np.ndarray':
+    """Цвета шкалы загрузки для массива долей: тот же массив с последней осью RGB"""
+    return np.stack([
+        np.interp(values, HEATMAP_STOPS, channel) for channel in zip(*HEATMAP_COLORS)
+    ], axis=-1).astype(np.uint8)
+
+
+def draw_digits(image: 'np.ndarray', text: str, x: int, y: int):
+    """Рисует число цифрами DIGIT_GLYPHS с левым верхним углом в (x, y)"""
+    for char in text:
+        glyph = np.array([[pixel == '1' for pixel in row] for row in DIGIT_GLYPHS[char]])
+        mask = np.kron(glyph, np.ones((GLYPH_SCALE, GLYPH_SCALE), dtype=bool))
+        image[y:y + mask.shape[0], x:x + mask.shape[1]][mask] = HEATMAP_TEXT_COLOR
+        x += mask.shape[1] + GLYPH_SCALE
+
+
+def encode_png(image: 'np.ndarray') -> bytes:
+    """Кодирует массив высота × ширина × RGB (uint8) в PNG"""
+    height, width, _ = image.shape
+    # Каждая строка изображения начинается с байта фильтра (0 — без фильтра)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, -1)]).tobytes()
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(raw, 9))
+        + chunk(b'IEND', b'')
+    )
+
+
+def render_heatmap(utilization: 'np.ndarray') -> bytes:
+    """
+    Тепловая карта загрузки 7 × 24 в формате PNG.
+
+    Строки — дни недели с понедельника (подписаны 1–7), столбцы — часы (подписаны через 3).
+    """
+    cells = np.repeat(np.repeat(heatmap_colors(utilization), HEATMAP_CELL, axis=0), HEATMAP_CELL, axis=1)
+    image = np.full((HEATMAP_MARGIN + cells.shape[0], HEATMAP_MARGIN + cells.shape[1], 3), 255, dtype=np.uint8)
+    image[HEATMAP_MARGIN:, HEATMAP_MARGIN:] = cells
+
+    # Белая сетка между клетками
+    image[HEATMAP_MARGIN::HEATMAP_CELL, HEATMAP_MARGIN:] = 255
+    image[HEATMAP_MARGIN:, HEATMAP_MARGIN::HEATMAP_CELL] = 255
+
+    glyph_height = 5 * GLYPH_SCALE
+    for hour in range(0, 24, 3):
+        draw_digits(image, str(hour), HEATMAP_MARGIN + hour * HEATMAP_CELL + 3, (HEATMAP_MARGIN - glyph_height) // 2)
+    for weekday in range(7):
+        draw_digits(image, str(weekday + 1), (HEATMAP_MARGIN - 3 * GLYPH_SCALE) // 2,
+                    HEATMAP_MARGIN + weekday * HEATMAP_CELL + (HEATMAP_CELL - glyph_height) // 2)
+
+    return encode_png(image)
+
+
+def build_utilization_report(resource: str, days: int = HEATMAP_DAYS) -> Dict:
+    """
+    Отчет о загрузке за последние days дней (до сегодняшнего включительно).
+
+    resource: 'laundry' (все машинки), 'laundry_N' (одна машинка) или 'restroom'.
+    Период начинается не раньше первой записи, чтобы пустые месяцы до запуска бота
+    не занижали загрузку.
+    """
+    if not ANALYTICS_AVAILABLE:
+        raise RuntimeError("Для отчетов о загрузке нужен пакет numpy")
+
+    started = time.perf_counter()
+    now = clock.now()
+    last_day = date_to_day_number(now.date())
+    first_day = last_day - days + 1
+
+    if resource == RESTROOM_RESOURCE:
+        booking_type, machine_number, machines = 'restroom', None, [0]
+    elif resource == 'laundry':
+        booking_type, machine_number = 'laundry', None
+        machines = [machine['machine_number'] for machine in get_all_machines()]
+    else:
+        booking_type, machine_number = 'laundry', int(resource.split('_')[1])
+        machines = [machine_number]
+
+    history = load_history(booking_type, first_day, last_day, machine_number)
+    if len(history):
+        first_day = max(first_day, int(history[:, DAY].min()))
+    period = last_day - first_day + 1
+
+    utilization = hourly_utilization(occupancy_array(history, first_day, period, machines), first_day)
+    no_show_rate, no_show_by_hour = no_show_rates(history, to_minute_stamp(now))
+
+    return {
+        'resource': resource,
+        'days': period,
+        'bookings': int((history[:, CANCELLED] == 0).sum()),
+        'utilization': utilization,
+        'peaks': peak_hours(utilization),
+        'saturated_hours': int((utilization >= SATURATION_THRESHOLD).sum()),
+        # В комнату отдыха отметки о приходе нет, неявки не фиксируются
+        'no_show_rate': no_show_rate if booking_type == 'laundry' else None,
+        'no_show_by_hour': no_show_by_hour,
+        'png': render_heatmap(utilization),
+        'elapsed': time.perf_counter() - started
+    }
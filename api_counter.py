@@ -0,0 +1,37 @@
+from collections import Counter
+from typing import Dict
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+
+class ApiCallCounter(BaseRequestMiddleware):
+    """Считает исходящие вызовы Telegram Bot API по методам"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.skipped_edits = 0
+        self.bookings = 0
+
+    async def __call__(self, make_request, bot, method):
+        self.calls[type(method).__name__] += 1
+        return await make_request(bot, method)
+
+    def record_skipped_edit(self):
+        """Учитывает редактирование, пропущенное из-за неизменного содержимого"""
+        self.skipped_edits += 1
+
+    def record_booking(self, count: int = 1):
+        """Учитывает завершенные записи для расчета вызовов API на одну запись"""
+        self.bookings += count
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает количество вызовов по методам и сводные счетчики"""
+        return {
+            'total': sum(self.calls.values()),
+            'skipped_edits': self.skipped_edits,
+            'bookings': self.bookings,
+            **dict(self.calls.most_common())
+        }
+
+
+api_call_counter = ApiCallCounter()
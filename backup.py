@@ -0,0 +1,234 @@
+"""
+Резервные копии БД на ходу, без остановки бота.
+
+Копия снимается через SQLite backup API небольшими порциями страниц в отдельном потоке,
+с паузой между порциями, поэтому цикл событий и поток-писатель не ждут резервного
+копирования. Источник держит открытую читающую транзакцию: в режиме WAL она фиксирует
+снимок БД, и копирование не начинается заново при каждой записи бота. Готовая копия
+проверяется (PRAGMA integrity_check) и только потом получает постоянное имя; старые
+копии удаляются по количеству.
+
+Использование:
+    python backup.py create [--dir backups] [--checkpoint passive|truncate]
+    python backup.py list [--dir backups]
+    python backup.py verify ФАЙЛ
+    python backup.py restore ФАЙЛ [--db dorm_bot.db]
+
+Восстановление выполняется при остановленном боте; текущая БД перед этим сохраняется
+рядом с копиями под именем pre-restore-*.db.
+"""
+import argparse
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import List, Optional, Tuple
+
+import clock
+import database
+
+logger = logging.getLogger(__name__)
+
+# Каталог резервных копий
+BACKUP_DIR = os.getenv('DORM_BOT_BACKUP_DIR', 'backups')
+
+# Интервал автоматического копирования в часах (0 — отключено)
+BACKUP_INTERVAL_HOURS = float(os.getenv('DORM_BOT_BACKUP_HOURS', '24'))
+
+# Сколько последних копий хранить
+BACKUP_KEEP = int(os.getenv('DORM_BOT_BACKUP_KEEP', '7'))
+
+# Контрольная точка WAL после копирования: '' (нет), 'passive' или 'truncate'
+BACKUP_CHECKPOINT = os.getenv('DORM_BOT_BACKUP_CHECKPOINT', 'passive')
+
+# Страниц за один шаг копирования и пауза между шагами
+BACKUP_PAGES_PER_STEP = 64
+BACKUP_STEP_PAUSE_SECONDS = 0.01
+
+BACKUP_PREFIX = 'dorm_bot-'
+CHECKPOINT_MODES = ('passive', 'truncate')
+
+
+def backup_path(backup_dir: str, prefix: str = BACKUP_PREFIX) -> str:
+    return os.path.join(backup_dir, f"{prefix}{clock.now().strftime('%Y%m%d-%H%M%S')}.db")
+
+
+def verify_backup(path: str) -> Tuple[bool, str]:
+    """Проверяет целостность файла копии. Возвращает (успех, результат проверки)"""
+    try:
+        with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+            rows = conn.execute('PRAGMA integrity_check').fetchall()
+            result = "; ".join(row[0] for row in rows)
+            if result != 'ok':
+                return False, result
+            conn.execute('SELECT COUNT(*) FROM laundry_bookings').fetchone()
+            return True, result
+    except sqlite3.Error as e:
+        return False, str(e)
+
+
+def copy_database(source: sqlite3.Connection, target_path: str,
+                  pages: int = BACKUP_PAGES_PER_STEP, pause: float = BACKUP_STEP_PAUSE_SECONDS) -> int:
+    """Копирует БД соединения source в файл target_path порциями по pages страниц. Возвращает число шагов"""
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if remaining and pause:
+            time.sleep(pause)
+
+    with closing(sqlite3.connect(target_path)) as target:
+        source.backup(target, pages=pages, progress=progress)
+        # Копия — самостоятельный файл без WAL
+        target.execute('PRAGMA journal_mode=DELETE')
+    return steps
+
+
+def create_backup(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+                  checkpoint: str = BACKUP_CHECKPOINT) -> str:
+    """
+    Снимает проверенную резервную копию текущей БД и возвращает путь к ней.
+
+    Блокирует вызывающий поток на время копирования; из бота вызывается через asyncio.to_thread.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    path = backup_path(backup_dir)
+    partial = path + '.part'
+    started = time.perf_counter()
+
+    with closing(database.get_db_connection()) as source:
+        # Читающая транзакция фиксирует снимок: записи бота не перезапускают копирование
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        try:
+            steps = copy_database(source, partial)
+        finally:
+            source.rollback()
+
+    ok, result = verify_backup(partial)
+    if not ok:
+        os.remove(partial)
+        raise RuntimeError(f"Резервная копия не прошла проверку: {result}")
+    os.replace(partial, path)
+
+    removed = rotate_backups(backup_dir, keep)
+    if checkpoint:
+        checkpoint_wal(checkpoint)
+
+    logger.info(
+        f"Резервная копия {path}: {os.path.getsize(path) // 1024} КБ, {steps} шагов, "
+        f"{time.perf_counter() - started:.1f} с, удалено старых: {removed}"
+    )
+    return path
+
+
+def list_backups(backup_dir: str = BACKUP_DIR, prefix: str = BACKUP_PREFIX) -> List[str]:
+    """Копии в каталоге, от старых к новым"""
+    return sorted(glob.glob(os.path.join(backup_dir, f"{prefix}*.db")))
+
+
+def rotate_backups(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> int:
+    """Удаляет копии сверх keep последних. Возвращает число удаленных"""
+    if keep <= 0:
+        return 0
+    stale = list_backups(backup_dir)[:-keep]
+    for path in stale:
+        os.remove(path)
+    return len(stale)
+
+
+def checkpoint_wal(mode: str = 'passive') -> Optional[Tuple[int, int, int]]:
+    """
+    Переносит WAL в основной файл БД.
+
+    PASSIVE не ждет ни читателей, ни писателя. TRUNCATE выполняется заданием писателя,
+    чтобы не конкурировать с записями бота, и обнуляет файл WAL.
+    """
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError(f"Неизвестный режим контрольной точки: {mode}")
+
+    def run(conn: sqlite3.Connection):
+        return conn.execute(f'PRAGMA wal_checkpoint({mode.upper()})').fetchone()
+
+    try:
+        if mode == 'truncate':
+            return database.get_writer().submit(lambda: run(database.get_writer().connection()))
+        with closing(database.get_db_connection()) as conn:
+            return run(conn)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка контрольной точки WAL ({mode}): {e}")
+        return None
+
+
+def restore_backup(path: str, db_path: Optional[str] = None, backup_dir: str = BACKUP_DIR) -> str:
+    """
+    Восстанавливает БД из копии (бот должен быть остановлен).
+
+    Текущая БД сначала сохраняется как pre-restore-*.db. Возвращает путь к этому сохранению.
+    """
+    ok, result = verify_backup(path)
+    if not ok:
+        raise RuntimeError(f"Копия {path} повреждена: {result}")
+
+    db_path = db_path or database.DB_PATH
+    database.close_connections()
+    os.makedirs(backup_dir, exist_ok=True)
+    saved = backup_path(backup_dir, prefix='pre-restore-')
+
+    with closing(sqlite3.connect(db_path)) as current:
+        copy_database(current, saved, pause=0)
+        with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as source:
+            # backup API переписывает БД целиком и корректно обрабатывает ее WAL
+            source.backup(current)
+        current.execute('PRAGMA journal_mode=WAL')
+
+    return saved
+
+
+async def run_scheduled_backups(interval_hours: float = BACKUP_INTERVAL_HOURS):
+    """Фоновая задача бота: резервная копия каждые interval_hours часов"""
+    if interval_hours <= 0:
+        return
+    while True:
+        await clock.sleep(interval_hours * 3600)
+        try:
+            await asyncio.to_thread(create_backup)
+        except Exception as e:
+            logger.error(f"Ошибка резервного копирования: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резервные копии БД бота")
+    parser.add_argument('command', choices=('create', 'list', 'verify', 'restore'))
+    parser.add_argument('path', nargs='?', help="Файл копии (для verify и restore)")
+    parser.add_argument('--dir', default=BACKUP_DIR)
+    parser.add_argument('--db', default=database.DB_PATH)
+    parser.add_argument('--keep', type=int, default=BACKUP_KEEP)
+    parser.add_argument('--checkpoint', choices=CHECKPOINT_MODES, default=None)
+    args = parser.parse_args()
+
+    if args.command in ('verify', 'restore') and not args.path:
+        parser.error("укажите файл копии")
+
+    database.set_db_path(args.db)
+    if args.command == 'create':
+        print(create_backup(args.dir, args.keep, args.checkpoint or ''))
+        database.close_connections()
+    elif args.command == 'list':
+        for path in list_backups(args.dir):
+            print(f"{path}\t{os.path.getsize(path) // 1024} КБ")
+    elif args.command == 'verify':
+        ok, result = verify_backup(args.path)
+        print(f"{'✅' if ok else '❌'} {args.path}: {result}")
+        raise SystemExit(0 if ok else 1)
+    else:
+        saved = restore_backup(args.path, args.db, args.dir)
+        print(f"БД {args.db} восстановлена из {args.path}; прежняя БД сохранена в {saved}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Бенчмарк групповой фиксации записей.
+
+Имитирует открытие записи: requests одновременных запросов на запись в прачечную
+и комнату отдыха (часть — на один и тот же слот), и сравнивает пропускную способность
+писателя без групповой фиксации и с ней.
+
+Использование:
+    python bench_group_commit.py [--requests 500] [--days 30] [--window-ms 5] [--db bench.db [--force]]
+
+БД по умолчанию создается в текущем каталоге, чтобы fsync шел на настоящий диск.
+Существующий файл БД перезаписывается только с --force, после прогона файл удаляется.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import timedelta
+
+import clock
+import database
+from database import (
+    init_db,
+    create_laundry_booking,
+    create_restroom_booking,
+    get_available_machines,
+    get_laundry_slot_times,
+    write_async
+)
+from utils import time_to_minutes, minutes_to_time
+
+
+def make_requests(count: int, days: int, rng: random.Random):
+    """Пачка запросов: 3/4 в прачечную, 1/4 в комнату отдыха; слоты пересекаются, чтобы были конфликты"""
+    machines = get_available_machines()
+    first_day = clock.today() + timedelta(days=1)
+    requests = []
+    for user_id in range(1, count + 1):
+        day = first_day + timedelta(days=rng.randrange(days))
+        booking_date = day.strftime('%Y-%m-%d')
+        if rng.random() < 0.75:
+            start_time = rng.choice(get_laundry_slot_times(day))
+            end_time = minutes_to_time(time_to_minutes(start_time) + 120)
+            requests.append((create_laundry_booking, (user_id, rng.choice(machines), booking_date, start_time, end_time)))
+        else:
+            start = rng.randrange(8 * 60, 22 * 60, 30)
+            requests.append((create_restroom_booking,
+                             (user_id, booking_date, minutes_to_time(start), minutes_to_time(start + 30), 30)))
+    return requests
+
+
+async def burst(requests):
+    return await asyncio.gather(*(write_async(func, *args) for func, args in requests))
+
+
+def run(db_path: str, requests, window: float):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    database.GROUP_COMMIT_WINDOW_SECONDS = window
+    database.set_db_path(db_path)
+    init_db()
+
+    started = time.perf_counter()
+    results = asyncio.run(burst(requests))
+    elapsed = time.perf_counter() - started
+
+    # Счетчики читаем после остановки писателя: результаты отдаются раньше, чем он их обновляет
+    writer = database.get_writer()
+    database.close_connections()
+    batches, jobs = writer.batches, writer.jobs
+    return elapsed, sum(1 for result in results if result), batches, jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк групповой фиксации записей")
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--days', type=int, default=30, help="На сколько дней вперед распределены запросы")
+    parser.add_argument('--window-ms', type=float, default=5.0)
+    parser.add_argument('--db', default='bench_group_commit.db')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help="Перезаписать существующий файл --db")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db) and not args.force:
+        parser.error(f"файл {args.db} уже существует; укажите другой --db или --force, чтобы перезаписать его")
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+    # Для генерации запросов нужна инициализированная БД с машинками и правилами расписания
+    database.set_db_path(args.db)
+    init_db()
+    requests = make_requests(args.requests, args.days, random.Random(args.seed))
+    database.close_connections()
+
+    print(f"{args.requests} одновременных запросов на запись, БД {args.db}\n")
+    baseline = None
+    for title, window in (("Без групповой фиксации", 0.0), (f"Групповая фиксация, окно {args.window_ms:g} мс",
+                                                          args.window_ms / 1000)):
+        elapsed, booked, batches, jobs = run(args.db, requests, window)
+        throughput = jobs / elapsed
+        baseline = baseline or throughput
+        print(f"{title}:")
+        print(f"  {elapsed * 1000:.0f} мс, {throughput:.0f} записей/с ({throughput / baseline:.1f}×)")
+        print(f"  транзакций: {batches}, создано записей: {booked}, отклонено (конфликт/лимит): {jobs - booked}\n")
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+
+if __name__ == '__main__':
+    main()
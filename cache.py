@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Признак отсутствия значения в кэше (None — допустимое значение)
+MISSING = object()
+
+
+class SessionCache:
+    """
+    Ограниченный LRU-кэш данных пользователя: права администратора, признак
+    известного пользователя и список ближайших записей.
+
+    Записи устаревают через ttl_seconds, чтобы подхватывать изменения,
+    сделанные в БД напрямую (например, назначение администратора).
+
+    Кэш читают обработчики в цикле событий, а сбрасывает поток-писатель после фиксации,
+    поэтому все операции выполняются под блокировкой.
+    """
+
+    def __init__(self, max_users: int = 1000, ttl_seconds: int = 300):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._created: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, key: str) -> Any:
+        """Возвращает значение из кэша или MISSING"""
+        with self._lock:
+            session = self._session(user_id)
+            if session is None:
+                return MISSING
+            return session.get(key, MISSING)
+
+    def set(self, user_id: int, key: str, value: Any):
+        """Сохраняет значение в сессию пользователя"""
+        with self._lock:
+            session = self._session(user_id)
+            if session is None:
+                session = {}
+                self._sessions[user_id] = session
+                self._created[user_id] = time.monotonic()
+                while len(self._sessions) > self.max_users:
+                    evicted, _ = self._sessions.popitem(last=False)
+                    self._created.pop(evicted, None)
+            session[key] = value
+
+    def invalidate(self, user_id: int, *keys: str):
+        """Сбрасывает указанные ключи сессии пользователя (или всю сессию)"""
+        with self._lock:
+            if not keys:
+                self._drop(user_id)
+                return
+            session = self._sessions.get(user_id)
+            if session is not None:
+                for key in keys:
+                    session.pop(key, None)
+
+    def clear(self):
+        """Полностью очищает кэш"""
+        with self._lock:
+            self._sessions.clear()
+            self._created.clear()
+
+    def _drop(self, user_id: int):
+        self._sessions.pop(user_id, None)
+        self._created.pop(user_id, None)
+
+    def _session(self, user_id: int) -> Optional[Dict[str, Any]]:
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        if time.monotonic() - self._created[user_id] > self.ttl_seconds:
+            self._drop(user_id)
+            return None
+        self._sessions.move_to_end(user_id)
+        return session
+
+
+session_cache = SessionCache()
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from datetime import date, datetime, timedelta
+
+
+class SystemClock:
+    """Реальное время"""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class SimulatedClock:
+    """
+    Ускоренное время для симуляции.
+
+    Начинает отсчет с start и идет в speed раз быстрее реального; sleep() ждет
+    соответственно меньше. advance() сдвигает время вручную.
+    """
+
+    def __init__(self, start: datetime, speed: float = 1000.0):
+        self.start = start
+        self.speed = speed
+        self._origin = time.monotonic()
+        self._offset = timedelta(0)
+
+    def now(self) -> datetime:
+        elapsed = (time.monotonic() - self._origin) * self.speed
+        return self.start + timedelta(seconds=elapsed) + self._offset
+
+    def advance(self, delta: timedelta):
+        self._offset += delta
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds / self.speed)
+
+
+_clock = SystemClock()
+
+
+def get_clock():
+    """Возвращает текущие часы бота"""
+    return _clock
+
+
+def set_clock(new_clock):
+    """Подменяет часы (симуляция, отладка); возвращает предыдущие"""
+    global _clock
+    previous, _clock = _clock, new_clock
+    return previous
+
+
+def now() -> datetime:
+    """Текущие дата и время по часам бота"""
+    return _clock.now()
+
+
+def today() -> date:
+    """Текущая дата по часам бота"""
+    return _clock.now().date()
+
+
+async def sleep(seconds: float):
+    """Пауза длительностью seconds по часам бота"""
+    await _clock.sleep(seconds)
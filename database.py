@@ -1,23 +1,188 @@
+import os
+import json
 import sqlite3
 import hashlib
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple, Optional, Union
-from contextlib import closing
+from typing import Callable, List, Dict, Tuple, Optional, Union, Iterator
+from contextlib import closing, contextmanager
+from functools import wraps
 import logging
 
+import clock
+from cache import MISSING, session_cache
+from db_access import ReadConnectionPool, WriterThread
+from schedule import (
+    ADMISSION_FIFO,
+    RULE_BREAK,
+    RULE_HOURS,
+    LAUNDRY_SLOT_MINUTES,
+    OCCUPANCY_STEP_MINUTES,
+    BookingWindow,
+    ScheduleRule,
+    SlotTemplateCache,
+    free_slot_starts,
+    occupied_steps
+)
+from tracing import trace_span, traced
+from utils import (
+    RESTROOM_RESOURCE,
+    get_nearest_available_time,
+    date_to_day_number,
+    date_str_to_day_number,
+    day_number_to_date,
+    day_number_to_str,
+    laundry_resource,
+    to_minute_stamp
+)
+
 # Настройки прачечной
 LAUNDRY_MIN_BOOKING_HOURS = 2  # Минимальное время бронирования
 logger = logging.getLogger(__name__)
 
+# Путь к файлу БД (для симуляции и тестов указывается отдельная база)
+DB_PATH = os.getenv('DORM_BOT_DB', 'dorm_bot.db')
+
+# Размер пула соединений для чтения
+READ_POOL_SIZE = 4
+
+# Окно групповой фиксации записей при всплеске (0 — каждая запись в своей транзакции)
+GROUP_COMMIT_WINDOW_SECONDS = float(os.getenv('DORM_BOT_GROUP_COMMIT_MS', '5')) / 1000
+
+# Обработчик трассировки SQL-запросов, подключаемый к каждому соединению
+_trace_callback = None
+
+# Пул читающих соединений и поток-писатель создаются при первом обращении
+_read_pool: Optional[ReadConnectionPool] = None
+_writer: Optional[WriterThread] = None
+
+
+def set_db_path(path: str):
+    """Переключает бота на другой файл БД"""
+    global DB_PATH
+    close_connections()
+    DB_PATH = path
+    session_cache.clear()
+    slot_templates.invalidate()
+
+
+def set_trace_callback(callback):
+    """Устанавливает обработчик, вызываемый для каждого выполняемого SQL-запроса (None — отключить)"""
+    global _trace_callback
+    close_connections()
+    _trace_callback = callback
+
 
 def get_db_connection():
     """Создает и возвращает соединение с базой данных"""
-    conn = sqlite3.connect('dorm_bot.db', timeout=30)
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    if _trace_callback is not None:
+        conn.set_trace_callback(_trace_callback)
     conn.execute('PRAGMA journal_mode=WAL')
     conn.execute('PRAGMA busy_timeout=30000')
     return conn
 
 
+def get_read_pool() -> ReadConnectionPool:
+    global _read_pool
+    if _read_pool is None:
+        _read_pool = ReadConnectionPool(get_db_connection, READ_POOL_SIZE)
+    return _read_pool
+
+
+def get_writer() -> WriterThread:
+    global _writer
+    if _writer is None:
+        _writer = WriterThread(get_db_connection, GROUP_COMMIT_WINDOW_SECONDS)
+    return _writer
+
+
+def close_connections():
+    """Останавливает поток-писатель и закрывает соединения пула"""
+    global _read_pool, _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+    if _read_pool is not None:
+        _read_pool.close()
+        _read_pool = None
+
+
+@contextmanager
+def read_connection() -> Iterator[sqlite3.Connection]:
+    """Соединение только для чтения из пула"""
+    with get_read_pool().connection() as conn:
+        yield conn
+
+
+@contextmanager
+def write_connection() -> Iterator[sqlite3.Connection]:
+    """Пишущее соединение потока-писателя; фиксацией транзакции управляет писатель"""
+    yield get_writer().connection()
+
+
+@contextmanager
+def savepoint(conn: sqlite3.Connection, name: str = 'booking') -> Iterator[None]:
+    """Вложенная транзакция: при исключении откатываются только изменения внутри блока"""
+    conn.execute(f'SAVEPOINT {name}')
+    try:
+        yield
+    except BaseException:
+        conn.execute(f'ROLLBACK TO {name}')
+        conn.execute(f'RELEASE {name}')
+        raise
+    conn.execute(f'RELEASE {name}')
+
+
+async def write_async(func, *args, **kwargs):
+    """
+    Выполняет функцию записи, не блокируя цикл событий.
+
+    Одновременные вызовы (например, при открытии записи) фиксируются писателем одной транзакцией.
+    """
+    with trace_span(f"db.{func.__name__}"):
+        return await get_writer().submit_async(func, *args, **kwargs)
+
+
+def invalidate_session(user_id: int):
+    """Сбрасывает кэш сессии пользователя после фиксации текущей транзакции писателя"""
+    get_writer().after_commit(lambda: session_cache.invalidate(user_id))
+
+
+# Чтения из обработчиков записываются отрезками трассы обновления db.<функция>
+traced_read = traced('db')
+
+
+def serialized_write(func):
+    """Выполняет функцию, изменяющую БД, в потоке-писателе (изменения идут строго по очереди)"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # В потоке-писателе трассы нет, поэтому отрезок включает и ожидание в очереди
+        with trace_span(f"db.{func.__name__}"):
+            return get_writer().submit(func, *args, **kwargs)
+    return wrapper
+
+
+# Начальные настройки системы: (название, значение, описание); настройки без значения не создаются
+DEFAULT_SETTINGS = [
+    ('laundry_open', '08:00', 'Обычное время открытия'),
+    ('laundry_close', '23:00', 'Обычное время закрытия'),
+    ('laundry_break_start', None, 'Начало перерыва (обычные дни)'),
+    ('laundry_break_end', None, 'Конец перерыва (обычные дни)'),
+    ('wednesday_start', '08:00', 'Время открытия в среду'),
+    ('wednesday_break_start', '10:00', 'Начало перерыва в среду'),
+    ('wednesday_break_end', '13:00', 'Конец перерыва в среду'),
+    ('waitlist_claim_minutes', '15', 'Время на подтверждение слота из листа ожидания (мин)'),
+    ('laundry_notification_minutes', '30', 'Уведомление перед стиркой (мин)'),
+    ('restroom_notification_minutes', '15', 'Уведомление перед комнатой отдыха (мин)'),
+    ('laundry_grace_period', '15', 'Грейс-период прачечной (мин)'),
+    ('restroom_max_weekly_minutes', '240', 'Недельный лимит комнаты отдыха (мин)'),
+    ('booking_window_days', '0', 'За сколько дней открывается запись в прачечную (0 — без ограничения)'),
+    ('booking_window_open_time', '20:00', 'Время открытия записи'),
+    ('admission_mode', 'fifo', 'Порядок очереди при открытии записи (fifo или lottery)'),
+    ('admission_window_seconds', '10', 'Сколько секунд после открытия запросы собираются в очередь')
+]
+
+
 def init_db():
     """Инициализирует базу данных и создает таблицы, если они не существуют"""
     with closing(get_db_connection()) as conn:
@@ -44,9 +209,34 @@ def init_db():
                     end_time TEXT,
                     status TEXT DEFAULT 'active',
                     notified INTEGER DEFAULT 0,
+                    checked_in INTEGER DEFAULT 0,
+                    day_number INTEGER,
+                    start_min INTEGER,
+                    end_min INTEGER,
+                    idempotency_key TEXT,
                     FOREIGN KEY (user_id) REFERENCES users (user_id)
                 )
             ''')
+            add_column_if_missing(cursor, 'laundry_bookings', 'checked_in', 'INTEGER DEFAULT 0')
+            add_column_if_missing(cursor, 'laundry_bookings', 'idempotency_key', 'TEXT')
+            migrate_booking_time_columns(cursor, 'laundry_bookings')
+
+            # Все проверки доступности выполняются по целочисленным дню и минутам
+            cursor.execute('DROP INDEX IF EXISTS idx_laundry_bookings_date_machine')
+            cursor.execute('DROP INDEX IF EXISTS idx_laundry_bookings_status_start')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_laundry_bookings_day_machine
+                ON laundry_bookings (day_number, machine_number, start_min)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_laundry_bookings_status_day
+                ON laundry_bookings (status, day_number, start_min)
+            ''')
+            # Ключ идемпотентности: повторный запрос на создание не создает вторую запись
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_laundry_bookings_idempotency
+                ON laundry_bookings (idempotency_key) WHERE idempotency_key IS NOT NULL
+            ''')
 
             # Таблица статусов машинок
             cursor.execute('''
@@ -68,9 +258,25 @@ def init_db():
                     status TEXT DEFAULT 'active',
                     notified INTEGER DEFAULT 0,
                     created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    day_number INTEGER,
+                    start_min INTEGER,
+                    end_min INTEGER,
+                    idempotency_key TEXT,
                     FOREIGN KEY (user_id) REFERENCES users (user_id)
                 )
             ''')
+            add_column_if_missing(cursor, 'restroom_bookings', 'idempotency_key', 'TEXT')
+            migrate_booking_time_columns(cursor, 'restroom_bookings')
+
+            cursor.execute('DROP INDEX IF EXISTS idx_restroom_bookings_date')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_restroom_bookings_day
+                ON restroom_bookings (day_number, start_min)
+            ''')
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_restroom_bookings_idempotency
+                ON restroom_bookings (idempotency_key) WHERE idempotency_key IS NOT NULL
+            ''')
 
             # Таблица недельных лимитов
             cursor.execute('''
@@ -94,13 +300,96 @@ def init_db():
                 )
             ''')
 
-            # Таблица слотов комнаты отдыха
+            # Почасовая загрузка ресурсов (машинок и комнаты отдыха) по дням
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS restroom_slots (
-                    slot_time TEXT PRIMARY KEY,
-                    is_available INTEGER DEFAULT 1
+                CREATE TABLE IF NOT EXISTS utilization_rollup (
+                    resource TEXT NOT NULL,
+                    booking_date TEXT NOT NULL,
+                    weekday INTEGER NOT NULL,
+                    hour INTEGER NOT NULL,
+                    booked_minutes INTEGER DEFAULT 0,
+                    bookings INTEGER DEFAULT 0,
+                    PRIMARY KEY (resource, booking_date, hour)
                 )
             ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_utilization_rollup_weekday
+                ON utilization_rollup (resource, weekday, hour)
+            ''')
+
+            # Занятость слотов по датам: машинки прачечной и комната отдыха (machine_number = 0),
+            # запись занимает все 30-минутные шаги своего интервала
+            cursor.execute('DROP TABLE IF EXISTS restroom_slots')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS slot_occupancy (
+                    booking_type TEXT NOT NULL,
+                    day_number INTEGER NOT NULL,
+                    machine_number INTEGER NOT NULL,
+                    slot_min INTEGER NOT NULL,
+                    booking_id INTEGER NOT NULL,
+                    PRIMARY KEY (booking_type, day_number, machine_number, slot_min)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('SELECT 1 FROM slot_occupancy LIMIT 1')
+            if not cursor.fetchone() or laundry_occupancy_outdated(cursor):
+                cursor.execute('DELETE FROM slot_occupancy')
+                fill_slot_occupancy(cursor)
+
+            # Таблица листа ожидания прачечной
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS laundry_waitlist (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    machine_number INTEGER NOT NULL,
+                    booking_date TEXT NOT NULL,
+                    start_time TEXT NOT NULL,
+                    status TEXT DEFAULT 'waiting',
+                    offered_at TEXT,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_laundry_waitlist_slot
+                ON laundry_waitlist (booking_date, machine_number, start_time)
+            ''')
+
+            # Правила расписания прачечной: часы работы, перерывы и закрытия
+            # по дням недели, конкретным датам или на каждый день
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schedule_rules (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    rule_type TEXT NOT NULL,
+                    weekday INTEGER,
+                    rule_date TEXT,
+                    start_min INTEGER,
+                    end_min INTEGER,
+                    description TEXT,
+                    legacy_key TEXT UNIQUE
+                )
+            ''')
+
+            # Исходящие уведомления: пишутся в той же транзакции, что и изменение записи,
+            # и доставляются фоновым рассыльщиком (outbox.py) с повторами
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    buttons TEXT,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at TEXT NOT NULL,
+                    sent_at TEXT
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_outbox_status_next
+                ON outbox (status, next_attempt_at)
+            ''')
 
             # Инициализация машинок
             for machine in [1, 2, 3]:
@@ -109,31 +398,55 @@ def init_db():
                     VALUES (?, ?)
                 ''', (machine, 'active'))
 
-            # Инициализация слотов комнаты отдыха
-            for hour in range(8, 23):
-                for minute in [0, 30]:
-                    slot_time = f"{hour:02d}:{minute:02d}"
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO restroom_slots (slot_time)
-                        VALUES (?)
-                    ''', (slot_time,))
 
             # Начальные настройки системы
-            default_settings = [
-                ('laundry_open', '08:00', 'Обычное время открытия'),
-                ('laundry_close', '23:00', 'Обычное время закрытия'),
-                ('laundry_break_start', None, 'Начало перерыва (обычные дни)'),
-                ('laundry_break_end', None, 'Конец перерыва (обычные дни)'),
-                ('wednesday_start', '08:00', 'Время открытия в среду'),
-                ('wednesday_break_start', '10:00', 'Начало перерыва в среду'),
-                ('wednesday_break_end', '13:00', 'Конец перерыва в среду')
-            ]
-
             cursor.executemany('''
                 INSERT OR IGNORE INTO schedule_settings 
                 (setting_name, setting_value, description)
                 VALUES (?, ?, ?)
-            ''', default_settings)
+            ''', DEFAULT_SETTINGS)
+
+            seed_schedule_rules(cursor)
+
+    slot_templates.invalidate()
+
+
+def add_column_if_missing(cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+    """Добавляет столбец в существующую таблицу (миграция старых БД)"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def migrate_booking_time_columns(cursor: sqlite3.Cursor, table: str):
+    """Добавляет целочисленные столбцы дня и минут и заполняет их по текстовым дате и времени"""
+    for column in ('day_number', 'start_min', 'end_min'):
+        add_column_if_missing(cursor, table, column, 'INTEGER')
+
+    cursor.execute(f'SELECT id, booking_date, start_time, end_time FROM {table} WHERE day_number IS NULL')
+    cursor.executemany(
+        f'UPDATE {table} SET day_number = ?, start_min = ?, end_min = ? WHERE id = ?',
+        [(*booking_time_values(booking_date, start_time, end_time), booking_id)
+         for booking_id, booking_date, start_time, end_time in cursor.fetchall()]
+    )
+
+
+def booking_time_values(booking_date: str, start_time: str, end_time: str) -> Tuple[int, int, int]:
+    """Возвращает (номер дня, минута начала, минута окончания) для записи"""
+    return date_str_to_day_number(booking_date), time_to_minutes(start_time), time_to_minutes(end_time)
+
+
+def slot_started(day_number: int, start_min: int) -> bool:
+    """Начался ли слот: такой слот не показывается, не предлагается и не занимается из листа ожидания"""
+    return day_number * 1440 + start_min <= to_minute_stamp(clock.now())
+
+
+def booking_exists_for_key(cursor: sqlite3.Cursor, table: str, idempotency_key: Optional[str]) -> bool:
+    """Проверяет, создана ли уже запись по этому ключу идемпотентности"""
+    if idempotency_key is None:
+        return False
+    cursor.execute(f'SELECT 1 FROM {table} WHERE idempotency_key = ?', (idempotency_key,))
+    return cursor.fetchone() is not None
 
 
 def hash_username(username: str) -> str:
@@ -141,363 +454,1707 @@ def hash_username(username: str) -> str:
     return hashlib.sha256(username.encode()).hexdigest() if username else ''
 
 
+@traced_read
 def is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT is_admin FROM users WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            return result and result[0] == 1 if result else False
+    cached = session_cache.get(user_id, 'is_admin')
+    if cached is not MISSING:
+        return cached
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT is_admin FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        admin = bool(result and result[0] == 1)
 
+    session_cache.set(user_id, 'is_admin', admin)
+    return admin
 
-def get_current_week() -> Tuple[int, int]:
-    """Возвращает текущую неделю и год"""
-    today = datetime.now()
-    year, week, _ = today.isocalendar()
+
+def booking_week(day_number: int) -> Tuple[int, int]:
+    """Неделя и год ISO даты записи: по ним ведется недельный лимит комнаты отдыха"""
+    year, week, _ = day_number_to_date(day_number).isocalendar()
     return week, year
 
 
-def get_laundry_schedule(date: datetime) -> Dict[str, str]:
-    """Возвращает расписание прачечной с учетом дня недели и перерывов"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT setting_name, setting_value FROM schedule_settings')
-            settings = {row[0]: row[1] for row in cursor.fetchall()}
-
-    base_schedule = {
-        'open': settings.get('laundry_open', '08:00'),
-        'close': settings.get('laundry_close', '23:00'),
-        'break_start': settings.get('laundry_break_start'),
-        'break_end': settings.get('laundry_break_end')
-    }
+# Связь старых настроек расписания с правилами: настройка -> (ключ правила, поле)
+LEGACY_SCHEDULE_SETTINGS = {
+    'laundry_open': ('default_hours', 'start_min'),
+    'laundry_close': ('default_hours', 'end_min'),
+    'laundry_break_start': ('default_break', 'start_min'),
+    'laundry_break_end': ('default_break', 'end_min'),
+    'wednesday_start': ('wednesday_hours', 'start_min'),
+    'wednesday_break_start': ('wednesday_break', 'start_min'),
+    'wednesday_break_end': ('wednesday_break', 'end_min')
+}
 
-    # Особое расписание для среды
-    if date.weekday() == 2:  # Среда
-        wednesday_schedule = {
-            'open': settings.get('wednesday_start', '08:00'),
-            'close': base_schedule['close'],
-            'break_start': settings.get('wednesday_break_start', '10:00'),
-            'break_end': settings.get('wednesday_break_end', '13:00')
-        }
-        return wednesday_schedule
 
-    return base_schedule
+def default_schedule_rule_rows(settings: Dict[str, str]) -> List[Tuple]:
+    """
+    Правила расписания по старым настройкам (обычные часы, перерыв и особая среда):
+    (тип, день недели, начало, конец, описание, ключ настройки)
+    """
+    def minutes(name: str, default: Optional[str]) -> Optional[int]:
+        value = settings.get(name, default)
+        return time_to_minutes(value) if value else None
+
+    return [
+        (RULE_HOURS, None, minutes('laundry_open', '08:00'), minutes('laundry_close', '23:00'),
+         'Обычные часы работы', 'default_hours'),
+        (RULE_BREAK, None, minutes('laundry_break_start', None), minutes('laundry_break_end', None),
+         'Обычный перерыв', 'default_break'),
+        (RULE_HOURS, 2, minutes('wednesday_start', '08:00'), None,
+         'Открытие в среду', 'wednesday_hours'),
+        (RULE_BREAK, 2, minutes('wednesday_break_start', '10:00'), minutes('wednesday_break_end', '13:00'),
+         'Перерыв в среду', 'wednesday_break')
+    ]
+
+
+def seed_schedule_rules(cursor: sqlite3.Cursor):
+    """Создает правила расписания из старых настроек (обычные часы, перерыв и особая среда)"""
+    cursor.execute('SELECT COUNT(*) FROM schedule_rules')
+    if cursor.fetchone()[0]:
+        return
+
+    cursor.execute('SELECT setting_name, setting_value FROM schedule_settings')
+    settings = {row[0]: row[1] for row in cursor.fetchall()}
+
+    cursor.executemany('''
+        INSERT INTO schedule_rules (rule_type, weekday, start_min, end_min, description, legacy_key)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', default_schedule_rule_rows(settings))
+
+
+@traced_read
+def get_schedule_rules() -> List[ScheduleRule]:
+    """Возвращает все правила расписания прачечной"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, rule_type, weekday, rule_date, start_min, end_min, description
+            FROM schedule_rules
+            ORDER BY rule_date IS NULL, rule_date, weekday IS NOT NULL, weekday, rule_type, start_min
+        ''')
+        return [ScheduleRule(*row) for row in cursor.fetchall()]
+
+
+# Скомпилированные шаблоны слотов по датам; сбрасываются при изменении правил
+slot_templates = SlotTemplateCache(get_schedule_rules)
+
+
+@serialized_write
+def add_schedule_rule(rule_type: str, weekday: Optional[int] = None, rule_date: Optional[str] = None,
+                      start_min: Optional[int] = None, end_min: Optional[int] = None,
+                      description: Optional[str] = None) -> bool:
+    """Добавляет правило расписания (часы работы, перерыв или закрытие)"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                INSERT INTO schedule_rules (rule_type, weekday, rule_date, start_min, end_min, description)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (rule_type, weekday, rule_date, start_min, end_min, description))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка добавления правила расписания: {e}")
+            return False
+
+    get_writer().after_commit(slot_templates.invalidate)
+    return True
+
+
+@serialized_write
+def delete_schedule_rule(rule_id: int) -> bool:
+    """Удаляет правило расписания"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM schedule_rules WHERE id = ?', (rule_id,))
+        deleted = cursor.rowcount > 0
+
+    get_writer().after_commit(slot_templates.invalidate)
+    return deleted
+
+
+def as_day(value: datetime):
+    """Приводит datetime к date, чтобы даты одинаково использовались как ключи кэша"""
+    return value.date() if isinstance(value, datetime) else value
+
+
+def get_laundry_slot_template(date: datetime) -> Tuple[int, ...]:
+    """Возвращает скомпилированный шаблон слотов даты (минуты начала 2-часовых слотов)"""
+    return slot_templates.template(as_day(date))
+
+
+def get_laundry_schedule(date: datetime) -> Dict[str, Union[bool, str, None, List[Tuple[str, str]]]]:
+    """Возвращает расписание прачечной с учетом дня недели, перерывов и исключений"""
+    schedule = slot_templates.schedule(as_day(date))
+    breaks = [(minutes_to_time(start), minutes_to_time(end)) for start, end in schedule.breaks]
+    return {
+        'closed': schedule.closed,
+        'open': minutes_to_time(schedule.open_min),
+        'close': minutes_to_time(schedule.close_min),
+        'break_start': breaks[0][0] if breaks else None,
+        'break_end': breaks[0][1] if breaks else None,
+        'breaks': breaks
+    }
 
 
+@serialized_write
 def update_schedule_settings(setting_name: str, value: str) -> bool:
-    """Обновляет настройки расписания"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute('''
-                    INSERT INTO schedule_settings (setting_name, setting_value)
-                    VALUES (?, ?)
-                    ON CONFLICT(setting_name) DO UPDATE SET setting_value = excluded.setting_value
-                ''', (setting_name, value))
-                return True
-            except sqlite3.Error:
-                return False
-
+    """Обновляет настройки расписания и соответствующее им правило"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if setting_name in LEGACY_SCHEDULE_SETTINGS:
+                legacy_key, field = LEGACY_SCHEDULE_SETTINGS[setting_name]
+                cursor.execute(
+                    f'UPDATE schedule_rules SET {field} = ? WHERE legacy_key = ?',
+                    (time_to_minutes(value) if value else None, legacy_key)
+                )
+                get_writer().after_commit(slot_templates.invalidate)
 
-def check_user_daily_bookings(user_id: int, date: str) -> bool:
-    """Проверяет, что у пользователя не более 2 записей в день"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
             cursor.execute('''
-                SELECT COUNT(*) FROM laundry_bookings 
-                WHERE user_id = ? AND booking_date = ? AND status = 'active'
-            ''', (user_id, date))
-            count = cursor.fetchone()[0]
-            return count < 2
+                INSERT INTO schedule_settings (setting_name, setting_value)
+                VALUES (?, ?)
+                ON CONFLICT(setting_name) DO UPDATE SET setting_value = excluded.setting_value
+            ''', (setting_name, value))
+            return True
+        except sqlite3.Error:
+            return False
 
 
+@traced_read
+def check_user_daily_bookings(user_id: int, date: str) -> bool:
+    """Проверяет, что у пользователя не более 2 записей в день"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) FROM laundry_bookings 
+            WHERE user_id = ? AND day_number = ? AND status = 'active'
+        ''', (user_id, date_str_to_day_number(date)))
+        count = cursor.fetchone()[0]
+        return count < 2
+
+
+@traced_read
+def get_laundry_booking_counts(date: str) -> Dict[int, int]:
+    """Число активных записей каждого пользователя на дату: {user_id: записей}"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id, COUNT(*) FROM laundry_bookings
+            WHERE day_number = ? AND status = 'active'
+            GROUP BY user_id
+        ''', (date_str_to_day_number(date),))
+        return dict(cursor.fetchall())
+
+
+def get_laundry_slot_times(date: datetime) -> List[str]:
+    """Возвращает все 2-часовые слоты дня с учетом расписания и перерывов (без учета записей)"""
+    return [minutes_to_time(slot) for slot in get_laundry_slot_template(date)]
+
+
+@traced_read
 def get_available_laundry_slots(date: datetime, machine_number: int) -> List[str]:
-    """Возвращает доступные 2-часовые слоты с учетом расписания и перерывов"""
-    schedule = get_laundry_schedule(date)
-    open_time = time_to_minutes(schedule['open'])
-    close_time = time_to_minutes(schedule['close'])
-    break_start = time_to_minutes(schedule['break_start']) if schedule['break_start'] else None
-    break_end = time_to_minutes(schedule['break_end']) if schedule['break_end'] else None
+    """Возвращает доступные 2-часовые слоты с учетом расписания и перерывов (уже начавшиеся не входят)"""
+    day_number = date_to_day_number(date)
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT slot_min FROM slot_occupancy
+            WHERE booking_type = 'laundry' AND day_number = ? AND machine_number = ?
+        ''', (day_number, machine_number))
+        booked_slots = {row[0] for row in cursor.fetchall()}
+
+    return [
+        minutes_to_time(slot) for slot in free_slot_starts(get_laundry_slot_template(date), booked_slots)
+        if not slot_started(day_number, slot)
+    ]
+
+
+@traced_read
+def find_nearest_laundry_slot(days: int = 7) -> Optional[Dict[str, Union[int, str]]]:
+    """
+    Находит ближайший свободный слот прачечной среди всех активных машинок на days дней вперед.
 
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            date_str = date.strftime('%Y-%m-%d')
-            cursor.execute('''
-                SELECT start_time FROM laundry_bookings 
-                WHERE booking_date = ? AND status = 'active' AND machine_number = ?
-            ''', (date_str, machine_number))
-            booked_slots = [time_to_minutes(row[0]) for row in cursor.fetchall()]
+    Занятые слоты периода читаются одним запросом по первичному ключу, поиск выполняется в памяти.
+    """
+    now = clock.now()
+    first_date = now.date()
+    last_date = first_date + timedelta(days=days - 1)
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT machine_number FROM laundry_machines WHERE status = "active" ORDER BY machine_number')
+        machines = [row[0] for row in cursor.fetchall()]
+
+        booked = get_occupied_slots(cursor, 'laundry', date_to_day_number(first_date), date_to_day_number(last_date))
+
+    window = get_booking_window()
+    now_minutes = now.hour * 60 + now.minute
+    for offset in range(days):
+        date = first_date + timedelta(days=offset)
+        if not window.is_open(date, now):
+            break
+        day_number = date_to_day_number(date)
+        slots = get_laundry_slot_template(date)
+        if offset == 0:
+            slots = [slot for slot in slots if slot > now_minutes]
+
+        best = None
+        for machine_number in machines:
+            free = free_slot_starts(slots, booked.get((day_number, machine_number), set()))
+            slot = free[0] if free else None
+            if slot is not None and (best is None or slot < best[1]):
+                best = (machine_number, slot)
+
+        if best:
+            return {
+                'machine_number': best[0],
+                'booking_date': date.strftime('%Y-%m-%d'),
+                'start_time': minutes_to_time(best[1]),
+                'end_time': minutes_to_time(best[1] + 120)
+            }
+
+    return None
+
+
+@traced_read
+def get_available_machines() -> List[int]:
+    """Возвращает список доступных машинок"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT machine_number FROM laundry_machines WHERE status = "active"')
+        return [row[0] for row in cursor.fetchall()]
 
-    available_slots = []
-    current_time = open_time
 
-    while current_time + 120 <= close_time:  # 120 минут = 2 часа
-        # Проверяем, что слот не в перерыве
-        if not (break_start and break_end and break_start <= current_time < break_end):
-            if current_time not in booked_slots:
-                available_slots.append(minutes_to_time(current_time))
-        current_time += 120  # Шаг 2 часа
+@traced_read
+def get_booked_laundry_slots(date: datetime) -> Dict[int, set]:
+    """Возвращает занятые 30-минутные шаги даты по машинкам одним запросом"""
+    with read_connection() as conn:
+        occupied = get_occupied_slots(conn.cursor(), 'laundry', date_to_day_number(date))
+        return {machine_number: slots for (_, machine_number), slots in occupied.items()}
 
-    return available_slots
 
+def get_booking_window() -> BookingWindow:
+    """Возвращает настройки окна открытия записи в прачечную"""
+    return booking_window_from_settings(get_all_settings())
 
-def get_available_machines() -> List[int]:
-    """Возвращает список доступных машинок"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT machine_number FROM laundry_machines WHERE status = "active"')
-            return [row[0] for row in cursor.fetchall()]
 
+def booking_window_from_settings(settings: Dict[str, str]) -> BookingWindow:
+    """Собирает окно открытия записи из словаря настроек"""
+    return BookingWindow(
+        days=int(settings.get('booking_window_days') or 0),
+        open_min=time_to_minutes(settings.get('booking_window_open_time') or '20:00'),
+        mode=settings.get('admission_mode') or ADMISSION_FIFO,
+        surge_seconds=int(settings.get('admission_window_seconds') or 0)
+    )
 
+
+@serialized_write
 def create_laundry_booking(user_id: int, machine_number: int, booking_date: str, start_time: str,
-                           end_time: str) -> bool:
-    """Создает запись в прачечную"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute('''
-                    INSERT INTO laundry_bookings 
-                    (user_id, machine_number, booking_date, start_time, end_time)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (user_id, machine_number, booking_date, start_time, end_time))
+                           end_time: str, idempotency_key: Optional[str] = None, notice: Optional[str] = None) -> bool:
+    """
+    Создает запись в прачечную.
+
+    Дневной лимит проверяется в той же транзакции, а пересечение с другой записью машинки
+    отсекается первичным ключом slot_occupancy: при групповой фиксации соседние запросы пачки уже видны,
+    поэтому двойная запись невозможна. Повтор запроса с тем же idempotency_key
+    возвращает True, не создавая вторую запись. notice — подтверждение, которое ставится
+    в очередь уведомлений вместе с записью.
+    """
+    day_number, start_min, end_min = booking_time_values(booking_date, start_time, end_time)
+
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if booking_exists_for_key(cursor, 'laundry_bookings', idempotency_key):
                 return True
-            except sqlite3.Error:
+
+            cursor.execute('''
+                SELECT COUNT(*) FROM laundry_bookings
+                WHERE user_id = ? AND day_number = ? AND status = 'active'
+            ''', (user_id, day_number))
+            if cursor.fetchone()[0] >= 2:
                 return False
 
+            with savepoint(conn):
+                cursor.execute('''
+                    INSERT INTO laundry_bookings
+                    (user_id, machine_number, booking_date, start_time, end_time, day_number, start_min, end_min,
+                     idempotency_key)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, machine_number, booking_date, start_time, end_time, day_number, start_min, end_min,
+                      idempotency_key))
+                occupy_slots(cursor, 'laundry', cursor.lastrowid, day_number, start_min, end_min, machine_number)
+            apply_utilization(cursor, laundry_resource(machine_number), booking_date, start_time, end_time, 1)
+            if notice:
+                enqueue_notification(cursor, user_id, notice, 'booking')
+            invalidate_session(user_id)
+            return True
+        except sqlite3.Error:
+            return False
+
 
+@serialized_write
+def create_recurring_laundry_bookings(user_id: int, machine_number: int, first_date: datetime,
+                                     start_time: str, weeks: int) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """
+    Создает еженедельные записи в прачечную на одно и то же время.
+
+    Расписание берется из скомпилированных шаблонов слотов, занятость всех дат проверяется
+    одним запросом, подходящие записи вставляются одной транзакцией.
+    Возвращает (созданные даты, пропущенные даты с причиной: 'past', 'schedule', 'window', 'taken', 'limit').
+    """
+    dates = [first_date + timedelta(weeks=week) for week in range(weeks)]
+    now = clock.now()
+    window = get_booking_window()
+    created = []
+    skipped = []
+
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            # Отбрасываем прошедшие даты и даты, где слот не попадает в расписание
+            candidates = []
+            for date in dates:
+                date_str = date.strftime('%Y-%m-%d')
+                if datetime.strptime(f"{date_str} {start_time}", '%Y-%m-%d %H:%M') <= now:
+                    skipped.append((date_str, 'past'))
+                elif time_to_minutes(start_time) not in get_laundry_slot_template(date):
+                    skipped.append((date_str, 'schedule'))
+                elif not window.is_open(date, now):
+                    skipped.append((date_str, 'window'))
+                else:
+                    candidates.append(date_str)
+
+            if not candidates:
+                return created, skipped
+
+            # Одним запросом находим пересекающиеся записи машинки и дневные лимиты по всем датам
+            start_min = time_to_minutes(start_time)
+            steps = occupied_steps(start_min, start_min + LAUNDRY_SLOT_MINUTES)
+            day_numbers = [date_str_to_day_number(date_str) for date_str in candidates]
+            placeholders = ','.join('?' * len(candidates))
+            cursor.execute(f'''
+                SELECT DISTINCT day_number FROM slot_occupancy
+                WHERE booking_type = 'laundry' AND day_number IN ({placeholders})
+                      AND machine_number = ? AND slot_min BETWEEN ? AND ?
+            ''', (*day_numbers, machine_number, steps[0], steps[-1]))
+            taken = {row[0] for row in cursor.fetchall()}
+            cursor.execute(f'''
+                SELECT day_number, COUNT(*) FROM laundry_bookings
+                WHERE status = 'active' AND user_id = ? AND day_number IN ({placeholders})
+                GROUP BY day_number
+            ''', (user_id, *day_numbers))
+            user_bookings = dict(cursor.fetchall())
+
+            end_time = minutes_to_time(start_min + 120)
+            rows = []
+            for date_str, day_number in zip(candidates, day_numbers):
+                if day_number in taken:
+                    skipped.append((date_str, 'taken'))
+                elif user_bookings.get(day_number, 0) >= 2:
+                    skipped.append((date_str, 'limit'))
+                else:
+                    rows.append((user_id, machine_number, date_str, start_time, end_time,
+                                 day_number, start_min, start_min + 120))
+
+            for row in rows:
+                cursor.execute('''
+                    INSERT INTO laundry_bookings
+                    (user_id, machine_number, booking_date, start_time, end_time, day_number, start_min, end_min)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', row)
+                occupy_slots(cursor, 'laundry', cursor.lastrowid, row[5], start_min, start_min + 120, machine_number)
+                apply_utilization(cursor, laundry_resource(machine_number), row[2], start_time, end_time, 1)
+            created = [row[2] for row in rows]
+            invalidate_session(user_id)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка создания регулярных записей: {e}")
+            return [], [(date.strftime('%Y-%m-%d'), 'error') for date in dates]
+
+    skipped.sort()
+    return created, skipped
+
+
+@serialized_write
 def cancel_laundry_booking(booking_id: int) -> bool:
     """Отменяет запись в прачечную с проверкой"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            try:
-                cursor = conn.cursor()
-                # Проверяем существование записи перед отменой
-                cursor.execute('SELECT id FROM laundry_bookings WHERE id = ? AND status = "active"', (booking_id,))
-                if not cursor.fetchone():
-                    return False
-
-                cursor.execute('UPDATE laundry_bookings SET status = "cancelled" WHERE id = ?', (booking_id,))
-                return cursor.rowcount > 0
-            except sqlite3.Error as e:
-                logger.error(f"Ошибка отмены записи {booking_id}: {e}")
+    with write_connection() as conn:
+        try:
+            cursor = conn.cursor()
+            # Проверяем существование записи перед отменой
+            cursor.execute('''
+                SELECT user_id, machine_number, booking_date, start_time, end_time, day_number
+                FROM laundry_bookings WHERE id = ? AND status = "active"
+            ''', (booking_id,))
+            booking = cursor.fetchone()
+            if not booking:
                 return False
 
+            cursor.execute('UPDATE laundry_bookings SET status = "cancelled" WHERE id = ?', (booking_id,))
+            user_id, machine_number, booking_date, start_time, end_time, day_number = booking
+            release_slots(cursor, 'laundry', booking_id, day_number, machine_number)
+            invalidate_session(user_id)
+            apply_utilization(cursor, laundry_resource(machine_number), booking_date, start_time, end_time, -1)
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка отмены записи {booking_id}: {e}")
+            return False
 
-def get_available_restroom_slots(date: datetime) -> List[Dict[str, str]]:
-    """Возвращает доступные слоты для комнаты отдыха"""
-    date_str = date.strftime('%Y-%m-%d')
-    available_slots = []
 
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
+@traced_read
+def get_due_reminders(booking_type: str, minutes_before: int,
+                      grace_minutes: int = 0) -> List[Dict[str, Union[int, str]]]:
+    """
+    Возвращает активные записи без отправленного напоминания, начинающиеся в ближайшие minutes_before минут
+    (или начавшиеся не более grace_minutes минут назад).
+    """
+    now = clock.now()
+    window_start = to_minute_stamp(now - timedelta(minutes=grace_minutes))
+    window_end = to_minute_stamp(now + timedelta(minutes=minutes_before))
+    table = 'laundry_bookings' if booking_type == 'laundry' else 'restroom_bookings'
+    extra = ', machine_number' if booking_type == 'laundry' else ''
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT id, user_id, booking_date, start_time, end_time{extra}
+            FROM {table}
+            WHERE status = 'active' AND notified = 0
+                  AND day_number BETWEEN ? AND ?
+                  AND day_number * 1440 + start_min > ?
+                  AND day_number * 1440 + start_min <= ?
+            ORDER BY day_number, start_min
+        ''', (window_start // 1440, window_end // 1440, window_start, window_end))
+        columns = ['id', 'user_id', 'booking_date', 'start_time', 'end_time']
+        if booking_type == 'laundry':
+            columns.append('machine_number')
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+@serialized_write
+def mark_booking_notified(booking_type: str, booking_id: int, text: Optional[str] = None,
+                          buttons: Optional[List[Tuple[str, str]]] = None) -> bool:
+    """
+    Отмечает, что напоминание о записи отправлено.
 
-            # Получаем все занятые слоты на выбранную дату
-            cursor.execute('''
-                SELECT start_time, end_time 
-                FROM restroom_bookings 
-                WHERE booking_date = ? AND status = 'active'
-                ORDER BY start_time
-            ''', (date_str,))
-            booked_slots = cursor.fetchall()
+    Текст напоминания ставится в очередь уведомлений той же транзакцией и только один раз:
+    повторная отметка уже отмеченной записи возвращает False.
+    """
+    table = 'laundry_bookings' if booking_type == 'laundry' else 'restroom_bookings'
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'UPDATE {table} SET notified = 1 WHERE id = ? AND notified = 0', (booking_id,))
+        if cursor.rowcount == 0:
+            return False
+        if text:
+            cursor.execute(f'SELECT user_id FROM {table} WHERE id = ?', (booking_id,))
+            enqueue_notification(cursor, cursor.fetchone()[0], text, 'reminder', buttons)
+        return True
+
+
+@serialized_write
+def check_in_laundry_booking(booking_id: int, user_id: int) -> bool:
+    """Подтверждает, что пользователь пришел на стирку"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE laundry_bookings SET checked_in = 1
+            WHERE id = ? AND user_id = ? AND status = 'active'
+        ''', (booking_id, user_id))
+        return cursor.rowcount > 0
+
+
+@serialized_write
+def release_no_show_laundry_bookings(grace_minutes: int, notice: Optional[Callable[[Dict], str]] = None
+                                     ) -> List[Dict[str, Union[int, str]]]:
+    """
+    Снимает записи в прачечную, не подтвержденные в течение grace_minutes после начала.
 
-            # Проверяем базовые слоты (каждые 30 минут с 8:00 до 23:00)
-            for hour in range(8, 23):
-                for minute in [0, 30]:
-                    slot_time = f"{hour:02d}:{minute:02d}"
-                    slot_dt = datetime.strptime(slot_time, '%H:%M').time()
-                    is_available = True
+    Возвращает снятые записи, чтобы освободившиеся слоты можно было предложить другим.
+    notice(запись) — текст уведомления владельцу, которое ставится в очередь той же транзакцией.
+    """
+    now = clock.now()
+    deadline = to_minute_stamp(now - timedelta(minutes=grace_minutes))
+    released = []
+
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            # Диапазон по индексу (status, day_number, start_min): просроченные записи за последние сутки
+            cursor.execute('''
+                SELECT id, user_id, machine_number, booking_date, start_time, end_time, day_number
+                FROM laundry_bookings
+                WHERE status = 'active' AND checked_in = 0
+                      AND day_number BETWEEN ? AND ?
+                      AND day_number * 1440 + start_min <= ?
+            ''', (deadline // 1440 - 1, deadline // 1440, deadline))
+
+            for booking_id, user_id, machine_number, booking_date, start_time, end_time, day_number \
+                    in cursor.fetchall():
+                cursor.execute('UPDATE laundry_bookings SET status = "no_show" WHERE id = ?', (booking_id,))
+                release_slots(cursor, 'laundry', booking_id, day_number, machine_number)
+                invalidate_session(user_id)
+                apply_utilization(cursor, laundry_resource(machine_number), booking_date, start_time, end_time, -1)
+                booking = {
+                    'id': booking_id,
+                    'user_id': user_id,
+                    'machine_number': machine_number,
+                    'booking_date': booking_date,
+                    'start_time': start_time,
+                    'end_time': end_time
+                }
+                if notice:
+                    enqueue_notification(cursor, user_id, notice(booking), 'no_show')
+                released.append(booking)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка снятия неподтвержденных записей: {e}")
+            return []
+
+    return released
+
+
+@traced_read
+def get_laundry_booking(booking_id: int) -> Optional[Dict[str, Union[int, str]]]:
+    """Возвращает запись в прачечную по ID"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, user_id, machine_number, booking_date, start_time, end_time, status
+            FROM laundry_bookings
+            WHERE id = ?
+        ''', (booking_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return dict(zip(
+            ['id', 'user_id', 'machine_number', 'booking_date', 'start_time', 'end_time', 'status'],
+            row
+        ))
+
+
+@serialized_write
+def add_to_laundry_waitlist(user_id: int, machine_number: int, booking_date: str, start_time: str) -> bool:
+    """Добавляет пользователя в лист ожидания на слот прачечной"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            # Не ставим пользователя в очередь на один слот дважды
+            cursor.execute('''
+                SELECT id FROM laundry_waitlist
+                WHERE booking_date = ? AND machine_number = ? AND start_time = ?
+                      AND user_id = ? AND status IN ('waiting', 'offered')
+            ''', (booking_date, machine_number, start_time, user_id))
+            if cursor.fetchone():
+                return True
 
-                    for booked_start, booked_end in booked_slots:
-                        start_dt = datetime.strptime(booked_start, '%H:%M').time()
-                        end_dt = datetime.strptime(booked_end, '%H:%M').time()
+            cursor.execute('''
+                INSERT INTO laundry_waitlist
+                (user_id, machine_number, booking_date, start_time)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, machine_number, booking_date, start_time))
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка добавления в лист ожидания: {e}")
+            return False
 
-                        if start_dt <= slot_dt < end_dt:
-                            is_available = False
-                            break
 
-                    if is_available:
-                        available_slots.append({
-                            'time': slot_time,
-                            'display': slot_time
-                        })
+@serialized_write
+def offer_laundry_slot_to_next_waiter(machine_number: int, booking_date: str, start_time: str,
+                                      allow_started: bool = False) -> Optional[Dict[str, Union[int, str]]]:
+    """
+    Помечает первого ожидающего (FIFO) на освободившийся слот как получившего предложение.
 
-    return available_slots
+    Возвращает запись листа ожидания или None, если слот уже начался, занят, уже предложен
+    другому пользователю или очередь пуста. allow_started — предложить остаток уже идущего
+    слота (после снятия неявки); такое предложение подтверждается до конца слота.
+    """
+    day_number = date_str_to_day_number(booking_date)
+    start_min = time_to_minutes(start_time)
+    if slot_started(day_number, start_min + LAUNDRY_SLOT_MINUTES if allow_started else start_min):
+        return None
+
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if laundry_interval_occupied(cursor, day_number, machine_number,
+                                         start_min, start_min + LAUNDRY_SLOT_MINUTES):
+                return None
 
+            cursor.execute('''
+                SELECT 1 FROM laundry_waitlist
+                WHERE booking_date = ? AND machine_number = ? AND start_time = ? AND status = 'offered'
+            ''', (booking_date, machine_number, start_time))
+            if cursor.fetchone():
+                return None
 
-def check_restroom_limit(user_id: int, duration: int) -> Tuple[bool, int]:
-    """Проверяет недельный лимит для комнаты отдыха"""
-    week, year = get_current_week()
+            cursor.execute('''
+                SELECT id, user_id FROM laundry_waitlist
+                WHERE booking_date = ? AND machine_number = ? AND start_time = ? AND status = 'waiting'
+                ORDER BY id
+                LIMIT 1
+            ''', (booking_date, machine_number, start_time))
+            row = cursor.fetchone()
+            if not row:
+                return None
 
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
             cursor.execute('''
-                SELECT setting_value FROM schedule_settings 
-                WHERE setting_name = 'restroom_max_weekly_minutes'
-            ''')
-            max_minutes = int(cursor.fetchone()[0])
+                UPDATE laundry_waitlist
+                SET status = 'offered', offered_at = ?
+                WHERE id = ?
+            ''', (clock.now().strftime('%Y-%m-%d %H:%M:%S'), row[0]))
+
+            return {
+                'id': row[0],
+                'user_id': row[1],
+                'machine_number': machine_number,
+                'booking_date': booking_date,
+                'start_time': start_time
+            }
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка выдачи слота из листа ожидания: {e}")
+            return None
+
+
+@serialized_write
+def expire_laundry_waitlist_offer(waitlist_id: int) -> Optional[Dict[str, Union[int, str]]]:
+    """Снимает неподтвержденное предложение и возвращает слот для передачи следующему"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT machine_number, booking_date, start_time FROM laundry_waitlist
+            WHERE id = ? AND status = 'offered'
+        ''', (waitlist_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        cursor.execute('UPDATE laundry_waitlist SET status = "expired" WHERE id = ?', (waitlist_id,))
+        return dict(zip(['machine_number', 'booking_date', 'start_time'], row))
+
+
+@serialized_write
+def expire_stale_laundry_waitlist_offers(claim_minutes: int) -> List[Dict[str, Union[int, str]]]:
+    """
+    Снимает предложения, не подтвержденные за claim_minutes после выдачи (по offered_at).
 
+    Работает и для предложений, выданных до перезапуска бота. Возвращает освободившиеся
+    слоты, чтобы передать их следующим в листе ожидания.
+    """
+    deadline = (clock.now() - timedelta(minutes=claim_minutes)).strftime('%Y-%m-%d %H:%M:%S')
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
             cursor.execute('''
-                SELECT used_minutes FROM restroom_limits 
-                WHERE user_id = ? AND week_number = ? AND year = ?
-            ''', (user_id, week, year))
-            result = cursor.fetchone()
-            used_minutes = result[0] if result else 0
+                SELECT id, machine_number, booking_date, start_time FROM laundry_waitlist
+                WHERE status = 'offered' AND offered_at <= ?
+                ORDER BY id
+            ''', (deadline,))
+            rows = cursor.fetchall()
+            cursor.executemany(
+                'UPDATE laundry_waitlist SET status = "expired" WHERE id = ?',
+                [(row[0],) for row in rows]
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка снятия просроченных предложений листа ожидания: {e}")
+            return []
 
-            remaining = max_minutes - used_minutes
-            can_book = (used_minutes + duration) <= max_minutes
+    return [dict(zip(['machine_number', 'booking_date', 'start_time'], row[1:])) for row in rows]
 
-            return (can_book, remaining)
 
+@serialized_write
+def claim_laundry_waitlist_offer(waitlist_id: int, user_id: int) -> Tuple[bool, str]:
+    """
+    Подтверждает предложение из листа ожидания и создает запись.
 
-def create_restroom_booking(user_id: int, booking_date: str, start_time: str, end_time: str, duration: int) -> bool:
-    """Создает запись в комнату отдыха"""
-    week, year = get_current_week()
+    Возвращает (успех, причина): 'claimed', 'not_found', 'expired', 'taken' или 'limit'.
+    При 'expired' и 'limit' предложение остается выданным: вызывающий снимает его через
+    expire_laundry_waitlist_offer и передает слот следующему.
+    Предложение, выданное после начала слота (остаток после неявки), создает запись
+    с уже подтвержденным приходом, чтобы ее не сняли как неявку повторно.
+    """
+    claim_minutes = int(get_system_setting('waitlist_claim_minutes') or 15)
 
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            try:
-                # Создаем запись
-                cursor.execute('''
-                    INSERT INTO restroom_bookings 
-                    (user_id, booking_date, start_time, end_time, duration)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (user_id, booking_date, start_time, end_time, duration))
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                SELECT machine_number, booking_date, start_time, offered_at
+                FROM laundry_waitlist
+                WHERE id = ? AND user_id = ? AND status = 'offered'
+            ''', (waitlist_id, user_id))
+            row = cursor.fetchone()
+            if not row:
+                return False, 'not_found'
+
+            machine_number, booking_date, start_time, offered_at = row
+            offered_dt = datetime.strptime(offered_at, '%Y-%m-%d %H:%M:%S')
+            day_number = date_str_to_day_number(booking_date)
+            start_min = time_to_minutes(start_time)
+            started_offer = to_minute_stamp(offered_dt) >= day_number * 1440 + start_min
+            claim_until = start_min + LAUNDRY_SLOT_MINUTES if started_offer else start_min
+            if clock.now() > offered_dt + timedelta(minutes=claim_minutes) or slot_started(day_number, claim_until):
+                return False, 'expired'
+
+            if laundry_interval_occupied(cursor, day_number, machine_number,
+                                         start_min, start_min + LAUNDRY_SLOT_MINUTES):
+                cursor.execute('UPDATE laundry_waitlist SET status = "expired" WHERE id = ?', (waitlist_id,))
+                return False, 'taken'
 
-                # Обновляем лимит
+            cursor.execute('''
+                SELECT COUNT(*) FROM laundry_bookings
+                WHERE user_id = ? AND day_number = ? AND status = 'active'
+            ''', (user_id, day_number))
+            if cursor.fetchone()[0] >= 2:
+                return False, 'limit'
+
+            end_time = minutes_to_time(start_min + 120)
+            with savepoint(conn):
                 cursor.execute('''
-                    INSERT INTO restroom_limits 
-                    (user_id, week_number, year, used_minutes)
-                    VALUES (?, ?, ?, ?)
-                    ON CONFLICT(user_id, week_number, year) 
-                    DO UPDATE SET used_minutes = used_minutes + ?
-                ''', (user_id, week, year, duration, duration))
+                    INSERT INTO laundry_bookings
+                    (user_id, machine_number, booking_date, start_time, end_time, day_number, start_min, end_min,
+                     notified, checked_in)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, machine_number, booking_date, start_time, end_time,
+                      day_number, start_min, start_min + 120, int(started_offer), int(started_offer)))
+                occupy_slots(cursor, 'laundry', cursor.lastrowid, day_number, start_min, start_min + 120,
+                             machine_number)
+            apply_utilization(cursor, laundry_resource(machine_number), booking_date, start_time, end_time, 1)
+            cursor.execute('UPDATE laundry_waitlist SET status = "claimed" WHERE id = ?', (waitlist_id,))
+            invalidate_session(user_id)
+            return True, 'claimed'
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка подтверждения слота из листа ожидания {waitlist_id}: {e}")
+            return False, 'not_found'
+
+
+@traced_read
+def get_waitlisted_laundry_slots(machine_number: int) -> List[Dict[str, str]]:
+    """Возвращает будущие слоты машинки, на которые есть ожидающие пользователи"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT DISTINCT booking_date, start_time FROM laundry_waitlist
+            WHERE machine_number = ? AND status = 'waiting' AND booking_date >= ?
+            ORDER BY booking_date, start_time
+        ''', (machine_number, clock.now().strftime('%Y-%m-%d')))
+        return [{'booking_date': row[0], 'start_time': row[1]} for row in cursor.fetchall()]
+
+
+# Сетка слотов комнаты отдыха: каждые 30 минут с 8:00 до 23:00
+RESTROOM_OPEN_MIN = 8 * 60
+RESTROOM_CLOSE_MIN = 23 * 60
+RESTROOM_SLOT_MIN = 30
+
+
+@traced_read
+def get_available_restroom_slots(date: datetime) -> List[Dict[str, str]]:
+    """Возвращает доступные слоты для комнаты отдыха"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT slot_min FROM slot_occupancy
+            WHERE booking_type = 'restroom' AND day_number = ? AND machine_number = 0
+        ''', (date_to_day_number(date),))
+        occupied = {row[0] for row in cursor.fetchall()}
+
+    return [{
+        'time': minutes_to_time(slot),
+        'display': minutes_to_time(slot)
+    } for slot in range(RESTROOM_OPEN_MIN, RESTROOM_CLOSE_MIN, RESTROOM_SLOT_MIN) if slot not in occupied]
+
+
+@traced_read
+def find_nearest_restroom_slot(days: int = 7, max_duration: int = 120) -> Optional[Dict[str, Union[int, str]]]:
+    """
+    Находит ближайший свободный слот комнаты отдыха на days дней вперед.
+
+    Возвращает дату, время начала и максимальную длительность (не больше max_duration),
+    которую можно забронировать без пересечения со следующей записью.
+    """
+    now = clock.now()
+    first_day = date_to_day_number(now.date())
+    slot_minutes = list(range(RESTROOM_OPEN_MIN, RESTROOM_CLOSE_MIN, RESTROOM_SLOT_MIN))
+
+    with read_connection() as conn:
+        occupied = get_occupied_slots(conn.cursor(), 'restroom', first_day, first_day + days - 1)
+        booked = {day_number: slots for (day_number, _), slots in occupied.items()}
+
+    now_minutes = now.hour * 60 + now.minute
+    for offset in range(days):
+        day_number = first_day + offset
+        slots = slot_minutes if offset else [slot for slot in slot_minutes if slot > now_minutes]
+
+        day_booked = booked.get(day_number, set())
+        start_min = get_nearest_available_time(slots, day_booked)
+        if start_min is None:
+            continue
+
+        # Считаем, сколько подряд свободных 30-минутных слотов идет от начала
+        duration = 0
+        current = start_min
+        while duration < max_duration and current < RESTROOM_CLOSE_MIN and current not in day_booked:
+            duration += RESTROOM_SLOT_MIN
+            current += RESTROOM_SLOT_MIN
+
+        return {
+            'booking_date': day_number_to_str(day_number),
+            'start_time': minutes_to_time(start_min),
+            'max_duration': duration
+        }
+
+    return None
+
+
+@traced_read
+def check_restroom_limit(user_id: int, booking_date: str, duration: int) -> Tuple[bool, int]:
+    """Проверяет недельный лимит комнаты отдыха для недели даты записи"""
+    week, year = booking_week(date_str_to_day_number(booking_date))
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT setting_value FROM schedule_settings 
+            WHERE setting_name = 'restroom_max_weekly_minutes'
+        ''')
+        max_minutes = int(cursor.fetchone()[0])
+
+        cursor.execute('''
+            SELECT used_minutes FROM restroom_limits 
+            WHERE user_id = ? AND week_number = ? AND year = ?
+        ''', (user_id, week, year))
+        result = cursor.fetchone()
+        used_minutes = result[0] if result else 0
+
+        remaining = max_minutes - used_minutes
+        can_book = (used_minutes + duration) <= max_minutes
+
+        return (can_book, remaining)
+
 
+@serialized_write
+def create_restroom_booking(user_id: int, booking_date: str, start_time: str, end_time: str, duration: int,
+                            idempotency_key: Optional[str] = None) -> bool:
+    """
+    Создает запись в комнату отдыха.
+
+    Недельный лимит недели даты записи проверяется в той же транзакции, а пересечение с другими записями
+    отсекается первичным ключом slot_occupancy. Повтор запроса с тем же idempotency_key
+    возвращает True, не создавая вторую запись и не расходуя лимит.
+    """
+    day_number, start_min, end_min = booking_time_values(booking_date, start_time, end_time)
+    week, year = booking_week(day_number)
+
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if booking_exists_for_key(cursor, 'restroom_bookings', idempotency_key):
                 return True
-            except sqlite3.Error:
+
+            cursor.execute('''
+                SELECT
+                    (SELECT CAST(setting_value AS INTEGER) FROM schedule_settings
+                     WHERE setting_name = 'restroom_max_weekly_minutes'),
+                    (SELECT used_minutes FROM restroom_limits
+                     WHERE user_id = ? AND week_number = ? AND year = ?)
+            ''', (user_id, week, year))
+            max_minutes, used_minutes = cursor.fetchone()
+            if max_minutes is not None and (used_minutes or 0) + duration > max_minutes:
                 return False
 
+            # Создаем запись
+            with savepoint(conn):
+                cursor.execute('''
+                    INSERT INTO restroom_bookings
+                    (user_id, booking_date, start_time, end_time, duration, day_number, start_min, end_min,
+                     idempotency_key)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, booking_date, start_time, end_time, duration, day_number, start_min, end_min,
+                      idempotency_key))
+                occupy_slots(cursor, 'restroom', cursor.lastrowid, day_number, start_min, end_min)
+            apply_utilization(cursor, RESTROOM_RESOURCE, booking_date, start_time, end_time, 1)
+            invalidate_session(user_id)
+
+            # Обновляем лимит
+            cursor.execute('''
+                INSERT INTO restroom_limits 
+                (user_id, week_number, year, used_minutes)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, week_number, year) 
+                DO UPDATE SET used_minutes = used_minutes + ?
+            ''', (user_id, week, year, duration, duration))
+
+            return True
+        except sqlite3.Error:
+            return False
+
 
+@serialized_write
 def cancel_restroom_booking(booking_id: int) -> bool:
     """Отменяет запись в комнату отдыха"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            try:
-                # Получаем информацию о записи для обновления лимита
-                cursor.execute('''
-                    SELECT user_id, duration, booking_date 
-                    FROM restroom_bookings 
-                    WHERE id = ?
-                ''', (booking_id,))
-                booking = cursor.fetchone()
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            # Получаем информацию о записи для обновления лимита
+            cursor.execute('''
+                SELECT user_id, duration, booking_date, start_time, end_time, day_number
+                FROM restroom_bookings 
+                WHERE id = ? AND status = 'active'
+            ''', (booking_id,))
+            booking = cursor.fetchone()
 
-                if not booking:
-                    return False
+            if not booking:
+                return False
 
-                user_id, duration, booking_date = booking
-                booking_date = datetime.strptime(booking_date, '%Y-%m-%d').date()
-                week = booking_date.isocalendar()[1]
-                year = booking_date.year
+            user_id, duration, booking_date, start_time, end_time, day_number = booking
+            apply_utilization(cursor, RESTROOM_RESOURCE, booking_date, start_time, end_time, -1)
+            release_slots(cursor, 'restroom', booking_id, day_number)
+            invalidate_session(user_id)
+            week, year = booking_week(day_number)
 
-                # Отменяем запись
-                cursor.execute('''
-                    UPDATE restroom_bookings 
-                    SET status = 'cancelled' 
-                    WHERE id = ?
-                ''', (booking_id,))
+            # Отменяем запись
+            cursor.execute('''
+                UPDATE restroom_bookings 
+                SET status = 'cancelled' 
+                WHERE id = ?
+            ''', (booking_id,))
 
-                # Обновляем лимит
-                cursor.execute('''
-                    UPDATE restroom_limits 
-                    SET used_minutes = used_minutes - ? 
-                    WHERE user_id = ? AND week_number = ? AND year = ?
-                ''', (duration, user_id, week, year))
+            # Обновляем лимит
+            cursor.execute('''
+                UPDATE restroom_limits 
+                SET used_minutes = used_minutes - ? 
+                WHERE user_id = ? AND week_number = ? AND year = ?
+            ''', (duration, user_id, week, year))
 
-                return True
-            except sqlite3.Error:
-                return False
+            return True
+        except sqlite3.Error:
+            return False
 
 
+@traced_read
 def get_system_setting(setting_name: str) -> Optional[str]:
     """Возвращает значение системной настройки"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT setting_value FROM schedule_settings 
-                WHERE setting_name = ?
-            ''', (setting_name,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT setting_value FROM schedule_settings 
+            WHERE setting_name = ?
+        ''', (setting_name,))
+        result = cursor.fetchone()
+        return result[0] if result else None
 
 
+@serialized_write
 def update_machine_status(machine_number: int, status: str) -> bool:
     """Обновляет статус машинки"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute('''
-                    UPDATE laundry_machines 
-                    SET status = ? 
-                    WHERE machine_number = ?
-                ''', (status, machine_number))
-                return cursor.rowcount > 0
-            except sqlite3.Error:
-                return False
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                UPDATE laundry_machines 
+                SET status = ? 
+                WHERE machine_number = ?
+            ''', (status, machine_number))
+            return cursor.rowcount > 0
+        except sqlite3.Error:
+            return False
+
+
+@serialized_write
+def handle_machine_outage(machine_number: int, notice: Optional[Callable[[Dict], str]] = None
+                          ) -> Dict[str, List[Dict[str, Union[int, str]]]]:
+    """
+    Выводит машинку из строя одной транзакцией.
 
+    Будущие записи переносятся на свободную машинку в то же время, а если такой нет — отменяются.
+    Возвращает {'moved': [...], 'cancelled': [...]} с данными затронутых записей.
+    notice(запись) — строка уведомления владельцу (у перенесенной записи есть new_machine_number);
+    строки одного пользователя ставятся в очередь одним сообщением в той же транзакции.
+    """
+    now = clock.now()
+    now_stamp = to_minute_stamp(now)
+    result = {'moved': [], 'cancelled': []}
 
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                UPDATE laundry_machines SET status = 'inactive' WHERE machine_number = ?
+            ''', (machine_number,))
+
+            cursor.execute('''
+                SELECT machine_number FROM laundry_machines
+                WHERE status = 'active' AND machine_number != ?
+                ORDER BY machine_number
+            ''', (machine_number,))
+            other_machines = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute('''
+                SELECT id, user_id, booking_date, start_time, end_time, day_number, start_min, end_min
+                FROM laundry_bookings
+                WHERE machine_number = ? AND status = 'active'
+                      AND day_number >= ? AND day_number * 1440 + start_min > ?
+                ORDER BY day_number, start_min, id
+            ''', (machine_number, now_stamp // 1440, now_stamp))
+            bookings = cursor.fetchall()
+
+            cursor.execute('''
+                SELECT day_number, slot_min, machine_number FROM slot_occupancy
+                WHERE booking_type = 'laundry' AND day_number >= ? AND machine_number != ?
+            ''', (now_stamp // 1440, machine_number))
+            occupied = set(cursor.fetchall())
+
+            for booking_id, user_id, booking_date, start_time, end_time, day_number, start_min, end_min in bookings:
+                invalidate_session(user_id)
+                booking = {
+                    'id': booking_id,
+                    'user_id': user_id,
+                    'machine_number': machine_number,
+                    'booking_date': booking_date,
+                    'start_time': start_time,
+                    'end_time': end_time
+                }
+                steps = occupied_steps(start_min, end_min)
+                new_machine = next(
+                    (m for m in other_machines if not any((day_number, step, m) in occupied for step in steps)),
+                    None
+                )
+
+                if new_machine:
+                    cursor.execute(
+                        'UPDATE laundry_bookings SET machine_number = ? WHERE id = ?',
+                        (new_machine, booking_id)
+                    )
+                    cursor.execute('''
+                        UPDATE slot_occupancy SET machine_number = ?
+                        WHERE booking_type = 'laundry' AND day_number = ? AND machine_number = ? AND booking_id = ?
+                    ''', (new_machine, day_number, machine_number, booking_id))
+                    apply_utilization(cursor, laundry_resource(machine_number), booking_date, start_time, end_time, -1)
+                    apply_utilization(cursor, laundry_resource(new_machine), booking_date, start_time, end_time, 1)
+                    occupied.update((day_number, step, new_machine) for step in steps)
+                    booking['new_machine_number'] = new_machine
+                    result['moved'].append(booking)
+                else:
+                    cursor.execute(
+                        'UPDATE laundry_bookings SET status = "cancelled" WHERE id = ?',
+                        (booking_id,)
+                    )
+                    release_slots(cursor, 'laundry', booking_id, day_number, machine_number)
+                    apply_utilization(cursor, laundry_resource(machine_number), booking_date, start_time, end_time, -1)
+                    result['cancelled'].append(booking)
+
+            if notice:
+                lines: Dict[int, List[str]] = {}
+                for booking in result['moved'] + result['cancelled']:
+                    lines.setdefault(booking['user_id'], []).append(notice(booking))
+                for user_id, user_lines in lines.items():
+                    enqueue_notification(cursor, user_id, "\n\n".join(user_lines), 'outage')
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка обработки поломки машинки {machine_number}: {e}")
+            raise
+
+    return result
+
+
+@traced_read
 def get_all_machines() -> List[Dict[str, Union[int, str]]]:
     """Возвращает список всех машинок с их статусами"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT machine_number, status FROM laundry_machines ORDER BY machine_number')
-            return [{
-                'machine_number': row[0],
-                'status': row[1]
-            } for row in cursor.fetchall()]
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT machine_number, status FROM laundry_machines ORDER BY machine_number')
+        return [{
+            'machine_number': row[0],
+            'status': row[1]
+        } for row in cursor.fetchall()]
 
 
+@traced_read
 def get_active_bookings(booking_type: str) -> List[Dict[str, Union[int, str]]]:
     """Возвращает все активные записи указанного типа"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            if booking_type == 'laundry':
-                cursor.execute('''
-                    SELECT lb.id, u.username_hash, lb.machine_number, 
-                           lb.booking_date, lb.start_time, lb.end_time
-                    FROM laundry_bookings lb
-                    JOIN users u ON lb.user_id = u.user_id
-                    WHERE lb.status = 'active'
-                    ORDER BY lb.booking_date, lb.start_time
-                ''')
-            else:  # restroom
-                cursor.execute('''
-                    SELECT rb.id, u.username_hash, rb.booking_date, 
-                           rb.start_time, rb.end_time, rb.duration
-                    FROM restroom_bookings rb
-                    JOIN users u ON rb.user_id = u.user_id
-                    WHERE rb.status = 'active'
-                    ORDER BY rb.booking_date, rb.start_time
-                ''')
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        if booking_type == 'laundry':
+            cursor.execute('''
+                SELECT lb.id, u.username_hash, lb.machine_number, 
+                       lb.booking_date, lb.start_time, lb.end_time
+                FROM laundry_bookings lb
+                JOIN users u ON lb.user_id = u.user_id
+                WHERE lb.status = 'active'
+                ORDER BY lb.booking_date, lb.start_time
+            ''')
+        else:  # restroom
+            cursor.execute('''
+                SELECT rb.id, u.username_hash, rb.duration,
+                       rb.booking_date, rb.start_time, rb.end_time
+                FROM restroom_bookings rb
+                JOIN users u ON rb.user_id = u.user_id
+                WHERE rb.status = 'active'
+                ORDER BY rb.booking_date, rb.start_time
+            ''')
+
+        return [dict(zip(
+            ['id', 'username_hash', 'machine_number' if booking_type == 'laundry' else 'duration',
+             'booking_date', 'start_time', 'end_time'],
+            row
+        )) for row in cursor.fetchall()]
+
+
+EXPORT_COLUMNS = {
+    'laundry': ['id', 'username_hash', 'machine_number', 'booking_date', 'start_time', 'end_time',
+                'status', 'notified'],
+    'restroom': ['id', 'username_hash', 'booking_date', 'start_time', 'end_time', 'duration',
+                 'status', 'notified', 'created_at']
+}
+
+
+def iter_bookings_for_export(booking_type: str, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                             status: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict]:
+    """
+    Построчно отдает записи указанного типа для выгрузки.
+
+    Строки читаются курсором порциями по batch_size, поэтому потребление памяти
+    не зависит от размера таблицы.
+    """
+    table = 'laundry_bookings' if booking_type == 'laundry' else 'restroom_bookings'
+    columns = EXPORT_COLUMNS['laundry' if booking_type == 'laundry' else 'restroom']
+
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append('b.day_number >= ?')
+        params.append(date_str_to_day_number(date_from))
+    if date_to:
+        conditions.append('b.day_number <= ?')
+        params.append(date_str_to_day_number(date_to))
+    if status:
+        conditions.append('b.status = ?')
+        params.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    select = ', '.join('u.username_hash' if column == 'username_hash' else f'b.{column}' for column in columns)
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {select}
+            FROM {table} b
+            LEFT JOIN users u ON b.user_id = u.user_id
+            {where}
+            ORDER BY b.id
+        ''', params)
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(columns, row))
+
+
+
+@traced_read
+def get_booking_history(booking_type: str, first_day: int, last_day: int,
+                        machine_number: Optional[int] = None) -> List[Tuple[int, int, int, int, int, int]]:
+    """
+    Все записи за дни first_day..last_day для аналитики (analytics.py):
+    (номер дня, машинка (0 у комнаты отдыха), начало, окончание, отменена, неявка)
+    """
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        if booking_type == 'laundry':
+            machine_filter = 'AND machine_number = ?' if machine_number is not None else ''
+            cursor.execute(f'''
+                SELECT day_number, machine_number, start_min, end_min,
+                       status = 'cancelled', status = 'no_show'
+                FROM laundry_bookings
+                WHERE day_number BETWEEN ? AND ? {machine_filter}
+            ''', (first_day, last_day) + ((machine_number,) if machine_number is not None else ()))
+        else:
+            cursor.execute('''
+                SELECT day_number, 0, start_min, end_min, status = 'cancelled', status = 'no_show'
+                FROM restroom_bookings
+                WHERE day_number BETWEEN ? AND ?
+            ''', (first_day, last_day))
+        return cursor.fetchall()
+
+
+def split_by_hours(start_time: str, end_time: str) -> List[Tuple[int, int]]:
+    """Разбивает интервал на части по часам: [(час, минут в этом часе), ...]"""
+    start = time_to_minutes(start_time)
+    end = time_to_minutes(end_time)
+    parts = []
+    while start < end:
+        hour_end = min((start // 60 + 1) * 60, end)
+        parts.append((start // 60, hour_end - start))
+        start = hour_end
+    return parts
+
+
+def apply_utilization(cursor: sqlite3.Cursor, resource: str, booking_date: str,
+                      start_time: str, end_time: str, sign: int):
+    """Инкрементально учитывает запись (sign=1) или ее отмену (sign=-1) в почасовой загрузке"""
+    weekday = datetime.strptime(booking_date, '%Y-%m-%d').weekday()
+    cursor.executemany('''
+        INSERT INTO utilization_rollup (resource, booking_date, weekday, hour, booked_minutes, bookings)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(resource, booking_date, hour) DO UPDATE SET
+            booked_minutes = booked_minutes + excluded.booked_minutes,
+            bookings = bookings + excluded.bookings
+    ''', [
+        (resource, booking_date, weekday, hour, sign * minutes, sign)
+        for hour, minutes in split_by_hours(start_time, end_time)
+    ])
+
+
+@serialized_write
+def rebuild_utilization_rollups() -> int:
+    """Полностью пересчитывает таблицу загрузки по активным записям. Возвращает число строк"""
+    rollup = {}
+
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT 'laundry_' || machine_number, booking_date, start_time, end_time
+            FROM laundry_bookings WHERE status = 'active'
+            UNION ALL
+            SELECT ?, booking_date, start_time, end_time
+            FROM restroom_bookings WHERE status = 'active'
+        ''', (RESTROOM_RESOURCE,))
+
+        for resource, booking_date, start_time, end_time in cursor:
+            for hour, minutes in split_by_hours(start_time, end_time):
+                key = (resource, booking_date, hour)
+                booked_minutes, bookings = rollup.get(key, (0, 0))
+                rollup[key] = (booked_minutes + minutes, bookings + 1)
+
+        cursor.execute('DELETE FROM utilization_rollup')
+        cursor.executemany('''
+            INSERT INTO utilization_rollup (resource, booking_date, weekday, hour, booked_minutes, bookings)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            (resource, booking_date, datetime.strptime(booking_date, '%Y-%m-%d').weekday(), hour,
+             booked_minutes, bookings)
+            for (resource, booking_date, hour), (booked_minutes, bookings) in rollup.items()
+        ])
+
+    return len(rollup)
+
+
+@traced_read
+def get_utilization_stats(resource: str) -> List[Dict[str, int]]:
+    """
+    Возвращает загрузку ресурса по дням недели и часам из таблицы загрузки.
+
+    Для каждой пары (день недели, час): суммарно занятые минуты, число записей и число дней с записями.
+    """
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT weekday, hour, SUM(booked_minutes), SUM(bookings), COUNT(*)
+            FROM utilization_rollup
+            WHERE resource = ? AND booked_minutes > 0
+            GROUP BY weekday, hour
+            ORDER BY weekday, hour
+        ''', (resource,))
+        return [dict(zip(
+            ['weekday', 'hour', 'booked_minutes', 'bookings', 'days'],
+            row
+        )) for row in cursor.fetchall()]
+
+
+@traced_read
+def get_utilization_period(resource: str) -> Optional[Tuple[str, str]]:
+    """Первая и последняя дата с записями ресурса в таблице загрузки (None, если записей нет)"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT MIN(booking_date), MAX(booking_date)
+            FROM utilization_rollup
+            WHERE resource = ? AND booked_minutes > 0
+        ''', (resource,))
+        first_date, last_date = cursor.fetchone()
+        return (first_date, last_date) if first_date else None
+
+
+# Материализованная занятость слотов: меняется в той же транзакции, что и запись,
+# поэтому проверка доступности — одно чтение диапазона по первичному ключу,
+# а двойная запись отсекается конфликтом этого ключа
+def occupancy_slots(booking_type: str, start_min: int, end_min: int) -> List[int]:
+    """Слоты записи: все 30-минутные шаги интервала (у машинки и у комнаты отдыха)"""
+    return occupied_steps(start_min, end_min)
+
+
+def laundry_interval_occupied(cursor: sqlite3.Cursor, day_number: int, machine_number: int,
+                              start_min: int, end_min: int) -> bool:
+    """Пересекается ли интервал с какой-либо записью машинки (чтение диапазона первичного ключа)"""
+    steps = occupied_steps(start_min, end_min)
+    cursor.execute('''
+        SELECT 1 FROM slot_occupancy
+        WHERE booking_type = 'laundry' AND day_number = ? AND machine_number = ? AND slot_min BETWEEN ? AND ?
+        LIMIT 1
+    ''', (day_number, machine_number, steps[0], steps[-1]))
+    return cursor.fetchone() is not None
+
+
+def laundry_occupancy_outdated(cursor: sqlite3.Cursor) -> bool:
+    """
+    Есть ли записи прачечной, занимающие только минуту начала (формат до пошаговой занятости).
+
+    Такие записи не занимают второй шаг своего интервала.
+    """
+    cursor.execute('''
+        SELECT 1 FROM laundry_bookings lb
+        WHERE lb.status = 'active' AND NOT EXISTS (
+            SELECT 1 FROM slot_occupancy so
+            WHERE so.booking_type = 'laundry' AND so.day_number = lb.day_number
+                  AND so.machine_number = lb.machine_number
+                  AND so.slot_min = lb.start_min - lb.start_min % ? + ?
+        )
+        LIMIT 1
+    ''', (OCCUPANCY_STEP_MINUTES, OCCUPANCY_STEP_MINUTES))
+    return cursor.fetchone() is not None
+
+
+def occupy_slots(cursor: sqlite3.Cursor, booking_type: str, booking_id: int, day_number: int,
+                 start_min: int, end_min: int, machine_number: int = 0):
+    """
+    Занимает слоты записи одним запросом.
+
+    Если хотя бы один слот уже занят, запрос целиком отменяется с sqlite3.IntegrityError.
+    """
+    slots = occupancy_slots(booking_type, start_min, end_min)
+    cursor.execute(f'''
+        INSERT INTO slot_occupancy (booking_type, day_number, machine_number, slot_min, booking_id)
+        VALUES {', '.join(['(?, ?, ?, ?, ?)'] * len(slots))}
+    ''', [value for slot in slots for value in (booking_type, day_number, machine_number, slot, booking_id)])
+
+
+def release_slots(cursor: sqlite3.Cursor, booking_type: str, booking_id: int, day_number: int,
+                  machine_number: int = 0):
+    """Освобождает слоты записи"""
+    cursor.execute('''
+        DELETE FROM slot_occupancy
+        WHERE booking_type = ? AND day_number = ? AND machine_number = ? AND booking_id = ?
+    ''', (booking_type, day_number, machine_number, booking_id))
+
+
+def get_occupied_slots(cursor: sqlite3.Cursor, booking_type: str, first_day: int,
+                       last_day: Optional[int] = None) -> Dict[Tuple[int, int], set]:
+    """Занятые слоты за дни first_day..last_day: {(номер дня, машинка): {минуты слотов}}"""
+    cursor.execute('''
+        SELECT day_number, machine_number, slot_min FROM slot_occupancy
+        WHERE booking_type = ? AND day_number BETWEEN ? AND ?
+    ''', (booking_type, first_day, first_day if last_day is None else last_day))
+    occupied = {}
+    for day_number, machine_number, slot_min in cursor.fetchall():
+        occupied.setdefault((day_number, machine_number), set()).add(slot_min)
+    return occupied
+
+
+def fill_slot_occupancy(cursor: sqlite3.Cursor) -> int:
+    """Заполняет занятость слотов по активным записям. Возвращает число занятых слотов"""
+    cursor.execute('''
+        SELECT 'laundry', id, day_number, start_min, end_min, machine_number
+        FROM laundry_bookings WHERE status = 'active'
+        UNION ALL
+        SELECT 'restroom', id, day_number, start_min, end_min, 0
+        FROM restroom_bookings WHERE status = 'active'
+    ''')
+    rows = [
+        (booking_type, day_number, machine_number, slot, booking_id)
+        for booking_type, booking_id, day_number, start_min, end_min, machine_number in cursor.fetchall()
+        for slot in occupancy_slots(booking_type, start_min, end_min)
+    ]
+    # Пересекающиеся записи, созданные до появления таблицы, занимают слот один раз
+    cursor.executemany('''
+        INSERT OR IGNORE INTO slot_occupancy (booking_type, day_number, machine_number, slot_min, booking_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    return len(rows)
+
+
+@serialized_write
+def rebuild_slot_occupancy() -> int:
+    """Полностью пересчитывает занятость слотов по активным записям. Возвращает число занятых слотов"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM slot_occupancy')
+        return fill_slot_occupancy(cursor)
+
+
+# Исходящие уведомления (outbox): уведомление о записи пишется в той же транзакции, что и
+# само изменение, поэтому не теряется при сбое Telegram или перезапуске бота после фиксации
+OUTBOX_PENDING = 'pending'
+OUTBOX_SENT = 'sent'
+OUTBOX_DEAD = 'dead'
+
+
+def enqueue_notification(cursor: sqlite3.Cursor, user_id: int, text: str, kind: str,
+                         buttons: Optional[List[Tuple[str, str]]] = None) -> int:
+    """
+    Ставит уведомление в очередь в текущей транзакции.
+
+    buttons — кнопки под сообщением: [(текст, callback_data), ...]. Возвращает id уведомления.
+    """
+    now = clock.now()
+    cursor.execute('''
+        INSERT INTO outbox (user_id, kind, text, buttons, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, kind, text, json.dumps(buttons, ensure_ascii=False) if buttons else None,
+          now.timestamp(), now.strftime('%Y-%m-%d %H:%M:%S')))
+    return cursor.lastrowid
+
+
+@serialized_write
+def enqueue_notifications(notifications: List[Tuple[int, str, str]]) -> int:
+    """Ставит в очередь уведомления без изменения записей: [(пользователь, текст, вид), ...]"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            for user_id, text, kind in notifications:
+                enqueue_notification(cursor, user_id, text, kind)
+            return len(notifications)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка постановки уведомлений в очередь: {e}")
+            return 0
+
+
+@traced_read
+def has_due_notifications() -> bool:
+    """Есть ли уведомления, срок отправки которых наступил (чтение по индексу, без писателя)"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT 1 FROM outbox WHERE status = ? AND next_attempt_at <= ? LIMIT 1',
+            (OUTBOX_PENDING, clock.now().timestamp())
+        )
+        return cursor.fetchone() is not None
+
+
+@serialized_write
+def claim_outbox_batch(limit: int, lease_seconds: float) -> List[Dict[str, Union[int, str, list]]]:
+    """
+    Забирает до limit уведомлений, срок отправки которых наступил, в порядке постановки.
+
+    Попытка засчитывается сразу, а следующая назначается через lease_seconds: если бот
+    остановится, не записав результат, уведомление будет отправлено повторно.
+    """
+    now = clock.now().timestamp()
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                SELECT id, user_id, kind, text, buttons, attempts FROM outbox
+                WHERE status = ? AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+            ''', (OUTBOX_PENDING, now, limit))
+            rows = cursor.fetchall()
+            if not rows:
+                return []
+            cursor.executemany(
+                'UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ? WHERE id = ?',
+                [(now + lease_seconds, row[0]) for row in rows]
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка выборки уведомлений из очереди: {e}")
+            return []
+
+    return [{
+        'id': outbox_id,
+        'user_id': user_id,
+        'kind': kind,
+        'text': text,
+        'buttons': json.loads(buttons) if buttons else [],
+        'attempts': attempts + 1
+    } for outbox_id, user_id, kind, text, buttons, attempts in rows]
+
+
+@serialized_write
+def record_outbox_results(sent: List[int], failed: List[Tuple[int, str, Optional[float]]]) -> bool:
+    """
+    Записывает результаты доставки пачки одной транзакцией.
 
-            return [dict(zip(
-                ['id', 'username_hash', 'machine_number' if booking_type == 'laundry' else 'duration',
-                 'booking_date', 'start_time', 'end_time'],
-                row
-            )) for row in cursor.fetchall()]
+    failed: [(id, ошибка, время следующей попытки), ...]; время None — уведомление
+    больше не отправляется и остается в очереди со статусом 'dead'.
+    """
+    now = clock.now()
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(
+                'UPDATE outbox SET status = ?, sent_at = ?, last_error = NULL WHERE id = ?',
+                [(OUTBOX_SENT, now.strftime('%Y-%m-%d %H:%M:%S'), outbox_id) for outbox_id in sent]
+            )
+            cursor.executemany(
+                'UPDATE outbox SET next_attempt_at = ?, last_error = ? WHERE id = ?',
+                [(retry_at, error, outbox_id) for outbox_id, error, retry_at in failed if retry_at is not None]
+            )
+            cursor.executemany(
+                'UPDATE outbox SET status = ?, last_error = ? WHERE id = ?',
+                [(OUTBOX_DEAD, error, outbox_id) for outbox_id, error, retry_at in failed if retry_at is None]
+            )
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи результатов доставки уведомлений: {e}")
+            return False
+
+
+@serialized_write
+def prune_outbox(keep_days: int) -> int:
+    """Удаляет доставленные уведомления старше keep_days дней. Возвращает число удаленных"""
+    threshold = (clock.now() - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('DELETE FROM outbox WHERE status = ? AND sent_at < ?', (OUTBOX_SENT, threshold))
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка очистки очереди уведомлений: {e}")
+            return 0
+
+
+@traced_read
+def get_outbox_stats() -> Dict[str, int]:
+    """Уведомления в очереди по статусам; retrying — ожидающие повторной попытки"""
+    stats = {OUTBOX_PENDING: 0, OUTBOX_SENT: 0, OUTBOX_DEAD: 0, 'retrying': 0}
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT status, COUNT(*), SUM(attempts > 0) FROM outbox GROUP BY status
+        ''')
+        for status, count, retrying in cursor.fetchall():
+            stats[status] = count
+            if status == OUTBOX_PENDING:
+                stats['retrying'] = retrying or 0
+    return stats
+
+
+@traced_read
+def get_dead_notifications(limit: int = 10) -> List[Dict[str, Union[int, str]]]:
+    """Последние недоставленные уведомления с причиной"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, user_id, kind, attempts, last_error, created_at FROM outbox
+            WHERE status = ? ORDER BY id DESC LIMIT ?
+        ''', (OUTBOX_DEAD, limit))
+        columns = ['id', 'user_id', 'kind', 'attempts', 'last_error', 'created_at']
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+# Массовый импорт (import_data.py): строки проверяются в памяти, вставляются пачками executemany,
+# каждая пачка фиксируется одной транзакцией писателя
+def get_user_ids() -> set:
+    """Возвращает множество идентификаторов зарегистрированных пользователей"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id FROM users')
+        return {row[0] for row in cursor.fetchall()}
+
+
+def get_active_laundry_occupancy() -> List[Tuple[int, int, int, int]]:
+    """Активные записи в прачечную: (пользователь, машинка, номер дня, минута начала)"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id, machine_number, day_number, start_min
+            FROM laundry_bookings WHERE status = 'active'
+        ''')
+        return cursor.fetchall()
+
+
+def get_active_restroom_occupancy() -> List[Tuple[int, int, int, int, int]]:
+    """Активные записи в комнату отдыха: (пользователь, номер дня, начало, окончание, длительность)"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id, day_number, start_min, end_min, duration
+            FROM restroom_bookings WHERE status = 'active'
+        ''')
+        return cursor.fetchall()
+
+
+@serialized_write
+def import_users(rows: List[Tuple[int, Optional[str], Optional[int]]]) -> int:
+    """
+    Вставляет или обновляет пользователей (user_id, хеш имени, is_admin). Возвращает число строк.
+
+    None в хеше имени или is_admin означает, что файл это поле не задает: у существующего
+    пользователя оно не меняется, новому is_admin ставится 0.
+    """
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO users (user_id, username_hash, is_admin)
+            VALUES (?1, ?2, COALESCE(?3, 0))
+            ON CONFLICT(user_id) DO UPDATE SET
+                username_hash = COALESCE(?2, users.username_hash),
+                is_admin = COALESCE(?3, users.is_admin)
+        ''', rows)
+    get_writer().after_commit(session_cache.clear)
+    return len(rows)
+
+
+@serialized_write
+def import_laundry_bookings(rows: List[Tuple]) -> int:
+    """
+    Вставляет проверенные записи в прачечную пачкой.
+
+    Строка: (user_id, machine_number, booking_date, start_time, end_time, status,
+    day_number, start_min, end_min). Загрузку и занятость слотов после импорта нужно пересчитать.
+    """
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO laundry_bookings
+            (user_id, machine_number, booking_date, start_time, end_time, status, day_number, start_min, end_min)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+    return len(rows)
+
+
+@serialized_write
+def import_restroom_bookings(rows: List[Tuple]) -> int:
+    """
+    Вставляет проверенные записи в комнату отдыха пачкой.
+
+    Строка: (user_id, booking_date, start_time, end_time, duration, status,
+    day_number, start_min, end_min). Лимиты, загрузку и занятость слотов после импорта нужно пересчитать.
+    """
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO restroom_bookings
+            (user_id, booking_date, start_time, end_time, duration, status, day_number, start_min, end_min)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+    return len(rows)
+
+
+@serialized_write
+def rebuild_restroom_limits() -> int:
+    """
+    Пересчитывает недельные лимиты комнаты отдыха по активным записям
+    (неделя определяется датой записи). Возвращает число строк.
+    """
+    used = {}
+
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id, day_number, duration FROM restroom_bookings WHERE status = 'active'")
+        for user_id, day_number, duration in cursor.fetchall():
+            key = (user_id, *booking_week(day_number))
+            used[key] = used.get(key, 0) + duration
+
+        cursor.execute('DELETE FROM restroom_limits')
+        cursor.executemany('''
+            INSERT INTO restroom_limits (user_id, week_number, year, used_minutes)
+            VALUES (?, ?, ?, ?)
+        ''', [(user_id, week, year, minutes) for (user_id, week, year), minutes in used.items()])
+
+    return len(used)
 
 
 # Вспомогательные функции для работы со временем
@@ -514,6 +2171,7 @@ def minutes_to_time(minutes: int) -> str:
     return f"{h:02d}:{m:02d}"
 
 
+@serialized_write
 def update_system_setting(setting_name: str, setting_value: str) -> bool:
     """
     Обновляет значение системной настройки в базе данных.
@@ -525,40 +2183,40 @@ def update_system_setting(setting_name: str, setting_value: str) -> bool:
     Возвращает:
         bool: True если обновление прошло успешно, False в случае ошибки
     """
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute('''
-                    UPDATE schedule_settings
-                    SET setting_value = ?
-                    WHERE setting_name = ?
-                ''', (setting_value, setting_name))
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                UPDATE schedule_settings
+                SET setting_value = ?
+                WHERE setting_name = ?
+            ''', (setting_value, setting_name))
 
-                # Проверяем, была ли обновлена хотя бы одна строка
-                if cursor.rowcount == 0:
-                    # Если настройки не существует, создаем новую
-                    cursor.execute('''
-                        INSERT INTO schedule_settings 
-                        (setting_name, setting_value, description)
-                        VALUES (?, ?, ?)
-                    ''', (setting_name, setting_value, 'Автоматически создано системой'))
+            # Проверяем, была ли обновлена хотя бы одна строка
+            if cursor.rowcount == 0:
+                # Если настройки не существует, создаем новую
+                cursor.execute('''
+                    INSERT INTO schedule_settings 
+                    (setting_name, setting_value, description)
+                    VALUES (?, ?, ?)
+                ''', (setting_name, setting_value, 'Автоматически создано системой'))
 
-                return True
-            except sqlite3.Error as e:
-                logger.error(f"Ошибка при обновлении настройки {setting_name}: {e}")
-                return False
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при обновлении настройки {setting_name}: {e}")
+            return False
 
 
+@traced_read
 def get_all_settings() -> Dict[str, str]:
     """Возвращает все системные настройки в виде словаря"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT setting_name, setting_value FROM schedule_settings')
-            return dict(cursor.fetchall())
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT setting_name, setting_value FROM schedule_settings')
+        return dict(cursor.fetchall())
 
 
+@serialized_write
 def reset_settings_to_default() -> bool:
     """Сбрасывает все настройки к значениям по умолчанию"""
     default_settings = {
@@ -568,60 +2226,78 @@ def reset_settings_to_default() -> bool:
         'restroom_max_weekly_minutes': '240'
     }
 
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            try:
-                for name, value in default_settings.items():
-                    cursor.execute('''
-                        UPDATE schedule_settings
-                        SET setting_value = ?
-                        WHERE setting_name = ?
-                    ''', (value, name))
-                return True
-            except sqlite3.Error:
-                return False
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            for name, value in default_settings.items():
+                cursor.execute('''
+                    UPDATE schedule_settings
+                    SET setting_value = ?
+                    WHERE setting_name = ?
+                ''', (value, name))
+            return True
+        except sqlite3.Error:
+            return False
 
+@serialized_write
 def create_or_update_user(user_id: int, username: str) -> bool:
     """Создает или обновляет пользователя в БД"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            username_hash = hash_username(username)
-            cursor.execute(
-                'INSERT OR IGNORE INTO users (user_id, username_hash) VALUES (?, ?)',
-                (user_id, username_hash)
-            )
-            return True
+    if session_cache.get(user_id, 'known') is True:
+        return True
+
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        username_hash = hash_username(username)
+        cursor.execute(
+            'INSERT OR IGNORE INTO users (user_id, username_hash) VALUES (?, ?)',
+            (user_id, username_hash)
+        )
+
+    get_writer().after_commit(lambda: session_cache.set(user_id, 'known', True))
+    return True
 
+@traced_read
 def get_user_laundry_bookings(user_id: str) -> List[Dict]:
     """Возвращает активные записи в прачечную для пользователя"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, machine_number, booking_date, start_time, end_time
-                FROM laundry_bookings
-                WHERE user_id = ? AND status = 'active' AND booking_date >= date('now')
-                ORDER BY booking_date, start_time
-            ''', (user_id,))
-            return [dict(zip(
-                ['id', 'machine_number', 'booking_date', 'start_time', 'end_time'],
-                row
-            )) for row in cursor.fetchall()]
-
+    cached = session_cache.get(user_id, 'laundry_bookings')
+    if cached is not MISSING:
+        return cached
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, machine_number, booking_date, start_time, end_time
+            FROM laundry_bookings
+            WHERE user_id = ? AND status = 'active' AND day_number >= ?
+            ORDER BY day_number, start_min
+        ''', (user_id, date_to_day_number(clock.today())))
+        bookings = [dict(zip(
+            ['id', 'machine_number', 'booking_date', 'start_time', 'end_time'],
+            row
+        )) for row in cursor.fetchall()]
+
+    session_cache.set(user_id, 'laundry_bookings', bookings)
+    return bookings
+
+@traced_read
 def get_user_restroom_bookings(user_id: str) -> List[Dict]:
     """Возвращает активные записи в комнату отдыха для пользователя"""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, booking_date, start_time, end_time, duration
-                FROM restroom_bookings
-                WHERE user_id = ? AND status = 'active' AND booking_date >= date('now')
-                ORDER BY booking_date, start_time
-            ''', (user_id,))
-            return [dict(zip(
-                ['id', 'booking_date', 'start_time', 'end_time', 'duration'],
-                row
-            )) for row in cursor.fetchall()]
\ No newline at end of file
+    cached = session_cache.get(user_id, 'restroom_bookings')
+    if cached is not MISSING:
+        return cached
+
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, booking_date, start_time, end_time, duration
+            FROM restroom_bookings
+            WHERE user_id = ? AND status = 'active' AND day_number >= ?
+            ORDER BY day_number, start_min
+        ''', (user_id, date_to_day_number(clock.today())))
+        bookings = [dict(zip(
+            ['id', 'booking_date', 'start_time', 'end_time', 'duration'],
+            row
+        )) for row in cursor.fetchall()]
+
+    session_cache.set(user_id, 'restroom_bookings', bookings)
+    return bookings
\ No newline at end of file
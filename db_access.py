@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ReadConnectionPool:
+    """
+    Пул соединений только для чтения (PRAGMA query_only).
+
+    В режиме WAL читатели не ждут писателя, а повторное использование соединений
+    избавляет от открытия файла и настройки PRAGMA на каждый запрос.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_size: int = 4):
+        self._connect = connect
+        self._max_size = max_size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            # Читающие соединения не должны держать открытую транзакцию между запросами
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.put(conn)
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self._max_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            conn = self._connect()
+            conn.execute('PRAGMA query_only = ON')
+            return conn
+        return self._idle.get()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class WriterThread:
+    """
+    Единственный писатель БД.
+
+    Поток владеет единственным пишущим соединением и выполняет изменения из очереди.
+    Вызывающий ждет результат (или исключение) своего задания. Вложенные вызовы
+    из самого потока-писателя выполняются сразу, в текущей транзакции.
+
+    Групповая фиксация (group_window > 0): если за первым заданием в очереди уже ждут
+    другие, писатель добирает пачку в течение group_window секунд (не больше max_batch
+    заданий) и фиксирует ее одной транзакцией. Каждое задание выполняется в своей точке
+    сохранения: ошибка откатывает только его. Результаты отдаются после фиксации.
+
+    Действия, зарегистрированные заданием через after_commit (сброс кэшей), выполняются
+    после фиксации и до выдачи результатов; при откате задания они отбрасываются.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 group_window: float = 0.0, max_batch: int = 128):
+        self._connect = connect
+        self.group_window = group_window
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._after_commit: list = []
+        self.batches = 0
+        self.jobs = 0
+
+    def in_writer(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def connection(self) -> sqlite3.Connection:
+        """Пишущее соединение; доступно только внутри заданий писателя"""
+        if not self.in_writer():
+            raise RuntimeError("Пишущее соединение доступно только в потоке-писателе")
+        return self._conn
+
+    def after_commit(self, callback: Callable[[], None]):
+        """Выполняет callback после фиксации текущей транзакции писателя (вне писателя — сразу)"""
+        if self.in_writer():
+            self._after_commit.append(callback)
+        else:
+            callback()
+
+    def _run_after_commit(self):
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Ошибка действия после фиксации: {e}")
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Выполняет func(*args, **kwargs) в потоке-писателе и возвращает результат"""
+        if self.in_writer():
+            return func(*args, **kwargs)
+        return self._enqueue(func, args, kwargs).result()
+
+    async def submit_async(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """То же, что submit, но не блокирует цикл событий: одновременные запросы попадают в одну пачку"""
+        return await asyncio.wrap_future(self._enqueue(func, args, kwargs))
+
+    def close(self):
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            thread, self._thread = self._thread, None
+        thread.join()
+
+    def _enqueue(self, func, args, kwargs) -> Future:
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        self._conn = self._connect()
+        try:
+            stop = False
+            while not stop:
+                job = self._queue.get()
+                if job is None:
+                    break
+                batch = [job]
+                stop = self._collect(batch)
+                if len(batch) == 1:
+                    self._execute_single(job)
+                else:
+                    self._execute_batch(batch)
+                self.batches += 1
+                self.jobs += len(batch)
+        finally:
+            self._conn.close()
+            self._conn = None
+
+    def _collect(self, batch: list) -> bool:
+        """Добирает задания в пачку; возвращает True, если получен сигнал остановки"""
+        if self.group_window <= 0:
+            return False
+
+        deadline = time.monotonic() + self.group_window
+        while len(batch) < self.max_batch:
+            try:
+                # Одиночную запись не задерживаем; окно ждем, только если идет всплеск
+                if len(batch) > 1:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    job = self._queue.get(timeout=timeout)
+                else:
+                    job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                return True
+            batch.append(job)
+        return False
+
+    def _execute_single(self, job: tuple):
+        future, func, args, kwargs = job
+        try:
+            with self._conn:
+                result = func(*args, **kwargs)
+        except Exception as e:
+            self._after_commit.clear()
+            future.set_exception(e)
+        else:
+            self._run_after_commit()
+            future.set_result(result)
+
+    def _execute_batch(self, batch: list):
+        outcomes = []
+        try:
+            self._conn.execute('BEGIN')
+            for future, func, args, kwargs in batch:
+                self._conn.execute('SAVEPOINT job')
+                registered = len(self._after_commit)
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    self._conn.execute('ROLLBACK TO job')
+                    self._conn.execute('RELEASE job')
+                    del self._after_commit[registered:]
+                    outcomes.append((future, None, e))
+                else:
+                    self._conn.execute('RELEASE job')
+                    outcomes.append((future, result, None))
+            self._conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка групповой фиксации ({len(batch)} заданий): {e}")
+            self._conn.rollback()
+            self._after_commit.clear()
+            for future, *_ in batch:
+                future.set_exception(e)
+            return
+
+        self._run_after_commit()
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
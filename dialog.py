@@ -0,0 +1,104 @@
+import hashlib
+import logging
+from datetime import timedelta
+from typing import List, Optional, Tuple, Union
+
+from aiogram import types
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.fsm.context import FSMContext
+
+import clock
+from api_counter import api_call_counter
+
+logger = logging.getLogger(__name__)
+
+# Ключи FSM с «живым» сообщением диалога и отпечатком его содержимого
+DIALOG_MESSAGE_KEY = 'dialog_message_id'
+DIALOG_RENDER_KEY = 'dialog_render'
+
+
+def render_key(text: str, reply_markup: Optional[types.InlineKeyboardMarkup]) -> str:
+    """Отпечаток текста и клавиатуры для пропуска одинаковых правок"""
+    markup = reply_markup.model_dump_json() if reply_markup else ''
+    return hashlib.md5(f"{text}\0{markup}".encode()).hexdigest()
+
+
+async def edit_message(message: types.Message, text: str,
+                       reply_markup: Optional[types.InlineKeyboardMarkup] = None):
+    """Редактирует сообщение, не вызывая API, если текст и клавиатура не изменились"""
+    if message.text == text and message.reply_markup == reply_markup:
+        api_call_counter.record_skipped_edit()
+        return
+
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if 'message is not modified' not in str(e):
+            raise
+
+
+async def show_dialog(event: Union[types.Message, types.CallbackQuery], state: FSMContext, text: str,
+                      reply_markup: Optional[types.InlineKeyboardMarkup] = None):
+    """
+    Показывает шаг диалога в одном «живом» сообщении.
+
+    Первый шаг отправляет сообщение, следующие шаги его редактируют. Если содержимое
+    не изменилось, вызов API пропускается.
+    """
+    message = event.message if isinstance(event, types.CallbackQuery) else event
+    data = await state.get_data()
+    key = render_key(text, reply_markup)
+
+    if isinstance(event, types.CallbackQuery):
+        message_id = event.message.message_id
+    else:
+        message_id = data.get(DIALOG_MESSAGE_KEY)
+
+    if message_id is None:
+        sent = await message.answer(text, reply_markup=reply_markup)
+        await state.update_data(**{DIALOG_MESSAGE_KEY: sent.message_id, DIALOG_RENDER_KEY: key})
+        return
+
+    if data.get(DIALOG_MESSAGE_KEY) == message_id and data.get(DIALOG_RENDER_KEY) == key:
+        api_call_counter.record_skipped_edit()
+        return
+
+    try:
+        await message.bot.edit_message_text(
+            text=text,
+            chat_id=message.chat.id,
+            message_id=message_id,
+            reply_markup=reply_markup
+        )
+    except TelegramBadRequest as e:
+        if 'message is not modified' not in str(e):
+            # Сообщение удалено или слишком старое — начинаем новое
+            logger.info(f"Не удалось отредактировать сообщение диалога: {e}")
+            sent = await message.answer(text, reply_markup=reply_markup)
+            message_id = sent.message_id
+
+    await state.update_data(**{DIALOG_MESSAGE_KEY: message_id, DIALOG_RENDER_KEY: key})
+
+
+async def start_dialog(message: types.Message, state: FSMContext, text: str,
+                       reply_markup: Optional[types.InlineKeyboardMarkup] = None):
+    """Начинает новый диалог с новым «живым» сообщением"""
+    await state.update_data(**{DIALOG_MESSAGE_KEY: None, DIALOG_RENDER_KEY: None})
+    await show_dialog(message, state, text, reply_markup)
+
+
+def date_choice_markup(callback_prefix: str, days: int = 7,
+                       extra_buttons: Optional[List[Tuple[str, str]]] = None) -> types.InlineKeyboardMarkup:
+    """Клавиатура выбора даты на ближайшие days дней (callback_data: префикс + ГГГГ-ММ-ДД)"""
+    builder = InlineKeyboardBuilder()
+    today = clock.today()
+    for offset in range(days):
+        day = today + timedelta(days=offset)
+        builder.button(text=day.strftime('%d.%m'), callback_data=f"{callback_prefix}{day.strftime('%Y-%m-%d')}")
+    builder.adjust(4)
+
+    for text, callback_data in extra_buttons or []:
+        builder.row(types.InlineKeyboardButton(text=text, callback_data=callback_data))
+
+    return builder.as_markup()
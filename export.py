@@ -0,0 +1,38 @@
+import csv
+import gzip
+import json
+from typing import Optional
+
+from database import EXPORT_COLUMNS
+from storage import iter_bookings_for_export
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def write_bookings_export(path: str, booking_type: str, export_format: str = 'csv',
+                          date_from: Optional[str] = None, date_to: Optional[str] = None,
+                          status: Optional[str] = None) -> int:
+    """
+    Выгружает записи в сжатый файл CSV или JSON Lines по мере чтения из БД.
+
+    Возвращает количество выгруженных строк.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {export_format}")
+
+    rows = iter_bookings_for_export(booking_type, date_from, date_to, status)
+    count = 0
+
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as file:
+        if export_format == 'csv':
+            writer = csv.DictWriter(file, fieldnames=EXPORT_COLUMNS[booking_type])
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                file.write(json.dumps(row, ensure_ascii=False) + '\n')
+                count += 1
+
+    return count
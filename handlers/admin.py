@@ -2,24 +2,54 @@ from aiogram import Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
+import asyncio
+import html
 import logging
+import os
+import tempfile
 
-from database import (
+import clock
+from storage import (
+    STORAGE_BACKEND,
     get_all_machines,
     update_machine_status,
     get_active_bookings,
     get_system_setting,
     update_system_setting,
     is_admin,
-    update_schedule_settings
+    get_booking_window,
+    get_outbox_stats,
+    get_dead_notifications,
+    write_async,
+    update_schedule_settings,
+    get_waitlisted_laundry_slots,
+    handle_machine_outage,
+    get_utilization_period,
+    get_utilization_stats,
+    rebuild_utilization_rollups,
+    get_schedule_rules,
+    add_schedule_rule,
+    delete_schedule_rule
 )
-from utils import is_valid_time, format_date
+from handlers.laundry import offer_freed_laundry_slot
+from analytics import ANALYTICS_AVAILABLE, SATURATION_THRESHOLD, build_utilization_report
+from api_counter import api_call_counter
+from idempotency import idempotency_middleware
+from outbox import outbox_dispatcher
+from loop_monitor import loop_monitor
+from backup import create_backup, list_backups
+from export import EXPORT_FORMATS, write_bookings_export
+from states import AdminStates
+from text_commands import text_commands
+from schedule import ADMISSION_FIFO, ADMISSION_LOTTERY, RULE_BREAK, RULE_CLOSED, RULE_HOURS
+from utils import RESTROOM_RESOURCE, laundry_resource, is_valid_time, format_date, time_to_minutes, minutes_to_time
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-@router.message(F.text == "Администрирование")
+@text_commands.command("Администрирование")
 async def handle_admin(message: types.Message):
     """Основной обработчик кнопки администрирования"""
     if not is_admin(message.from_user.id):
@@ -32,6 +62,7 @@ async def handle_admin(message: types.Message):
         "Просмотр записей",
         "Настройки уведомлений",
         "Настройки расписания",
+        "Статистика загрузки",
         "Главное меню"
     ]
     for button in buttons:
@@ -43,7 +74,7 @@ async def handle_admin(message: types.Message):
         reply_markup=builder.as_markup(resize_keyboard=True)
     )
 
-@router.message(F.text == "Управление машинками")
+@text_commands.command("Управление машинками")
 async def manage_machines(message: types.Message):
     """Управление статусом машинок"""
     machines = get_all_machines()
@@ -68,21 +99,81 @@ async def manage_machines(message: types.Message):
 @router.callback_query(F.data.startswith("toggle_machine_"))
 async def toggle_machine_status(callback: types.CallbackQuery):
     """Переключение статуса машинки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+        return
+
     machine_number = int(callback.data.split('_')[2])
     machines = get_all_machines()
     current_status = next(
         (m['status'] for m in machines if m['machine_number'] == machine_number),
         'active'
     )
-    new_status = 'inactive' if current_status == 'active' else 'active'
 
-    if update_machine_status(machine_number, new_status):
+    if current_status == 'active':
+        await report_machine_outage(callback, machine_number)
+        return
+
+    if await write_async(update_machine_status, machine_number, 'active'):
         await callback.answer(f"Статус машинки {machine_number} изменен")
         await manage_machines(callback.message)
+
+        # После восстановления машинки предлагаем ее слоты листу ожидания
+        for slot in get_waitlisted_laundry_slots(machine_number):
+            await offer_freed_laundry_slot(
+                callback.bot, machine_number, slot['booking_date'], slot['start_time']
+            )
     else:
         await callback.answer("❌ Ошибка изменения статуса")
 
-@router.message(F.text == "Просмотр записей")
+async def report_machine_outage(callback: types.CallbackQuery, machine_number: int):
+    """Выводит машинку из строя, переносит или отменяет ее записи и уведомляет пользователей"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+        return
+
+    def notice(booking):
+        if 'new_machine_number' in booking:
+            return (
+                f"🔁 Ваша запись {booking['booking_date']} {booking['start_time']}-{booking['end_time']} "
+                f"перенесена с машинки №{machine_number} на машинку №{booking['new_machine_number']}"
+            )
+        return (
+            f"❌ Ваша запись {booking['booking_date']} {booking['start_time']}-{booking['end_time']} "
+            f"на машинку №{machine_number} отменена: машинка неисправна, а свободных машинок на это время нет"
+        )
+
+    try:
+        # Уведомления пользователей ставятся в очередь той же транзакцией, что и перенос записей
+        outage = await write_async(handle_machine_outage, machine_number, notice)
+    except Exception:
+        await callback.answer("❌ Ошибка изменения статуса")
+        return
+
+    await callback.answer(f"Статус машинки {machine_number} изменен")
+    await manage_machines(callback.message)
+
+    summary = f"🛠 Машинка №{machine_number} выведена из строя\n\n"
+
+    if outage['moved']:
+        summary += f"🔁 Перенесено записей: {len(outage['moved'])}\n"
+    for booking in outage['moved']:
+        summary += f"  {booking['booking_date']} {booking['start_time']}: №{machine_number} → №{booking['new_machine_number']}\n"
+
+    if outage['cancelled']:
+        summary += f"❌ Отменено записей: {len(outage['cancelled'])}\n"
+    for booking in outage['cancelled']:
+        summary += f"  {booking['booking_date']} {booking['start_time']}\n"
+
+    if not outage['moved'] and not outage['cancelled']:
+        summary += "Будущих записей на машинку не было"
+    else:
+        users = len({booking['user_id'] for booking in outage['moved'] + outage['cancelled']})
+        summary += f"\n📨 Уведомления поставлены в очередь: {users} польз."
+
+    await callback.message.answer(summary)
+
+@text_commands.command("Просмотр записей")
 async def view_bookings_menu(message: types.Message):
     """Меню просмотра записей"""
     builder = InlineKeyboardBuilder()
@@ -129,7 +220,284 @@ async def view_bookings(callback: types.CallbackQuery):
     )
     await callback.answer()
 
-@router.message(F.text == "Настройки уведомлений")
+@router.message(Command("api_stats"))
+async def show_api_stats(message: types.Message):
+    """Счетчики вызовов Telegram Bot API с момента запуска"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+
+    stats = api_call_counter.stats()
+    total = stats.pop('total')
+    skipped = stats.pop('skipped_edits')
+    bookings = stats.pop('bookings')
+
+    text = f"📡 Вызовы Bot API: {total}\n"
+    text += f"⏭ Пропущено одинаковых правок: {skipped}\n"
+    duplicates = idempotency_middleware.stats()
+    text += f"🔁 Отброшено повторов: обновлений {duplicates['updates']}, двойных нажатий {duplicates['actions']}\n"
+    text += f"📝 Завершенных записей: {bookings}\n"
+    if bookings:
+        text += f"≈ {total / bookings:.1f} вызовов на запись\n"
+    if stats:
+        text += "\n" + "\n".join(f"{method}: {count}" for method, count in stats.items())
+
+    await message.answer(text)
+
+@router.message(Command("outbox"))
+async def show_outbox(message: types.Message):
+    """Очередь уведомлений: ожидающие, доставленные и недоставленные с причиной"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+
+    queued = get_outbox_stats()
+    delivery = outbox_dispatcher.stats()
+    text = "📬 Очередь уведомлений\n"
+    text += f"Ожидают отправки: {queued['pending']} (из них повторных: {queued['retrying']})\n"
+    text += f"Доставлено: {queued['sent']}\n"
+    text += f"Не доставлено: {queued['dead']}\n\n"
+    text += (
+        f"С момента запуска: отправлено {delivery['sent']}, отложено для повтора {delivery['retried']}, "
+        f"не доставлено {delivery['dead']}\n"
+    )
+
+    dead = get_dead_notifications(5)
+    if dead:
+        text += "\nПоследние недоставленные:\n" + "\n".join(
+            f"#{item['id']} {item['created_at']} {item['kind']} → {item['user_id']} "
+            f"({item['attempts']} попыт.): {html.escape(item['last_error'] or '')}"
+            for item in dead
+        )
+
+    await message.answer(text)
+
+@router.message(Command("health"))
+async def show_health(message: types.Message):
+    """Состояние бота: задержка цикла событий и места, где он блокировался"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+
+    stats = loop_monitor.stats()
+    if not stats['samples']:
+        await message.answer("🩺 Измерение задержки цикла событий еще не запущено")
+        return
+
+    text = "🩺 Задержка цикла событий\n"
+    text += f"Измерений: {stats['samples']}, p50 ≤ {stats['p50_ms']} мс, p99 ≤ {stats['p99_ms']} мс, "
+    text += f"максимум {stats['max_ms']} мс\n\n"
+    text += "\n".join(f"{label}: {count}" for label, count in stats['histogram'].items())
+    text += f"\n\n⚠️ Блокировок дольше {loop_monitor.threshold * 1000:.0f} мс: {stats['stalls']}\n"
+    for site, count in stats['top_sites']:
+        text += f"{count} × {site}\n"
+
+    await message.answer(text)
+
+@router.message(Command("backup"))
+async def make_backup(message: types.Message):
+    """Внеплановая резервная копия БД (снимается на ходу, в отдельном потоке)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+
+    if STORAGE_BACKEND != 'sqlite':
+        await message.answer("❌ Резервные копии доступны только для хранилища sqlite")
+        return
+
+    await message.answer("⏳ Создаю резервную копию...")
+    try:
+        path = await asyncio.to_thread(create_backup)
+    except Exception as e:
+        logger.error(f"Ошибка резервного копирования: {e}")
+        await message.answer("❌ Не удалось создать резервную копию")
+        return
+
+    backups = list_backups()
+    await message.answer(
+        f"✅ Резервная копия создана и проверена: {os.path.basename(path)}\n"
+        f"Хранится копий: {len(backups)}"
+    )
+
+@router.message(Command("export"))
+async def export_bookings(message: types.Message):
+    """
+    Выгрузка истории записей в сжатый файл.
+
+    Использование: /export laundry|restroom [csv|jsonl] [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ] [статус]
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+
+    args = message.text.split()[1:]
+    if not args or args[0] not in ('laundry', 'restroom'):
+        await message.answer(
+            "Использование: /export laundry|restroom [csv|jsonl] [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ] [статус]\n"
+            "Например: /export laundry csv 01.09.2026 31.12.2026 cancelled"
+        )
+        return
+
+    booking_type = args[0]
+    export_format = args[1] if len(args) > 1 else 'csv'
+    if export_format not in EXPORT_FORMATS:
+        await message.answer(f"❌ Формат должен быть одним из: {', '.join(EXPORT_FORMATS)}")
+        return
+
+    try:
+        date_from = datetime.strptime(args[2], '%d.%m.%Y').strftime('%Y-%m-%d') if len(args) > 2 else None
+        date_to = datetime.strptime(args[3], '%d.%m.%Y').strftime('%Y-%m-%d') if len(args) > 3 else None
+    except ValueError:
+        await message.answer("❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+        return
+    status = args[4] if len(args) > 4 else None
+
+    filename = f"{booking_type}_bookings_{clock.now().strftime('%Y%m%d_%H%M%S')}.{export_format}.gz"
+    fd, path = tempfile.mkstemp(suffix='.gz')
+    os.close(fd)
+
+    try:
+        # Запись файла выполняется в отдельном потоке, чтобы не блокировать бота
+        count = await asyncio.to_thread(
+            write_bookings_export, path, booking_type, export_format, date_from, date_to, status
+        )
+        await message.answer_document(
+            types.FSInputFile(path, filename=filename),
+            caption=f"📦 Выгружено записей: {count}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки записей: {e}")
+        await message.answer("❌ Ошибка при выгрузке записей")
+    finally:
+        os.remove(path)
+
+WEEKDAY_NAMES = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+def resource_title(resource: str) -> str:
+    """Название ресурса загрузки для сообщений"""
+    if resource == RESTROOM_RESOURCE:
+        return "Комната отдыха"
+    if resource == 'laundry':
+        return "Прачечная (все машинки)"
+    return f"Машинка №{resource.split('_')[1]}"
+
+@text_commands.command("Статистика загрузки")
+async def utilization_menu(message: types.Message):
+    """Меню статистики загрузки машинок и комнаты отдыха"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+
+    builder = InlineKeyboardBuilder()
+    for machine in get_all_machines():
+        builder.button(
+            text=f"Машинка {machine['machine_number']}",
+            callback_data=f"util_stats_{laundry_resource(machine['machine_number'])}"
+        )
+    builder.button(text="Комната отдыха", callback_data=f"util_stats_{RESTROOM_RESOURCE}")
+    builder.button(text="🗺 Тепловая карта прачечной", callback_data="util_heatmap_laundry")
+    builder.button(text="🔄 Пересчитать статистику", callback_data="util_rebuild")
+    builder.adjust(1)
+
+    await message.answer(
+        "📊 Выберите ресурс для просмотра загрузки:",
+        reply_markup=builder.as_markup()
+    )
+
+@router.callback_query(F.data.startswith("util_stats_"))
+async def view_utilization(callback: types.CallbackQuery):
+    """
+    Загрузка ресурса по дням недели (читается только из агрегированной таблицы).
+
+    Среднее за день делится на число таких дней недели с первой по последнюю дату с записями,
+    включая дни без записей.
+    """
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+        return
+
+    resource = callback.data[len("util_stats_"):]
+    stats = get_utilization_stats(resource)
+    weekdays_in_period = Counter()
+    period = get_utilization_period(resource)
+    if period:
+        first_date, last_date = (datetime.strptime(value, '%Y-%m-%d') for value in period)
+        weekdays_in_period.update(
+            (first_date + timedelta(days=offset)).weekday() for offset in range((last_date - first_date).days + 1)
+        )
+    response = f"📊 Загрузка: {resource_title(resource)}\n\n"
+
+    for weekday, name in enumerate(WEEKDAY_NAMES):
+        rows = [row for row in stats if row['weekday'] == weekday]
+        if not rows:
+            response += f"{name}: нет записей\n"
+            continue
+
+        days = weekdays_in_period[weekday]
+        total_minutes = sum(row['booked_minutes'] for row in rows)
+        peak = max(rows, key=lambda row: row['booked_minutes'])
+        response += (
+            f"{name}: в среднем {total_minutes / days / 60:.1f} ч/день, "
+            f"пик {peak['hour']:02d}:00–{peak['hour'] + 1:02d}:00 "
+            f"({peak['bookings']} зап.)\n"
+        )
+
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🗺 Тепловая карта", callback_data=f"util_heatmap_{resource}")
+    builder.button(text="Назад", callback_data="admin_back")
+    builder.adjust(1)
+    await callback.message.edit_text(response, reply_markup=builder.as_markup())
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("util_heatmap_"))
+async def send_utilization_heatmap(callback: types.CallbackQuery):
+    """Тепловая карта загрузки по дням недели и часам за год, пиковые часы и доля неявок"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+        return
+
+    if not ANALYTICS_AVAILABLE:
+        await callback.answer("❌ Для тепловой карты на сервере нужен пакет numpy", show_alert=True)
+        return
+
+    resource = callback.data[len("util_heatmap_"):]
+    await callback.answer("⏳ Строю отчет...")
+    try:
+        report = await asyncio.to_thread(build_utilization_report, resource)
+    except Exception as e:
+        logger.error(f"Ошибка построения тепловой карты {resource}: {e}")
+        await callback.message.answer("❌ Ошибка при построении отчета")
+        return
+
+    caption = (
+        f"🗺 Загрузка: {resource_title(resource)} за {report['days']} дн.\n"
+        f"Строки — дни недели с понедельника, столбцы — часы.\n"
+        f"Записей: {report['bookings']}\n"
+    )
+    if report['peaks']:
+        caption += "Пиковые часы: " + ", ".join(
+            f"{WEEKDAY_NAMES[weekday]} {hour:02d}:00 — {value:.0%}" for weekday, hour, value in report['peaks']
+        ) + "\n"
+    caption += f"Насыщенных часов (≥ {SATURATION_THRESHOLD:.0%}): {report['saturated_hours']}\n"
+    if report['no_show_rate'] is not None:
+        caption += f"Неявки: {report['no_show_rate']:.1%}\n"
+
+    await callback.message.answer_photo(
+        types.BufferedInputFile(report['png'], filename=f"heatmap_{resource}.png"),
+        caption=caption
+    )
+
+@router.callback_query(F.data == "util_rebuild")
+async def rebuild_utilization(callback: types.CallbackQuery):
+    """Полный пересчет таблицы загрузки по записям"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+        return
+
+    rows = await write_async(rebuild_utilization_rollups)
+    await callback.answer(f"✅ Статистика пересчитана ({rows} строк)", show_alert=True)
+
+@text_commands.command("Настройки уведомлений")
 async def notification_settings(message: types.Message):
     """Меню настроек уведомлений"""
     settings = {
@@ -155,33 +523,34 @@ async def notification_settings(message: types.Message):
 @router.callback_query(F.data.startswith("edit_setting_"))
 async def edit_setting(callback: types.CallbackQuery, state: FSMContext):
     """Редактирование настройки"""
-    setting_name = callback.data.split('_')[2]
+    setting_name = callback.data[len("edit_setting_"):]
     current_value = get_system_setting(setting_name) or "30"
 
+    await state.set_state(AdminStates.editing_setting)
     await state.update_data(editing_setting=setting_name)
     await callback.message.answer(
         f"Введите новое значение для '{setting_name}' (текущее: {current_value}):"
     )
     await callback.answer()
 
-@router.message(F.text.regexp(r'^\d+$'))
+@router.message(AdminStates.editing_setting)
 async def save_setting(message: types.Message, state: FSMContext):
     """Сохранение новой настройки"""
     user_data = await state.get_data()
-    if 'editing_setting' not in user_data:
-        return
-
     setting_name = user_data['editing_setting']
-    new_value = message.text
+    new_value = (message.text or '').strip()
+    if not new_value.isdigit():
+        await message.answer("❌ Введите целое число минут")
+        return
 
-    if update_system_setting(setting_name, new_value):
+    if await write_async(update_system_setting, setting_name, new_value):
         await message.answer(f"✅ Настройка '{setting_name}' обновлена: {new_value}")
     else:
         await message.answer("❌ Ошибка при сохранении настройки")
 
     await state.clear()
 
-@router.message(F.text == "Настройки расписания")
+@text_commands.command("Настройки расписания")
 async def schedule_settings_menu(message: types.Message):
     """Меню настроек расписания"""
     builder = InlineKeyboardBuilder()
@@ -193,6 +562,7 @@ async def schedule_settings_menu(message: types.Message):
         ("Среда: время открытия", "set_wednesday_start"),
         ("Среда: перерыв (начало)", "set_wednesday_break_start"),
         ("Среда: перерыв (конец)", "set_wednesday_break_end"),
+        ("Правила и исключения", "schedule_rules"),
         ("Сброс настроек", "reset_schedule_settings")
     ]
 
@@ -219,23 +589,24 @@ async def ask_for_new_time(callback: types.CallbackQuery, state: FSMContext):
     }
 
     setting_name = setting_map[callback.data]
+    await state.set_state(AdminStates.editing_schedule_time)
     await state.update_data(editing_setting=setting_name)
     await callback.message.answer(
         f"Введите новое время для {setting_name} (формат HH:MM):"
     )
     await callback.answer()
 
-@router.message(F.text.regexp(r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$'))
+@router.message(AdminStates.editing_schedule_time)
 async def save_schedule_setting(message: types.Message, state: FSMContext):
     """Сохранение новой настройки расписания"""
     user_data = await state.get_data()
-    if 'editing_setting' not in user_data:
-        return
-
     setting_name = user_data['editing_setting']
-    time_value = message.text
+    time_value = (message.text or '').strip()
+    if not is_valid_time(time_value):
+        await message.answer("❌ Неверный формат времени. Используйте ЧЧ:ММ")
+        return
 
-    if update_schedule_settings(setting_name, time_value):
+    if await write_async(update_schedule_settings, setting_name, time_value):
         await message.answer(f"✅ Настройка '{setting_name}' обновлена: {time_value}")
     else:
         await message.answer("❌ Ошибка при сохранении настройки")
@@ -256,11 +627,159 @@ async def reset_schedule_settings(callback: types.CallbackQuery):
     }
 
     for name, value in default_settings.items():
-        update_schedule_settings(name, value)
+        await write_async(update_schedule_settings, name, value)
 
     await callback.answer("✅ Настройки сброшены к значениям по умолчанию")
     await callback.message.edit_reply_markup()
 
+WEEKDAY_SHORT_NAMES = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+
+def parse_rule_scope(scope: str):
+    """Разбирает область действия правила: 'все', день недели ('пн'..'вс') или дата ДД.ММ.ГГГГ"""
+    scope = scope.lower()
+    if scope == 'все':
+        return None, None
+    if scope in WEEKDAY_SHORT_NAMES:
+        return WEEKDAY_SHORT_NAMES.index(scope), None
+    return None, datetime.strptime(scope, '%d.%m.%Y').strftime('%Y-%m-%d')
+
+def describe_rule_scope(rule) -> str:
+    """Текстовое описание области действия правила"""
+    if rule.rule_date:
+        return datetime.strptime(rule.rule_date, '%Y-%m-%d').strftime('%d.%m.%Y')
+    if rule.weekday is not None:
+        return WEEKDAY_SHORT_NAMES[rule.weekday]
+    return "все дни"
+
+@router.callback_query(F.data == "schedule_rules")
+async def schedule_rules_menu(callback: types.CallbackQuery):
+    """Список правил расписания с возможностью удаления"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+        return
+
+    rules = get_schedule_rules()
+    names = {RULE_HOURS: "Часы", RULE_BREAK: "Перерыв", RULE_CLOSED: "Закрыто"}
+
+    builder = InlineKeyboardBuilder()
+    for rule in rules:
+        start = minutes_to_time(rule.start_min) if rule.start_min is not None else "…"
+        end = minutes_to_time(rule.end_min) if rule.end_min is not None else "…"
+        interval = "" if rule.rule_type == RULE_CLOSED else f" {start}-{end}"
+        builder.button(
+            text=f"❌ {names.get(rule.rule_type, rule.rule_type)} ({describe_rule_scope(rule)}){interval}",
+            callback_data=f"rule_delete_{rule.id}"
+        )
+    builder.adjust(1)
+
+    await callback.message.answer(
+        "📋 Правила расписания (нажмите, чтобы удалить).\n"
+        "Конкретная дата важнее дня недели, день недели важнее общего правила.\n\n"
+        "Добавить правило:\n"
+        "/add_hours все|пн..вс|ДД.ММ.ГГГГ HH:MM HH:MM\n"
+        "/add_break все|пн..вс|ДД.ММ.ГГГГ HH:MM HH:MM\n"
+        "/add_closed все|пн..вс|ДД.ММ.ГГГГ",
+        reply_markup=builder.as_markup()
+    )
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("rule_delete_"))
+async def remove_schedule_rule(callback: types.CallbackQuery):
+    """Удаление правила расписания"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+        return
+
+    if await write_async(delete_schedule_rule, int(callback.data.split('_')[2])):
+        await callback.answer("✅ Правило удалено")
+        await callback.message.delete()
+        await schedule_rules_menu(callback)
+    else:
+        await callback.answer("❌ Правило не найдено")
+
+@router.message(Command("add_hours", "add_break", "add_closed"))
+async def create_schedule_rule(message: types.Message):
+    """Добавление правила расписания командой"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+
+    command, *args = message.text.split()
+    rule_type = {
+        '/add_hours': RULE_HOURS,
+        '/add_break': RULE_BREAK,
+        '/add_closed': RULE_CLOSED
+    }[command.split('@')[0]]
+
+    try:
+        weekday, rule_date = parse_rule_scope(args[0])
+        start_min = end_min = None
+        if rule_type != RULE_CLOSED:
+            if not (is_valid_time(args[1]) and is_valid_time(args[2])):
+                raise ValueError
+            start_min, end_min = time_to_minutes(args[1]), time_to_minutes(args[2])
+            if start_min >= end_min:
+                raise ValueError
+    except (ValueError, IndexError):
+        await message.answer(
+            "❌ Неверный формат. Примеры:\n"
+            "/add_hours сб 10:00 20:00\n"
+            "/add_break все 14:00 15:00\n"
+            "/add_closed 01.01.2027"
+        )
+        return
+
+    if await write_async(add_schedule_rule, rule_type, weekday, rule_date, start_min, end_min):
+        await message.answer("✅ Правило добавлено")
+    else:
+        await message.answer("❌ Ошибка при сохранении правила")
+
+@router.message(Command("booking_window"))
+async def booking_window_settings(message: types.Message):
+    """
+    Окно открытия записи в прачечную.
+
+    Использование: /booking_window [дней ЧЧ:ММ fifo|lottery секунд]; /booking_window 0 — без ограничения
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+
+    args = message.text.split()[1:]
+    if args:
+        try:
+            days = int(args[0])
+            open_time = args[1] if len(args) > 1 else get_system_setting('booking_window_open_time')
+            mode = args[2] if len(args) > 2 else get_system_setting('admission_mode')
+            surge_seconds = int(args[3]) if len(args) > 3 else int(get_system_setting('admission_window_seconds') or 0)
+            if days < 0 or surge_seconds < 0 or not is_valid_time(open_time) \
+                    or mode not in (ADMISSION_FIFO, ADMISSION_LOTTERY):
+                raise ValueError
+        except ValueError:
+            await message.answer(
+                "❌ Неверный формат. Пример: /booking_window 7 20:00 lottery 10\n"
+                "(за 7 дней в 20:00, первые 10 секунд — розыгрыш очереди)"
+            )
+            return
+
+        for name, value in (('booking_window_days', days), ('booking_window_open_time', open_time),
+                            ('admission_mode', mode), ('admission_window_seconds', surge_seconds)):
+            await write_async(update_system_setting, name, str(value))
+
+    window = get_booking_window()
+    if not window.enabled:
+        await message.answer(
+            "🗓 Окно записи не ограничено.\n"
+            "Включить: /booking_window дней ЧЧ:ММ fifo|lottery секунд"
+        )
+        return
+
+    mode_names = {ADMISSION_FIFO: "по порядку поступления", ADMISSION_LOTTERY: "розыгрыш"}
+    await message.answer(
+        f"🗓 Запись открывается за {window.days} дн. в {minutes_to_time(window.open_min)}\n"
+        f"⏳ Очередь допуска: первые {window.surge_seconds} сек., {mode_names.get(window.mode, window.mode)}"
+    )
+
 @router.callback_query(F.data == "admin_back")
 async def admin_back(callback: types.CallbackQuery):
     """Возврат в главное меню администратора"""
@@ -1,8 +1,17 @@
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
-from database import init_db, hash_username, is_admin, create_or_update_user, get_user_laundry_bookings, get_user_restroom_bookings
+from storage import (
+    is_admin,
+    create_or_update_user,
+    get_user_laundry_bookings,
+    get_user_restroom_bookings,
+    write_async
+)
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.fsm.context import FSMContext
+from dialog import edit_message
+from text_commands import text_commands
 import datetime
 
 router = Router()
@@ -11,14 +20,17 @@ router = Router()
 async def send_welcome(message: types.Message):
     user_id = message.from_user.id
     username = message.from_user.username
-    create_or_update_user(user_id, username)
+    await write_async(create_or_update_user, user_id, username)
 
     builder = ReplyKeyboardBuilder()
     builder.row(
         types.KeyboardButton(text="Записаться в прачечную"),
         types.KeyboardButton(text="Записаться в комнату отдыха")
     )
-    builder.row(types.KeyboardButton(text="Мои записи"))
+    builder.row(
+        types.KeyboardButton(text="Регулярная запись в прачечную"),
+        types.KeyboardButton(text="Мои записи")
+    )
 
     # Проверка прав через функцию is_admin
     if is_admin(user_id):
@@ -31,18 +43,21 @@ async def send_welcome(message: types.Message):
     )
 
 
-@router.message(F.text == "Мои записи")
-async def show_my_bookings(message: types.Message):
-    """Показывает активные записи пользователя"""
-    user_id = message.from_user.id
+@text_commands.command("Главное меню")
+async def back_to_main_menu(message: types.Message, state: FSMContext):
+    """Возврат к основной клавиатуре (кнопка из меню администратора)"""
+    await state.clear()
+    await send_welcome(message)
+
 
+def build_bookings_view(user_id: int):
+    """Текст и клавиатура со списком активных записей пользователя"""
     # Получаем записи через функции из database.py
     laundry = get_user_laundry_bookings(user_id)
     restroom = get_user_restroom_bookings(user_id)
 
     if not laundry and not restroom:
-        await message.reply("У вас нет активных записей.")
-        return
+        return "У вас нет активных записей.", None
 
     response = "Ваши активные записи:\n\n"
 
@@ -70,39 +85,30 @@ async def show_my_bookings(message: types.Message):
         builder.button(text="Отменить запись в прачечную", callback_data="cancel_laundry_menu")
     if restroom:
         builder.button(text="Отменить запись в комнату отдыха", callback_data="cancel_restroom_menu")
+    builder.button(text="↩️ Главное меню", callback_data="main_menu")
     builder.adjust(1)
 
-    await message.reply(response, reply_markup=builder.as_markup())
+    return response, builder.as_markup()
 
 
-@router.callback_query(F.data == "my_bookings")
-async def show_my_bookings_menu(callback: types.CallbackQuery):
-    """Обновленное меню записей"""
-    user_id = callback.from_user.id
-
-    builder = InlineKeyboardBuilder()
-
-    # Проверяем записи в прачечную
-    laundry = get_user_laundry_bookings(user_id)
-    if laundry:
-        builder.button(
-            text="Отменить запись в прачечную",
-            callback_data="cancel_laundry_menu"
-        )
-
-    # Проверяем записи в комнату отдыха
-    restroom = get_user_restroom_bookings(user_id)
-    if restroom:
-        builder.button(
-            text="Отменить запись в комнату отдыха",
-            callback_data="cancel_restroom_menu"
-        )
+@text_commands.command("Мои записи")
+async def show_my_bookings(message: types.Message):
+    """Показывает активные записи пользователя"""
+    response, markup = build_bookings_view(message.from_user.id)
+    await message.reply(response, reply_markup=markup)
 
-    builder.button(text="↩️ Главное меню", callback_data="main_menu")
-    builder.adjust(1)
 
-    await callback.message.edit_text(
-        "Выберите действие:",
-        reply_markup=builder.as_markup()
-    )
-    await callback.answer()
\ No newline at end of file
+@router.callback_query(F.data == "my_bookings")
+async def show_my_bookings_menu(callback: types.CallbackQuery):
+    """Возвращает сообщение к списку записей (кнопка «Назад» из меню отмены)"""
+    response, markup = build_bookings_view(callback.from_user.id)
+    await edit_message(callback.message, response, reply_markup=markup)
+    await callback.answer()
+
+
+@router.callback_query(F.data == "main_menu")
+async def close_inline_menu(callback: types.CallbackQuery, state: FSMContext):
+    """Закрывает встроенное меню; основные действия доступны на клавиатуре"""
+    await state.clear()
+    await edit_message(callback.message, "Выберите действие на клавиатуре ниже.", reply_markup=None)
+    await callback.answer()
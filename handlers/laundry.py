@@ -1,26 +1,44 @@
 from aiogram import Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
-from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
-from datetime import datetime
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from datetime import datetime, timedelta
 import logging
 
-from database import (
+import clock
+from storage import (
+    add_to_laundry_waitlist,
+    offer_laundry_slot_to_next_waiter,
+    expire_laundry_waitlist_offer,
+    claim_laundry_waitlist_offer,
+    create_recurring_laundry_bookings,
     get_available_machines,
     get_available_laundry_slots,
     create_laundry_booking,
+    write_async,
     get_user_laundry_bookings,
     cancel_laundry_booking,
     get_system_setting,
-    check_user_daily_bookings
+    check_user_daily_bookings,
+    get_laundry_slot_times,
+    get_laundry_booking,
+    find_nearest_laundry_slot,
+    check_in_laundry_booking,
+    get_booking_window
 )
+from admission import admission_queue, admission_message
+from idempotency import current_idempotency_key
 from utils import (
     is_valid_time,
     time_to_minutes,
     minutes_to_time,
-    format_date
+    format_date,
+    get_weekday_name
 )
-from states import LaundryStates
+from states import LaundryStates, RecurringLaundryStates
+from dialog import show_dialog, start_dialog, edit_message, date_choice_markup
+from api_counter import api_call_counter
+from text_commands import text_commands
 
 router = Router()
 
@@ -28,8 +46,25 @@ router = Router()
 LAUNDRY_MIN_BOOKING_HOURS = 2
 logger = logging.getLogger(__name__)
 
+# Горизонт поиска ближайшего свободного слота (в днях)
+NEAREST_SLOT_SEARCH_DAYS = 7
 
-@router.message(F.text == "Записаться в прачечную")
+# Варианты количества недель для регулярной записи
+RECURRING_WEEKS_OPTIONS = [2, 4, 6, 8]
+
+
+LAUNDRY_DATE_PROMPT = "📅 Выберите дату или введите ее в формате ДД.ММ.ГГГГ:"
+
+
+def laundry_date_markup() -> types.InlineKeyboardMarkup:
+    """Клавиатура выбора даты записи в прачечную"""
+    return date_choice_markup(
+        "laundry_date_",
+        extra_buttons=[("⚡ Ближайший свободный слот", "nearest_laundry")]
+    )
+
+
+@text_commands.command("Записаться в прачечную")
 async def laundry_start(message: types.Message, state: FSMContext):
     """Начало процесса записи в прачечную"""
     available_machines = get_available_machines()
@@ -37,47 +72,82 @@ async def laundry_start(message: types.Message, state: FSMContext):
         await message.reply("❌ В данный момент нет доступных машинок для записи.")
         return
 
+    await state.clear()
     await state.set_state(LaundryStates.choosing_date)
-    await message.reply("📅 На какую дату вы хотите записаться? (Формат: ДД.ММ.ГГГГ)")
+    await start_dialog(message, state, LAUNDRY_DATE_PROMPT, laundry_date_markup())
 
 
 @router.message(LaundryStates.choosing_date)
 async def process_laundry_date(message: types.Message, state: FSMContext):
-    """Обработка выбранной даты"""
+    """Обработка введенной даты"""
     try:
         booking_date = datetime.strptime(message.text, '%d.%m.%Y').date()
-        today = datetime.now().date()
+    except (TypeError, ValueError):
+        await show_dialog(
+            message, state,
+            "❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ\n\n" + LAUNDRY_DATE_PROMPT,
+            laundry_date_markup()
+        )
+        return
 
-        if booking_date < today:
-            await message.reply("❌ Нельзя записаться на прошедшую дату. Введите корректную дату.")
-            return
+    await choose_laundry_machine(message, state, booking_date)
 
-        available_machines = get_available_machines()
-        if not available_machines:
-            await state.clear()
-            await message.reply("❌ Нет доступных машинок.")
-            return
 
-        # Сохраняем дату в FSM контексте
-        await state.update_data(booking_date=booking_date.strftime('%Y-%m-%d'))
+@router.callback_query(F.data.startswith("laundry_date_"), LaundryStates.choosing_date)
+async def process_laundry_date_button(callback: types.CallbackQuery, state: FSMContext):
+    """Обработка даты, выбранной кнопкой"""
+    booking_date = datetime.strptime(callback.data[len("laundry_date_"):], '%Y-%m-%d').date()
+    await choose_laundry_machine(callback, state, booking_date)
+    await callback.answer()
 
-        # Создаем клавиатуру с доступными машинками
-        builder = InlineKeyboardBuilder()
-        for machine in available_machines:
-            builder.button(
-                text=f"Машинка №{machine}",
-                callback_data=f"machine_{machine}"
-            )
-        builder.adjust(1)
 
-        await state.set_state(LaundryStates.choosing_machine)
-        await message.reply(
-            "🌀 Выберите машинку:",
-            reply_markup=builder.as_markup()
+async def choose_laundry_machine(event, state: FSMContext, booking_date):
+    """Шаг выбора машинки на выбранную дату"""
+    today = clock.today()
+
+    if booking_date < today:
+        await show_dialog(
+            event, state,
+            "❌ Нельзя записаться на прошедшую дату.\n\n" + LAUNDRY_DATE_PROMPT,
+            laundry_date_markup()
         )
+        return
 
-    except ValueError:
-        await message.reply("❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+    window = get_booking_window()
+    if not window.is_open(booking_date, clock.now()):
+        opens_at = window.opens_at(booking_date)
+        await show_dialog(
+            event, state,
+            f"❌ Запись на {booking_date.strftime('%d.%m.%Y')} откроется "
+            f"{opens_at.strftime('%d.%m.%Y в %H:%M')}.\n\n" + LAUNDRY_DATE_PROMPT,
+            laundry_date_markup()
+        )
+        return
+
+    available_machines = get_available_machines()
+    if not available_machines:
+        await show_dialog(event, state, "❌ Нет доступных машинок.")
+        await state.clear()
+        return
+
+    # Сохраняем дату в FSM контексте
+    await state.update_data(booking_date=booking_date.strftime('%Y-%m-%d'))
+
+    # Создаем клавиатуру с доступными машинками
+    builder = InlineKeyboardBuilder()
+    for machine in available_machines:
+        builder.button(
+            text=f"Машинка №{machine}",
+            callback_data=f"machine_{machine}"
+        )
+    builder.adjust(1)
+
+    await state.set_state(LaundryStates.choosing_machine)
+    await show_dialog(
+        event, state,
+        f"📅 {booking_date.strftime('%d.%m.%Y')}\n🌀 Выберите машинку:",
+        builder.as_markup()
+    )
 
 
 @router.callback_query(F.data.startswith('machine_'), LaundryStates.choosing_machine)
@@ -87,85 +157,206 @@ async def process_laundry_machine(callback: types.CallbackQuery, state: FSMConte
     booking_date = user_data['booking_date']
     date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
 
-    available_slots = get_available_laundry_slots(date_obj, machine_number)
+    if get_booking_window().in_surge(date_obj, clock.now()):
+        # Во время всплеска показываем слоты из прогретого снимка, не нагружая БД
+        available_slots = admission_queue.free_slots(booking_date, machine_number)
+    else:
+        available_slots = get_available_laundry_slots(date_obj, machine_number)
 
     if not available_slots:
-        await callback.message.edit_text(
-            "❌ На выбранную дату нет свободных слотов для этой машинки.",
-            reply_markup=None
+        # Предлагаем встать в лист ожидания вместо повторных попыток
+        builder = InlineKeyboardBuilder()
+        for slot in get_laundry_slot_times(date_obj):
+            builder.button(
+                text=f"🔔 {slot}",
+                callback_data=f"waitlist_join_{machine_number}_{booking_date}_{slot}"
+            )
+        builder.adjust(2)
+
+        await show_dialog(
+            callback, state,
+            "❌ На выбранную дату нет свободных слотов для этой машинки.\n"
+            "Вы можете встать в лист ожидания — мы сообщим, как только слот освободится:",
+            builder.as_markup()
         )
         await state.clear()
+        await callback.answer()
         return
 
-    builder = ReplyKeyboardBuilder()
+    builder = InlineKeyboardBuilder()
     for slot in available_slots:
-        builder.add(types.KeyboardButton(text=slot))
+        builder.button(text=slot, callback_data=f"laundry_time_{slot}")
     builder.adjust(2)  # 2 кнопки в ряд
 
     await state.update_data(machine_number=machine_number)
     await state.set_state(LaundryStates.choosing_time)
-    await callback.message.answer(
-        f"⏰ Выберите время начала для машинки №{machine_number} (слоты по 2 часа):",
-        reply_markup=builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
+    await show_dialog(
+        callback, state,
+        f"📅 {date_obj.strftime('%d.%m.%Y')}, машинка №{machine_number}\n"
+        f"⏰ Выберите время начала (слоты по 2 часа):",
+        builder.as_markup()
     )
     await callback.answer()
-    builder = ReplyKeyboardBuilder()
-    for slot in available_slots:
-        builder.add(types.KeyboardButton(text=slot))
-    builder.adjust(2)
 
+
+@router.callback_query(F.data.startswith("laundry_time_"), LaundryStates.choosing_time)
+async def process_laundry_time_button(callback: types.CallbackQuery, state: FSMContext):
+    """Обработка времени, выбранного кнопкой"""
+    await book_laundry_slot(callback, state, callback.from_user.id, callback.data[len("laundry_time_"):])
     await callback.answer()
 
 
 @router.message(LaundryStates.choosing_time)
 async def process_laundry_time(message: types.Message, state: FSMContext):
-    if not is_valid_time(message.text):
+    if not is_valid_time(message.text or ''):
         await message.reply("❌ Неверный формат времени.")
         return
 
+    await book_laundry_slot(message, state, message.from_user.id, message.text)
+
+
+async def book_laundry_slot(event, state: FSMContext, user_id: int, start_time: str):
+    """Проверка слота и создание записи; результат показывается в сообщении диалога"""
     user_data = await state.get_data()
     booking_date = user_data['booking_date']
     machine_number = user_data['machine_number']
-    start_time = message.text
     date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
 
+    # В первые секунды после открытия даты запрос встает в очередь допуска
+    window = get_booking_window()
+    if window.in_surge(date_obj, clock.now()):
+        position, total = admission_queue.enqueue(
+            window, user_id, machine_number, booking_date, start_time, current_idempotency_key()
+        )
+        await show_dialog(event, state, admission_message(window, position, total))
+        await state.clear()
+        return
+
     # Проверка доступности слота
     available_slots = get_available_laundry_slots(date_obj, machine_number)
     if start_time not in available_slots:
+        await show_dialog(event, state, "❌ Это время уже занято.")
         await state.clear()
-        await message.reply("❌ Это время уже занято.", reply_markup=types.ReplyKeyboardRemove())
         return
 
     # Проверка лимита записей (не более 2 в день)
-    if not check_user_daily_bookings(message.from_user.id, booking_date):
-        await state.clear()
-        await message.reply(
-            "❌ У вас уже 2 записи на этот день. Отмените одну из них для создания новой.",
-            reply_markup=types.ReplyKeyboardRemove()
+    if not check_user_daily_bookings(user_id, booking_date):
+        await show_dialog(
+            event, state,
+            "❌ У вас уже 2 записи на этот день. Отмените одну из них для создания новой."
         )
+        await state.clear()
         return
 
     # Создание записи (2 часа)
     end_time = minutes_to_time(time_to_minutes(start_time) + 120)
 
-    if create_laundry_booking(
-            user_id=message.from_user.id,
+    if await write_async(
+            create_laundry_booking,
+            user_id=user_id,
             machine_number=machine_number,
             booking_date=booking_date,
             start_time=start_time,
-            end_time=end_time
+            end_time=end_time,
+            idempotency_key=current_idempotency_key()
     ):
-        await message.reply(
+        api_call_counter.record_booking()
+        await show_dialog(
+            event, state,
             f"✅ Вы успешно записаны на машинку №{machine_number}\n"
             f"📅 Дата: {date_obj.strftime('%d.%m.%Y')}\n"
             f"⏰ Время: {start_time}-{end_time}\n\n"
-            f"ℹ️ Вы можете иметь до 2 активных записей в день.",
-            reply_markup=types.ReplyKeyboardRemove()
+            f"ℹ️ Вы можете иметь до 2 активных записей в день."
         )
     else:
-        await message.reply("❌ Ошибка при создании записи.", reply_markup=types.ReplyKeyboardRemove())
+        await show_dialog(event, state, "❌ Ошибка при создании записи.")
+
+    await state.clear()
+
 
+@router.callback_query(F.data == "nearest_laundry")
+async def show_nearest_laundry_slot(callback: types.CallbackQuery, state: FSMContext):
+    """Находит ближайший свободный слот на любой активной машинке"""
     await state.clear()
+    slot = find_nearest_laundry_slot(NEAREST_SLOT_SEARCH_DAYS)
+
+    if not slot:
+        await edit_message(
+            callback.message,
+            f"❌ В ближайшие {NEAREST_SLOT_SEARCH_DAYS} дней нет свободных слотов.",
+            reply_markup=None
+        )
+        await callback.answer()
+        return
+
+    builder = InlineKeyboardBuilder()
+    builder.button(
+        text="✅ Записаться",
+        callback_data=f"quick_laundry_{slot['machine_number']}_{slot['booking_date']}_{slot['start_time']}"
+    )
+
+    date_display = datetime.strptime(slot['booking_date'], '%Y-%m-%d').strftime('%d.%m.%Y')
+    await edit_message(
+        callback.message,
+        f"⚡ Ближайший свободный слот:\n"
+        f"🌀 Машинка №{slot['machine_number']}\n"
+        f"📅 Дата: {date_display}\n"
+        f"⏰ Время: {slot['start_time']}-{slot['end_time']}",
+        reply_markup=builder.as_markup()
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("quick_laundry_"))
+async def book_nearest_laundry_slot(callback: types.CallbackQuery):
+    """Запись на найденный ближайший слот в одно нажатие"""
+    _, _, machine_number, booking_date, start_time = callback.data.split('_')
+    machine_number = int(machine_number)
+    date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
+
+    window = get_booking_window()
+    if window.in_surge(date_obj, clock.now()):
+        position, total = admission_queue.enqueue(
+            window, callback.from_user.id, machine_number, booking_date, start_time,
+            current_idempotency_key()
+        )
+        await edit_message(callback.message, admission_message(window, position, total), reply_markup=None)
+        await callback.answer()
+        return
+
+    if start_time not in get_available_laundry_slots(date_obj, machine_number):
+        await edit_message(callback.message, "❌ Этот слот уже заняли, попробуйте найти следующий.", reply_markup=None)
+        await callback.answer()
+        return
+
+    if not check_user_daily_bookings(callback.from_user.id, booking_date):
+        await edit_message(callback.message, "❌ У вас уже 2 записи на этот день.", reply_markup=None)
+        await callback.answer()
+        return
+
+    end_time = minutes_to_time(time_to_minutes(start_time) + 120)
+    if await write_async(
+            create_laundry_booking,
+            user_id=callback.from_user.id,
+            machine_number=machine_number,
+            booking_date=booking_date,
+            start_time=start_time,
+            end_time=end_time,
+            idempotency_key=current_idempotency_key()
+    ):
+        api_call_counter.record_booking()
+        await edit_message(
+            callback.message,
+            f"✅ Вы успешно записаны на машинку №{machine_number}\n"
+            f"📅 Дата: {date_obj.strftime('%d.%m.%Y')}\n"
+            f"⏰ Время: {start_time}-{end_time}",
+            reply_markup=None
+        )
+    else:
+        await edit_message(callback.message, "❌ Ошибка при создании записи.", reply_markup=None)
+
+    await callback.answer()
+
 
 @router.callback_query(F.data == "cancel_laundry")
 async def cancel_laundry(callback: types.CallbackQuery):
@@ -186,7 +377,8 @@ async def cancel_laundry(callback: types.CallbackQuery):
         )
     builder.adjust(1)
 
-    await callback.message.edit_text(
+    await edit_message(
+        callback.message,
         "Выберите запись для отмены:",
         reply_markup=builder.as_markup()
     )
@@ -209,10 +401,11 @@ async def show_cancel_laundry_menu(callback: types.CallbackQuery):
             text=f"Машинка {booking['machine_number']} {booking['booking_date']} {booking['start_time']}",
             callback_data=f"cancel_laundry_{booking['id']}"
         )
-    builder.button(text="↩️ Назад", callback_data="main_menu")
+    builder.button(text="↩️ Назад", callback_data="my_bookings")
     builder.adjust(1)
 
-    await callback.message.edit_text(
+    await edit_message(
+        callback.message,
         "Выберите запись для отмены:",
         reply_markup=builder.as_markup()
     )
@@ -229,14 +422,23 @@ async def process_laundry_cancel(callback: types.CallbackQuery):
             raise ValueError("Invalid callback data format")
 
         booking_id = int(parts[2])
+        booking = get_laundry_booking(booking_id)
 
-        if cancel_laundry_booking(booking_id):
-            await callback.message.edit_text(
+        if await write_async(cancel_laundry_booking, booking_id):
+            await edit_message(
+                callback.message,
                 "✅ Запись успешно отменена",
                 reply_markup=None
             )
+            await offer_freed_laundry_slot(
+                callback.bot,
+                booking['machine_number'],
+                booking['booking_date'],
+                booking['start_time']
+            )
         else:
-            await callback.message.edit_text(
+            await edit_message(
+                callback.message,
                 "❌ Не удалось отменить запись",
                 reply_markup=None
             )
@@ -247,6 +449,226 @@ async def process_laundry_cancel(callback: types.CallbackQuery):
         await callback.answer()
 
 
+@text_commands.command("Регулярная запись в прачечную")
+async def recurring_laundry_start(message: types.Message, state: FSMContext):
+    """Начало создания еженедельной записи в прачечную"""
+    available_machines = get_available_machines()
+    if not available_machines:
+        await message.reply("❌ В данный момент нет доступных машинок для записи.")
+        return
+
+    builder = InlineKeyboardBuilder()
+    for machine in available_machines:
+        builder.button(text=f"Машинка №{machine}", callback_data=f"rec_machine_{machine}")
+    builder.adjust(1)
+
+    await state.clear()
+    await state.set_state(RecurringLaundryStates.choosing_machine)
+    await start_dialog(message, state, "🔁 Выберите машинку для регулярной записи:", builder.as_markup())
+
+
+@router.callback_query(F.data.startswith("rec_machine_"), RecurringLaundryStates.choosing_machine)
+async def process_recurring_machine(callback: types.CallbackQuery, state: FSMContext):
+    """Выбор машинки для регулярной записи"""
+    await state.update_data(machine_number=int(callback.data.split('_')[2]))
+
+    builder = InlineKeyboardBuilder()
+    today = clock.today()
+    for offset in range(7):
+        day = today + timedelta(days=offset)
+        builder.button(text=get_weekday_name(day), callback_data=f"rec_day_{day.weekday()}")
+    builder.adjust(2)
+
+    await state.set_state(RecurringLaundryStates.choosing_weekday)
+    await edit_message(callback.message, "📅 Выберите день недели:", reply_markup=builder.as_markup())
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("rec_day_"), RecurringLaundryStates.choosing_weekday)
+async def process_recurring_weekday(callback: types.CallbackQuery, state: FSMContext):
+    """Выбор дня недели для регулярной записи"""
+    weekday = int(callback.data.split('_')[2])
+    today = clock.today()
+    first_date = today + timedelta(days=(weekday - today.weekday()) % 7)
+    await state.update_data(first_date=first_date.strftime('%Y-%m-%d'))
+
+    builder = InlineKeyboardBuilder()
+    for slot in get_laundry_slot_times(first_date):
+        builder.button(text=slot, callback_data=f"rec_time_{slot}")
+    builder.adjust(2)
+
+    await state.set_state(RecurringLaundryStates.choosing_time)
+    await edit_message(
+        callback.message,
+        f"⏰ Выберите время начала ({get_weekday_name(first_date)}, слоты по 2 часа):",
+        reply_markup=builder.as_markup()
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("rec_time_"), RecurringLaundryStates.choosing_time)
+async def process_recurring_time(callback: types.CallbackQuery, state: FSMContext):
+    """Выбор времени для регулярной записи"""
+    await state.update_data(start_time=callback.data.split('_')[2])
+
+    builder = InlineKeyboardBuilder()
+    for weeks in RECURRING_WEEKS_OPTIONS:
+        builder.button(text=f"{weeks} нед.", callback_data=f"rec_weeks_{weeks}")
+    builder.adjust(len(RECURRING_WEEKS_OPTIONS))
+
+    await state.set_state(RecurringLaundryStates.choosing_weeks)
+    await edit_message(callback.message, "🔁 На сколько недель вперед записаться?", reply_markup=builder.as_markup())
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("rec_weeks_"), RecurringLaundryStates.choosing_weeks)
+async def process_recurring_weeks(callback: types.CallbackQuery, state: FSMContext):
+    """Создание всех записей серии одной транзакцией"""
+    weeks = int(callback.data.split('_')[2])
+    user_data = await state.get_data()
+    await state.clear()
+
+    first_date = datetime.strptime(user_data['first_date'], '%Y-%m-%d').date()
+    created, skipped = await write_async(
+        create_recurring_laundry_bookings,
+        user_id=callback.from_user.id,
+        machine_number=user_data['machine_number'],
+        first_date=first_date,
+        start_time=user_data['start_time'],
+        weeks=weeks
+    )
+
+    reasons = {
+        'past': "время уже прошло",
+        'schedule': "не по расписанию",
+        'window': "запись еще не открыта",
+        'taken': "слот занят",
+        'limit': "уже 2 записи в этот день",
+        'error': "ошибка записи"
+    }
+    start_time = user_data['start_time']
+    end_time = minutes_to_time(time_to_minutes(start_time) + 120)
+
+    response = (
+        f"🔁 Регулярная запись на машинку №{user_data['machine_number']}, "
+        f"{get_weekday_name(first_date)} {start_time}-{end_time}\n\n"
+    )
+    if created:
+        response += "✅ Созданы записи:\n" + "\n".join(
+            datetime.strptime(date, '%Y-%m-%d').strftime('%d.%m.%Y') for date in created
+        ) + "\n"
+    if skipped:
+        response += "\n⚠️ Пропущены даты:\n" + "\n".join(
+            f"{datetime.strptime(date, '%Y-%m-%d').strftime('%d.%m.%Y')} — {reasons[reason]}"
+            for date, reason in skipped
+        )
+
+    api_call_counter.record_booking(len(created))
+    await edit_message(callback.message, response, reply_markup=None)
+    await callback.answer()
+
+
+async def offer_freed_laundry_slot(bot, machine_number: int, booking_date: str, start_time: str,
+                                   allow_started: bool = False):
+    """
+    Предлагает освободившийся слот первому пользователю из листа ожидания.
+
+    allow_started — слот уже идет (снята неявка): предлагается его оставшееся время.
+    """
+    while True:
+        offer = await write_async(offer_laundry_slot_to_next_waiter, machine_number, booking_date, start_time, allow_started)
+        if not offer:
+            return
+
+        claim_minutes = int(get_system_setting('waitlist_claim_minutes') or 15)
+        builder = InlineKeyboardBuilder()
+        builder.button(text="✅ Занять слот", callback_data=f"waitlist_claim_{offer['id']}")
+
+        date_display = datetime.strptime(booking_date, '%Y-%m-%d').strftime('%d.%m.%Y')
+        started_note = "\nСлот уже идет: машинка свободна до его окончания." if allow_started else ""
+        try:
+            await bot.send_message(
+                offer['user_id'],
+                f"🔔 Освободился слот из вашего листа ожидания!\n"
+                f"🌀 Машинка №{machine_number}\n"
+                f"📅 Дата: {date_display}\n"
+                f"⏰ Время: {start_time}{started_note}\n\n"
+                f"У вас есть {claim_minutes} минут, чтобы занять его.",
+                reply_markup=builder.as_markup()
+            )
+        except Exception as e:
+            # Пользователь недоступен — передаем слот следующему
+            logger.error(f"Не удалось отправить предложение из листа ожидания: {e}")
+            await write_async(expire_laundry_waitlist_offer, offer['id'])
+            continue
+
+        # Неподтвержденное предложение снимает фоновая проверка (tasks.expire_waitlist_offers)
+        return
+
+
+@router.callback_query(F.data.startswith("waitlist_join_"))
+async def join_laundry_waitlist(callback: types.CallbackQuery):
+    """Добавляет пользователя в лист ожидания на выбранный слот"""
+    _, _, machine_number, booking_date, start_time = callback.data.split('_')
+
+    added = await write_async(
+        add_to_laundry_waitlist, callback.from_user.id, int(machine_number), booking_date, start_time
+    )
+    if added:
+        await callback.answer(f"🔔 Вы в листе ожидания на {start_time}", show_alert=True)
+    else:
+        await callback.answer("❌ Не удалось встать в лист ожидания", show_alert=True)
+
+
+@router.callback_query(F.data.startswith("waitlist_claim_"))
+async def claim_laundry_waitlist(callback: types.CallbackQuery):
+    """Подтверждение слота, предложенного из листа ожидания"""
+    waitlist_id = int(callback.data.split('_')[2])
+    success, reason = await write_async(claim_laundry_waitlist_offer, waitlist_id, callback.from_user.id)
+
+    if success:
+        await edit_message(
+            callback.message,
+            callback.message.text.split('\n\n')[0] + "\n\n✅ Слот закреплен за вами!",
+            reply_markup=None
+        )
+    else:
+        messages = {
+            'expired': "⌛ Время на подтверждение истекло",
+            'taken': "❌ Слот уже занят",
+            'limit': "❌ У вас уже 2 записи на этот день",
+            'not_found': "❌ Предложение больше не действительно"
+        }
+        await edit_message(callback.message, messages[reason], reply_markup=None)
+
+        if reason in ('expired', 'limit'):
+            # Пользователь не может занять слот — передаем его следующему
+            slot = await write_async(expire_laundry_waitlist_offer, waitlist_id)
+            if slot:
+                await offer_freed_laundry_slot(
+                    callback.bot, slot['machine_number'], slot['booking_date'], slot['start_time']
+                )
+
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("checkin_laundry_"))
+async def check_in_laundry(callback: types.CallbackQuery):
+    """Подтверждение прихода на стирку по кнопке из напоминания"""
+    booking_id = int(callback.data.split('_')[2])
+
+    if await write_async(check_in_laundry_booking, booking_id, callback.from_user.id):
+        await edit_message(
+            callback.message,
+            callback.message.text.split('\n\n')[0] + "\n\n✅ Приход подтвержден, приятной стирки!",
+            reply_markup=None
+        )
+    else:
+        await edit_message(callback.message, "❌ Запись уже неактивна", reply_markup=None)
+
+    await callback.answer()
+
+
 # Административные команды
 @router.message(Command("laundry_status"))
 async def show_laundry_status(message: types.Message):
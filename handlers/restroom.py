@@ -1,17 +1,24 @@
 from aiogram import Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
-from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime
+import clock
 from states import RestroomStates
+from dialog import show_dialog, start_dialog, edit_message, date_choice_markup
+from api_counter import api_call_counter
+from text_commands import text_commands
+from idempotency import current_idempotency_key
 
-from database import (
+from storage import (
     get_available_restroom_slots,
     create_restroom_booking,
+    write_async,
     get_user_restroom_bookings,
     cancel_restroom_booking,
     check_restroom_limit,
-    get_system_setting
+    get_system_setting,
+    find_nearest_restroom_slot
 )
 from utils import (
     is_valid_time,
@@ -22,114 +29,175 @@ from utils import (
 
 router = Router()
 
+# Горизонт поиска ближайшего свободного слота (в днях)
+NEAREST_SLOT_SEARCH_DAYS = 7
 
-@router.message(F.text == "Записаться в комнату отдыха")
+
+RESTROOM_DATE_PROMPT = "📅 Выберите дату или введите ее в формате ДД.ММ.ГГГГ:"
+
+# Варианты продолжительности записи (подпись -> минуты)
+DURATION_OPTIONS = {
+    "30 минут": 30,
+    "1 час": 60,
+    "1.5 часа": 90,
+    "2 часа": 120
+}
+
+
+def restroom_date_markup() -> types.InlineKeyboardMarkup:
+    """Клавиатура выбора даты записи в комнату отдыха"""
+    return date_choice_markup(
+        "restroom_date_",
+        extra_buttons=[("⚡ Ближайший свободный слот", "nearest_restroom")]
+    )
+
+
+@text_commands.command("Записаться в комнату отдыха")
 async def restroom_start(message: types.Message, state: FSMContext):
     """Начало процесса записи в комнату отдыха"""
+    await state.clear()
     await state.set_state(RestroomStates.choosing_date)
-    await message.reply("📅 На какую дату вы хотите записаться? (Формат: ДД.ММ.ГГГГ)")
+    await start_dialog(message, state, RESTROOM_DATE_PROMPT, restroom_date_markup())
 
 
 @router.message(RestroomStates.choosing_date)
 async def process_restroom_date(message: types.Message, state: FSMContext):
-    """Обработка выбранной даты"""
+    """Обработка введенной даты"""
     try:
         booking_date = datetime.strptime(message.text, '%d.%m.%Y').date()
-        today = datetime.now().date()
-
-        if booking_date < today:
-            await message.reply("❌ Нельзя записаться на прошедшую дату.")
-            return
-
-        available_slots = get_available_restroom_slots(booking_date)
-        if not available_slots:
-            await state.clear()
-            await message.reply("❌ На выбранную дату нет свободных слотов.")
-            return
-
-        # Сохраняем дату и готовим клавиатуру со слотами
-        await state.update_data(booking_date=booking_date.strftime('%Y-%m-%d'))
-
-        builder = ReplyKeyboardBuilder()
-        for slot in available_slots:
-            builder.add(types.KeyboardButton(text=slot['display']))
-        builder.adjust(2)
-
-        await state.set_state(RestroomStates.choosing_start)
-        await message.reply(
-            "⏰ Выберите время начала:",
-            reply_markup=builder.as_markup(resize_keyboard=True)
+    except (TypeError, ValueError):
+        await show_dialog(
+            message, state,
+            "❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ\n\n" + RESTROOM_DATE_PROMPT,
+            restroom_date_markup()
         )
+        return
+
+    await choose_restroom_start(message, state, booking_date)
+
+
+@router.callback_query(F.data.startswith("restroom_date_"), RestroomStates.choosing_date)
+async def process_restroom_date_button(callback: types.CallbackQuery, state: FSMContext):
+    """Обработка даты, выбранной кнопкой"""
+    booking_date = datetime.strptime(callback.data[len("restroom_date_"):], '%Y-%m-%d').date()
+    await choose_restroom_start(callback, state, booking_date)
+    await callback.answer()
 
-    except ValueError:
-        await message.reply("❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+
+async def choose_restroom_start(event, state: FSMContext, booking_date):
+    """Шаг выбора времени начала на выбранную дату"""
+    today = clock.today()
+
+    if booking_date < today:
+        await show_dialog(
+            event, state,
+            "❌ Нельзя записаться на прошедшую дату.\n\n" + RESTROOM_DATE_PROMPT,
+            restroom_date_markup()
+        )
+        return
+
+    available_slots = get_available_restroom_slots(booking_date)
+    if not available_slots:
+        await show_dialog(
+            event, state,
+            "❌ На выбранную дату нет свободных слотов.\n\n" + RESTROOM_DATE_PROMPT,
+            restroom_date_markup()
+        )
+        return
+
+    # Сохраняем дату и готовим клавиатуру со слотами
+    await state.update_data(booking_date=booking_date.strftime('%Y-%m-%d'))
+
+    builder = InlineKeyboardBuilder()
+    for slot in available_slots:
+        builder.button(text=slot['display'], callback_data=f"restroom_start_{slot['time']}")
+    builder.adjust(2)
+
+    await state.set_state(RestroomStates.choosing_start)
+    await show_dialog(
+        event, state,
+        f"📅 {format_date(booking_date)}\n⏰ Выберите время начала:",
+        builder.as_markup()
+    )
+
+
+@router.callback_query(F.data.startswith("restroom_start_"), RestroomStates.choosing_start)
+async def process_restroom_start_button(callback: types.CallbackQuery, state: FSMContext):
+    """Обработка времени начала, выбранного кнопкой"""
+    await choose_restroom_duration(callback, state, callback.data[len("restroom_start_"):])
+    await callback.answer()
 
 
 @router.message(RestroomStates.choosing_start)
 async def process_restroom_start(message: types.Message, state: FSMContext):
-    """Обработка выбранного времени начала"""
-    if not is_valid_time(message.text.split('-')[0]):
+    """Обработка введенного времени начала (ЧЧ:ММ или ЧЧ:ММ-ЧЧ:ММ)"""
+    start_time = (message.text or '').split('-')[0]
+    if not is_valid_time(start_time):
         await message.reply("❌ Неверный формат времени.")
         return
 
+    await choose_restroom_duration(message, state, start_time)
+
+
+async def choose_restroom_duration(event, state: FSMContext, start_time: str):
+    """Проверка времени начала и шаг выбора продолжительности"""
     user_data = await state.get_data()
-    booking_date = user_data['booking_date']
-    start_time = message.text.split('-')[0]  # Извлекаем время из формата "HH:MM-HH:MM"
+    date_obj = datetime.strptime(user_data['booking_date'], '%Y-%m-%d').date()
 
     # Проверяем доступность слота
-    date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
     available_slots = get_available_restroom_slots(date_obj)
-    slot_available = any(slot['display'] == message.text for slot in available_slots)
-
-    if not slot_available:
+    if not any(slot['time'] == start_time for slot in available_slots):
+        await show_dialog(event, state, "❌ Это время уже занято.")
         await state.clear()
-        await message.reply("❌ Это время уже занято.", reply_markup=types.ReplyKeyboardRemove())
         return
 
     await state.update_data(start_time=start_time)
 
-    # Подготовка клавиатуры с вариантами продолжительности
-    builder = ReplyKeyboardBuilder()
-    durations = ["30 минут", "1 час", "1.5 часа", "2 часа"]
-    for duration in durations:
-        builder.add(types.KeyboardButton(text=duration))
+    builder = InlineKeyboardBuilder()
+    for label, duration in DURATION_OPTIONS.items():
+        builder.button(text=label, callback_data=f"restroom_duration_{duration}")
     builder.adjust(2)
 
     await state.set_state(RestroomStates.choosing_duration)
-    await message.reply(
-        "⏳ Выберите продолжительность:",
-        reply_markup=builder.as_markup(resize_keyboard=True)
+    await show_dialog(
+        event, state,
+        f"📅 {format_date(date_obj)}, начало в {start_time}\n⏳ Выберите продолжительность:",
+        builder.as_markup()
     )
 
 
+@router.callback_query(F.data.startswith("restroom_duration_"), RestroomStates.choosing_duration)
+async def process_restroom_duration_button(callback: types.CallbackQuery, state: FSMContext):
+    """Обработка продолжительности, выбранной кнопкой"""
+    duration = int(callback.data[len("restroom_duration_"):])
+    await book_restroom_slot(callback, state, callback.from_user.id, duration)
+    await callback.answer()
+
+
 @router.message(RestroomStates.choosing_duration)
 async def process_restroom_duration(message: types.Message, state: FSMContext):
-    """Обработка выбранной продолжительности"""
-    duration_map = {
-        "30 минут": 30,
-        "1 час": 60,
-        "1.5 часа": 90,
-        "2 часа": 120
-    }
-
-    if message.text not in duration_map:
+    """Обработка введенной продолжительности"""
+    if message.text not in DURATION_OPTIONS:
         await message.reply("❌ Выберите вариант из списка.")
         return
 
-    duration = duration_map[message.text]
+    await book_restroom_slot(message, state, message.from_user.id, DURATION_OPTIONS[message.text])
+
+
+async def book_restroom_slot(event, state: FSMContext, user_id: int, duration: int):
+    """Проверка лимита и создание записи; результат показывается в сообщении диалога"""
     user_data = await state.get_data()
     booking_date = user_data['booking_date']
     start_time = user_data['start_time']
-    user_id = message.from_user.id
 
     # Проверка недельного лимита
-    can_book, remaining = check_restroom_limit(user_id, duration)
+    can_book, remaining = check_restroom_limit(user_id, booking_date, duration)
     if not can_book:
         remaining_hours = remaining // 60
         remaining_minutes = remaining % 60
-        await message.reply(
-            f"❌ Превышен недельный лимит. Доступно: {remaining_hours}ч {remaining_minutes}мин.",
-            reply_markup=types.ReplyKeyboardRemove()
+        await show_dialog(
+            event, state,
+            f"❌ Превышен недельный лимит. Доступно: {remaining_hours}ч {remaining_minutes}мин."
         )
         await state.clear()
         return
@@ -138,31 +206,119 @@ async def process_restroom_duration(message: types.Message, state: FSMContext):
     end_time = minutes_to_time(time_to_minutes(start_time) + duration)
 
     # Создание записи
-    if create_restroom_booking(
+    if await write_async(
+            create_restroom_booking,
             user_id=user_id,
             booking_date=booking_date,
             start_time=start_time,
             end_time=end_time,
-            duration=duration
+            duration=duration,
+            idempotency_key=current_idempotency_key()
     ):
+        api_call_counter.record_booking()
         # Получаем настройку уведомлений
         notify_minutes = get_system_setting('restroom_notification_minutes') or 15
 
-        await message.reply(
+        await show_dialog(
+            event, state,
             f"✅ Вы успешно записаны в комнату отдыха\n"
             f"📅 Дата: {format_date(datetime.strptime(booking_date, '%Y-%m-%d'))}\n"
             f"⏰ Время: {start_time}-{end_time}\n"
             f"⏳ Продолжительность: {duration} минут\n\n"
-            f"ℹ️ Вы получите уведомление за {notify_minutes} минут до времени записи.",
-            reply_markup=types.ReplyKeyboardRemove()
+            f"ℹ️ Вы получите уведомление за {notify_minutes} минут до времени записи."
+        )
+    else:
+        await show_dialog(event, state, "❌ Произошла ошибка при создании записи. Попробуйте позже.")
+
+    await state.clear()
+
+
+@router.callback_query(F.data == "nearest_restroom")
+async def show_nearest_restroom_slot(callback: types.CallbackQuery, state: FSMContext):
+    """Находит ближайшее свободное время в комнате отдыха"""
+    await state.clear()
+    slot = find_nearest_restroom_slot(NEAREST_SLOT_SEARCH_DAYS)
+
+    if not slot:
+        await edit_message(
+            callback.message,
+            f"❌ В ближайшие {NEAREST_SLOT_SEARCH_DAYS} дней нет свободных слотов.",
+            reply_markup=None
+        )
+        await callback.answer()
+        return
+
+    builder = InlineKeyboardBuilder()
+    for duration in range(30, slot['max_duration'] + 1, 30):
+        builder.button(
+            text=f"{duration} минут",
+            callback_data=f"quick_restroom_{slot['booking_date']}_{slot['start_time']}_{duration}"
+        )
+    builder.adjust(2)
+
+    await edit_message(
+        callback.message,
+        f"⚡ Ближайшее свободное время:\n"
+        f"📅 Дата: {format_date(datetime.strptime(slot['booking_date'], '%Y-%m-%d'))}\n"
+        f"⏰ Начало: {slot['start_time']}\n\n"
+        f"Выберите продолжительность:",
+        reply_markup=builder.as_markup()
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("quick_restroom_"))
+async def book_nearest_restroom_slot(callback: types.CallbackQuery):
+    """Запись на найденное ближайшее время в одно нажатие"""
+    _, _, booking_date, start_time, duration = callback.data.split('_')
+    duration = int(duration)
+    user_id = callback.from_user.id
+    end_time = minutes_to_time(time_to_minutes(start_time) + duration)
+
+    # Все 30-минутные слоты интервала должны быть по-прежнему свободны
+    available = {slot['time'] for slot in get_available_restroom_slots(datetime.strptime(booking_date, '%Y-%m-%d'))}
+    needed = {minutes_to_time(minute) for minute in range(time_to_minutes(start_time), time_to_minutes(end_time), 30)}
+    if not needed <= available:
+        await edit_message(callback.message, "❌ Это время уже заняли, попробуйте найти следующее.", reply_markup=None)
+        await callback.answer()
+        return
+
+    can_book, remaining = check_restroom_limit(user_id, booking_date, duration)
+    if not can_book:
+        await edit_message(
+            callback.message,
+            f"❌ Превышен недельный лимит. Доступно: {remaining // 60}ч {remaining % 60}мин.",
+            reply_markup=None
+        )
+        await callback.answer()
+        return
+
+    if await write_async(
+            create_restroom_booking,
+            user_id=user_id,
+            booking_date=booking_date,
+            start_time=start_time,
+            end_time=end_time,
+            duration=duration,
+            idempotency_key=current_idempotency_key()
+    ):
+        api_call_counter.record_booking()
+        await edit_message(
+            callback.message,
+            f"✅ Вы успешно записаны в комнату отдыха\n"
+            f"📅 Дата: {format_date(datetime.strptime(booking_date, '%Y-%m-%d'))}\n"
+            f"⏰ Время: {start_time}-{end_time}\n"
+            f"⏳ Продолжительность: {duration} минут",
+            reply_markup=None
         )
     else:
-        await message.reply(
+        await edit_message(
+            callback.message,
             "❌ Произошла ошибка при создании записи. Попробуйте позже.",
-            reply_markup=types.ReplyKeyboardRemove()
+            reply_markup=None
         )
 
-    await state.clear()
+    await callback.answer()
 
 
 @router.callback_query(F.data == "cancel_restroom")
@@ -184,25 +340,50 @@ async def cancel_restroom(callback: types.CallbackQuery):
         )
     builder.adjust(1)
 
-    await callback.message.edit_text(
+    await edit_message(
+        callback.message,
         "Выберите запись для отмены:",
         reply_markup=builder.as_markup()
     )
     await callback.answer()
 
 
+@router.callback_query(F.data == "cancel_restroom_menu")
+async def show_cancel_restroom_menu(callback: types.CallbackQuery):
+    """Показывает меню отмены записей в комнату отдыха"""
+    bookings = get_user_restroom_bookings(callback.from_user.id)
+
+    if not bookings:
+        await callback.answer("У вас нет активных записей", show_alert=True)
+        return
+
+    builder = InlineKeyboardBuilder()
+    for booking in bookings:
+        builder.button(
+            text=f"{booking['booking_date']} {booking['start_time']}-{booking['end_time']}",
+            callback_data=f"cancel_restroom_{booking['id']}"
+        )
+    builder.button(text="↩️ Назад", callback_data="my_bookings")
+    builder.adjust(1)
+
+    await edit_message(callback.message, "Выберите запись для отмены:", reply_markup=builder.as_markup())
+    await callback.answer()
+
+
 @router.callback_query(F.data.startswith("cancel_restroom_"))
 async def process_restroom_cancel(callback: types.CallbackQuery):
     """Подтверждение отмены записи"""
     booking_id = int(callback.data.split('_')[2])
 
-    if cancel_restroom_booking(booking_id):
-        await callback.message.edit_text(
+    if await write_async(cancel_restroom_booking, booking_id):
+        await edit_message(
+            callback.message,
             "✅ Запись успешно отменена",
             reply_markup=None
         )
     else:
-        await callback.message.edit_text(
+        await edit_message(
+            callback.message,
             "❌ Не удалось отменить запись",
             reply_markup=None
         )
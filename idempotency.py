@@ -0,0 +1,111 @@
+import os
+import time
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from typing import Dict, Hashable, Optional, Tuple
+
+from aiogram import BaseMiddleware
+
+# Сколько секунд повтор того же нажатия или текста считается двойным нажатием
+ACTION_DEDUP_SECONDS = float(os.getenv('DORM_BOT_DEDUP_SECONDS', '2'))
+
+# Сколько помнить обработанные обновления (повторная доставка после сбоя соединения)
+UPDATE_DEDUP_SECONDS = 3600
+
+# Предельный размер каждого множества ключей
+DEDUP_MAX_KEYS = 10000
+
+# Ключ идемпотентности текущего обновления (передается в создание записей)
+_current_key: ContextVar[Optional[str]] = ContextVar('idempotency_key', default=None)
+
+
+def current_idempotency_key() -> Optional[str]:
+    """
+    Ключ идемпотентности обрабатываемого обновления.
+
+    Одинаков при повторной доставке того же обновления, в том числе после перезапуска бота,
+    поэтому запись с этим ключом создается в БД не больше одного раза.
+    """
+    return _current_key.get()
+
+
+class RecentKeys:
+    """Ограниченное множество недавно встреченных ключей: каждый живет ttl секунд, всего не больше max_size"""
+
+    def __init__(self, ttl: float, max_size: int = DEDUP_MAX_KEYS):
+        self.ttl = ttl
+        self.max_size = max_size
+        # Ключи в порядке добавления, то есть и в порядке устаревания
+        self._seen: 'OrderedDict[Hashable, float]' = OrderedDict()
+
+    def seen(self, key: Hashable) -> bool:
+        """Запоминает ключ и возвращает True, если он уже встречался за последние ttl секунд"""
+        now = time.monotonic()
+        while self._seen:
+            oldest, stamp = next(iter(self._seen.items()))
+            if now - stamp < self.ttl:
+                break
+            self._seen.popitem(last=False)
+
+        if key in self._seen:
+            return True
+        self._seen[key] = now
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return False
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+
+def action_key(update) -> Optional[Tuple]:
+    """Ключ действия пользователя: (пользователь, тип события, данные кнопки или текст)"""
+    if update.callback_query is not None:
+        event = update.callback_query
+        return event.from_user.id, 'callback', event.data
+    if update.message is not None and update.message.text is not None:
+        event = update.message
+        return event.from_user.id, 'message', event.text
+    return None
+
+
+class IdempotencyMiddleware(BaseMiddleware):
+    """
+    Отбрасывает повторы до обработчиков.
+
+    Регистрируется как внешний middleware обновлений. Повторно доставленное обновление
+    (тот же update_id) и двойное нажатие (то же действие пользователя в пределах
+    ACTION_DEDUP_SECONDS) не доходят до обработчиков и БД; на повторное нажатие кнопки
+    бот только отвечает на callback, чтобы у пользователя не висели часики.
+    """
+
+    def __init__(self, action_ttl: float = ACTION_DEDUP_SECONDS, update_ttl: float = UPDATE_DEDUP_SECONDS):
+        self.updates = RecentKeys(update_ttl)
+        self.actions = RecentKeys(action_ttl)
+        self.skipped = Counter()
+
+    async def __call__(self, handler, event, data):
+        if self.updates.seen(event.update_id):
+            self.skipped['updates'] += 1
+            return None
+
+        key = action_key(event)
+        if key is not None and self.actions.seen(key):
+            self.skipped['actions'] += 1
+            if event.callback_query is not None:
+                await event.callback_query.answer()
+            return None
+
+        user = key[0] if key is not None else 0
+        token = _current_key.set(f"{user}:{event.update_id}")
+        try:
+            return await handler(event, data)
+        finally:
+            _current_key.reset(token)
+
+    def stats(self) -> Dict[str, int]:
+        """Отброшенные повторы: обновления и двойные нажатия"""
+        return {'updates': self.skipped['updates'], 'actions': self.skipped['actions']}
+
+
+idempotency_middleware = IdempotencyMiddleware()
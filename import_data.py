@@ -0,0 +1,368 @@
+"""
+Массовый импорт пользователей, настроек и записей (перенос общежития с бумаги или таблиц).
+
+Файлы читаются потоково (CSV или JSON Lines, можно сжатые .gz), каждая строка проверяется
+по правилам расписания и уже существующим записям (включая строки, импортированные раньше
+в этом же запуске), подходящие строки вставляются пачками executemany, по одной транзакции
+на пачку. После импорта пересчитываются недельные лимиты комнаты отдыха, таблица загрузки
+и занятость слотов.
+Отклоненные строки с причиной записываются в отдельный CSV.
+
+Использование:
+    python import_data.py [--settings settings.csv] [--users users.csv]
+                          [--laundry laundry.csv] [--restroom restroom.jsonl.gz]
+                          [--db dorm_bot.db] [--batch 1000] [--rejects rejects.csv] [--dry-run]
+
+Колонки:
+    settings: setting_name, setting_value
+    users:    user_id, username (необязательно), is_admin (необязательно; пустые поля
+              не меняют уже существующего пользователя)
+    laundry:  user_id, machine_number, booking_date, start_time, end_time (необязательно), status
+    restroom: user_id, booking_date, start_time, end_time или duration, status
+
+Дата — ГГГГ-ММ-ДД или ДД.ММ.ГГГГ, время — ЧЧ:ММ, status по умолчанию active.
+Порядок импорта: настройки (влияют на расписание), пользователи, прачечная, комната отдыха.
+"""
+import argparse
+import csv
+import gzip
+import json
+import time
+from collections import Counter
+from datetime import date, datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import database
+from database import (
+    init_db,
+    booking_week,
+    get_all_settings,
+    get_all_machines,
+    get_laundry_slot_template,
+    get_user_ids,
+    get_active_laundry_occupancy,
+    get_active_restroom_occupancy,
+    hash_username,
+    import_users,
+    import_laundry_bookings,
+    import_restroom_bookings,
+    rebuild_restroom_limits,
+    rebuild_slot_occupancy,
+    rebuild_utilization_rollups,
+    update_schedule_settings,
+    update_system_setting,
+    LEGACY_SCHEDULE_SETTINGS,
+    RESTROOM_OPEN_MIN,
+    RESTROOM_CLOSE_MIN,
+    RESTROOM_SLOT_MIN
+)
+from schedule import LAUNDRY_SLOT_MINUTES
+from utils import date_to_day_number, is_valid_time, minutes_to_time
+
+BOOKING_STATUSES = ('active', 'cancelled', 'no_show')
+
+# Допустимая длительность записи в комнату отдыха (как в кнопках бота)
+RESTROOM_MIN_DURATION = 30
+RESTROOM_MAX_DURATION = 120
+
+
+class RowError(ValueError):
+    """Строка не прошла проверку; текст — причина отказа"""
+
+
+def read_rows(path: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Потоково читает строки CSV или JSON Lines (в том числе сжатые gzip): (номер строки файла, строка)"""
+    name = path[:-3] if path.endswith('.gz') else path
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8-sig', newline='') as file:
+        if name.endswith(('.jsonl', '.json')):
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield line_number, row if isinstance(row, dict) else None
+        else:
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+
+
+def field(row: Dict, name: str, required: bool = True) -> Optional[str]:
+    value = row.get(name)
+    value = '' if value is None else str(value).strip()
+    if not value:
+        if required:
+            raise RowError(f"нет поля {name}")
+        return None
+    return value
+
+
+def parse_int(row: Dict, name: str, required: bool = True) -> Optional[int]:
+    value = field(row, name, required)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise RowError(f"{name} не число")
+
+
+def parse_day(row: Dict) -> date:
+    value = field(row, 'booking_date')
+    for date_format in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise RowError("неверная дата")
+
+
+def parse_minutes(row: Dict, name: str, required: bool = True) -> Optional[int]:
+    value = field(row, name, required)
+    if value is None:
+        return None
+    if not is_valid_time(value):
+        raise RowError(f"неверное время {name}")
+    hours, minutes = map(int, value.split(':'))
+    return hours * 60 + minutes
+
+
+def parse_status(row: Dict) -> str:
+    status = field(row, 'status', required=False) or 'active'
+    if status not in BOOKING_STATUSES:
+        raise RowError("неизвестный статус")
+    return status
+
+
+class Importer:
+    """
+    Проверяет и импортирует строки.
+
+    Занятость слотов, дневные и недельные лимиты держатся в памяти: они загружаются из БД
+    один раз и пополняются принятыми строками, поэтому проверка не обращается к БД.
+    """
+
+    def __init__(self, batch_size: int = 1000, dry_run: bool = False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.inserted = Counter()
+        self.rejected = Counter()
+        self.reasons = Counter()
+        self.rejects: List[Dict[str, str]] = []
+
+        self.users = get_user_ids()
+        self.machines = {machine['machine_number'] for machine in get_all_machines()}
+        self.templates: Dict[date, frozenset] = {}
+
+        self.laundry_slots = set()
+        self.laundry_user_days = Counter()
+        for user_id, machine_number, day_number, start_min in get_active_laundry_occupancy():
+            self.laundry_slots.add((day_number, machine_number, start_min))
+            self.laundry_user_days[(user_id, day_number)] += 1
+
+        self.restroom_intervals: Dict[int, List[Tuple[int, int]]] = {}
+        self.restroom_week_minutes = Counter()
+        for user_id, day_number, start_min, end_min, duration in get_active_restroom_occupancy():
+            self.restroom_intervals.setdefault(day_number, []).append((start_min, end_min))
+            self.restroom_week_minutes[(user_id, *booking_week(day_number))] += duration
+
+    def slot_template(self, day: date) -> frozenset:
+        if day not in self.templates:
+            self.templates[day] = frozenset(get_laundry_slot_template(day))
+        return self.templates[day]
+
+    def run(self, kind: str, path: str, parse: Callable[[Dict], Tuple], insert: Callable[[List[Tuple]], int]):
+        """Проверяет строки файла и вставляет подходящие пачками по batch_size"""
+        batch = []
+        for line_number, row in read_rows(path):
+            if row is None:
+                self.reject(kind, path, line_number, {}, "неверная строка JSON")
+                continue
+            try:
+                batch.append(parse(row))
+            except RowError as e:
+                self.reject(kind, path, line_number, row, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self.flush(kind, batch, insert)
+                batch = []
+        self.flush(kind, batch, insert)
+
+    def flush(self, kind: str, batch: List[Tuple], insert: Callable[[List[Tuple]], int]):
+        if batch:
+            self.inserted[kind] += len(batch) if self.dry_run else insert(batch)
+
+    def reject(self, kind: str, path: str, line_number: int, row: Dict, reason: str):
+        self.rejected[kind] += 1
+        self.reasons[(kind, reason)] += 1
+        self.rejects.append({
+            'file': path,
+            'line': line_number,
+            'reason': reason,
+            'row': json.dumps(row, ensure_ascii=False)
+        })
+
+    def parse_user(self, row: Dict) -> Tuple[int, Optional[str], Optional[int]]:
+        """Пустые или отсутствующие username и is_admin не меняют существующего пользователя"""
+        user_id = parse_int(row, 'user_id')
+        username = field(row, 'username', required=False)
+        is_admin = parse_int(row, 'is_admin', required=False)
+        self.users.add(user_id)
+        return (
+            user_id,
+            hash_username(username) if username is not None else None,
+            None if is_admin is None else int(bool(is_admin))
+        )
+
+    def parse_laundry(self, row: Dict) -> Tuple:
+        user_id = parse_int(row, 'user_id')
+        if user_id not in self.users:
+            raise RowError("неизвестный пользователь")
+        machine_number = parse_int(row, 'machine_number')
+        if machine_number not in self.machines:
+            raise RowError("нет такой машинки")
+        day = parse_day(row)
+        start_min = parse_minutes(row, 'start_time')
+        end_min = parse_minutes(row, 'end_time', required=False)
+        if end_min is None:
+            end_min = start_min + LAUNDRY_SLOT_MINUTES
+        if end_min - start_min != LAUNDRY_SLOT_MINUTES:
+            raise RowError("длительность стирки не равна слоту")
+        if start_min not in self.slot_template(day):
+            raise RowError("слот вне расписания")
+        status = parse_status(row)
+
+        day_number = date_to_day_number(day)
+        if status == 'active':
+            if (day_number, machine_number, start_min) in self.laundry_slots:
+                raise RowError("слот занят")
+            if self.laundry_user_days[(user_id, day_number)] >= 2:
+                raise RowError("больше 2 записей в день")
+            self.laundry_slots.add((day_number, machine_number, start_min))
+            self.laundry_user_days[(user_id, day_number)] += 1
+
+        return (user_id, machine_number, day.strftime('%Y-%m-%d'), minutes_to_time(start_min),
+                minutes_to_time(end_min), status, day_number, start_min, end_min)
+
+    def parse_restroom(self, row: Dict, max_weekly_minutes: int) -> Tuple:
+        user_id = parse_int(row, 'user_id')
+        if user_id not in self.users:
+            raise RowError("неизвестный пользователь")
+        day = parse_day(row)
+        start_min = parse_minutes(row, 'start_time')
+        end_min = parse_minutes(row, 'end_time', required=False)
+        if end_min is None:
+            duration = parse_int(row, 'duration')
+            end_min = start_min + duration
+        duration = end_min - start_min
+        if not RESTROOM_MIN_DURATION <= duration <= RESTROOM_MAX_DURATION:
+            raise RowError("недопустимая длительность")
+        if start_min % RESTROOM_SLOT_MIN or duration % RESTROOM_SLOT_MIN:
+            raise RowError("время не кратно 30 минутам")
+        if start_min < RESTROOM_OPEN_MIN or end_min > RESTROOM_CLOSE_MIN:
+            raise RowError("вне часов работы")
+        status = parse_status(row)
+
+        day_number = date_to_day_number(day)
+        if status == 'active':
+            intervals = self.restroom_intervals.setdefault(day_number, [])
+            if any(start < end_min and end > start_min for start, end in intervals):
+                raise RowError("пересечение с другой записью")
+            week_key = (user_id, *booking_week(day_number))
+            if self.restroom_week_minutes[week_key] + duration > max_weekly_minutes:
+                raise RowError("превышен недельный лимит")
+            intervals.append((start_min, end_min))
+            self.restroom_week_minutes[week_key] += duration
+
+        return (user_id, day.strftime('%Y-%m-%d'), minutes_to_time(start_min), minutes_to_time(end_min),
+                duration, status, day_number, start_min, end_min)
+
+
+def import_settings(importer: Importer, path: str):
+    """Настройки импортируются по одной: их мало, а расписание надо применять сразу"""
+    known = get_all_settings()
+    for line_number, row in read_rows(path):
+        try:
+            if row is None:
+                raise RowError("неверная строка JSON")
+            name = field(row, 'setting_name')
+            value = field(row, 'setting_value', required=False) or ''
+            if name not in known and name not in LEGACY_SCHEDULE_SETTINGS:
+                raise RowError("неизвестная настройка")
+            if name in LEGACY_SCHEDULE_SETTINGS:
+                if value and not is_valid_time(value):
+                    raise RowError("неверное время")
+                saved = importer.dry_run or update_schedule_settings(name, value)
+            else:
+                saved = importer.dry_run or update_system_setting(name, value)
+            if not saved:
+                raise RowError("ошибка записи")
+        except RowError as e:
+            importer.reject('settings', path, line_number, row, str(e))
+            continue
+        importer.inserted['settings'] += 1
+
+
+def write_rejects(path: str, rejects: List[Dict[str, str]]):
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['file', 'line', 'reason', 'row'])
+        writer.writeheader()
+        writer.writerows(rejects)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт пользователей, настроек и записей")
+    parser.add_argument('--settings')
+    parser.add_argument('--users')
+    parser.add_argument('--laundry')
+    parser.add_argument('--restroom')
+    parser.add_argument('--db', default=database.DB_PATH)
+    parser.add_argument('--batch', type=int, default=1000, help="Строк в одной транзакции")
+    parser.add_argument('--rejects', default='import_rejects.csv', help="Куда записать отклоненные строки")
+    parser.add_argument('--dry-run', action='store_true', help="Только проверить, ничего не записывая")
+    args = parser.parse_args()
+
+    database.set_db_path(args.db)
+    init_db()
+    started = time.perf_counter()
+
+    # Настройки меняют расписание, по которому проверяются записи, поэтому идут первыми
+    importer = Importer(args.batch, args.dry_run)
+    if args.settings:
+        import_settings(importer, args.settings)
+        importer.templates.clear()
+    if args.users:
+        importer.run('users', args.users, importer.parse_user, import_users)
+    if args.laundry:
+        importer.run('laundry', args.laundry, importer.parse_laundry, import_laundry_bookings)
+    if args.restroom:
+        max_weekly_minutes = int(get_all_settings().get('restroom_max_weekly_minutes') or 240)
+        importer.run('restroom', args.restroom,
+                     lambda row: importer.parse_restroom(row, max_weekly_minutes), import_restroom_bookings)
+
+    if not args.dry_run and (importer.inserted['laundry'] or importer.inserted['restroom']):
+        limits = rebuild_restroom_limits()
+        rollups = rebuild_utilization_rollups()
+        slots = rebuild_slot_occupancy()
+        print(f"Пересчитано: недельных лимитов {limits}, строк загрузки {rollups}, занятых слотов {slots}")
+    database.close_connections()
+    elapsed = time.perf_counter() - started
+
+    title = "Проверено" if args.dry_run else "Импортировано"
+    for kind in ('settings', 'users', 'laundry', 'restroom'):
+        if importer.inserted[kind] or importer.rejected[kind]:
+            print(f"{kind}: {title.lower()} {importer.inserted[kind]}, отклонено {importer.rejected[kind]}")
+    for (kind, reason), count in importer.reasons.most_common():
+        print(f"  {kind}: {reason} — {count}")
+    print(f"{title} за {elapsed:.1f} с")
+
+    if importer.rejects:
+        write_rejects(args.rejects, importer.rejects)
+        print(f"Отклоненные строки: {args.rejects}")
+
+
+if __name__ == '__main__':
+    main()
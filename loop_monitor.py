@@ -0,0 +1,150 @@
+import asyncio
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Задержка цикла событий, начиная с которой снимается стек блокирующего кода
+LOOP_LAG_THRESHOLD_SECONDS = float(os.getenv('DORM_BOT_LAG_THRESHOLD_MS', '100')) / 1000
+
+# Интервал измерения задержки
+LOOP_LAG_INTERVAL_SECONDS = 0.1
+
+# Верхние границы корзин гистограммы задержки, мс (последняя — все остальное)
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+# Файлы проекта, по которым группируются места блокировки
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopLagMonitor:
+    """
+    Сторож цикла событий.
+
+    Фоновая задача засыпает на interval секунд и измеряет, насколько позже она проснулась:
+    это время цикл был занят чужим синхронным кодом. Отдельный поток следит за отметкой
+    последнего пробуждения и, если цикл не отвечает дольше threshold секунд, снимает стек
+    потока цикла (sys._current_frames) — то есть код, который блокирует его прямо сейчас.
+    """
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD_SECONDS,
+                 interval: float = LOOP_LAG_INTERVAL_SECONDS, max_stalls: int = 20):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_stalls = max_stalls
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.stall_sites: Counter = Counter()
+        self.recent_stalls: List[Tuple[float, str]] = []
+        self._heartbeat = time.monotonic()
+        self._captured = False
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Запускает измерение в текущем цикле событий и поток-сторож"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def record(self, lag: float):
+        """Учитывает одно измерение задержки (в секундах)"""
+        lag = max(lag, 0.0)
+        self.histogram[bisect.bisect_left(LAG_BUCKETS_MS, lag * 1000)] += 1
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+
+    async def _measure(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            woke = time.monotonic()
+            self.record(woke - started - self.interval)
+            self._heartbeat = woke
+            self._captured = False
+
+    def _watch(self):
+        # Опрашиваем чаще порога, чтобы застать блокирующий код на месте
+        poll = min(self.interval, self.threshold) / 2
+        while not self._stopped.wait(poll):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled >= self.threshold and not self._captured:
+                self._captured = True
+                self._capture(stalled)
+
+    def _capture(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        site = blocking_site(stack)
+        self.stall_sites[site] += 1
+        self.recent_stalls.append((time.time(), site))
+        del self.recent_stalls[:-self.max_stalls]
+        logger.warning(
+            f"Цикл событий заблокирован уже {stalled * 1000:.0f} мс, место: {site}\n"
+            + "".join(traceback.format_list(stack[-12:]))
+        )
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Верхняя граница корзины, в которую попадает заданная доля измерений (мс)"""
+        if not self.samples:
+            return None
+        target = self.samples * fraction
+        seen = 0
+        for bound, count in zip(LAG_BUCKETS_MS + (float('inf'),), self.histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def stats(self) -> Dict[str, object]:
+        """Гистограмма задержки и самые частые места блокировки"""
+        labels = [f"≤{bound} мс" for bound in LAG_BUCKETS_MS] + [f">{LAG_BUCKETS_MS[-1]} мс"]
+        return {
+            'samples': self.samples,
+            'max_ms': round(self.max_lag * 1000, 1),
+            'p50_ms': self.percentile(0.5),
+            'p99_ms': self.percentile(0.99),
+            'histogram': {label: count for label, count in zip(labels, self.histogram) if count},
+            'stalls': sum(self.stall_sites.values()),
+            'top_sites': self.stall_sites.most_common(5),
+        }
+
+
+def blocking_site(stack: traceback.StackSummary) -> str:
+    """Самый глубокий кадр из файлов проекта (иначе самый глубокий вообще): файл:строка функция"""
+    for frame in reversed(stack):
+        if frame.filename.startswith(PROJECT_DIR) and 'site-packages' not in frame.filename:
+            return f"{os.path.relpath(frame.filename, PROJECT_DIR)}:{frame.lineno} {frame.name}"
+    if stack:
+        frame = stack[-1]
+        return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+    return "неизвестно"
+
+
+loop_monitor = LoopLagMonitor()
@@ -9,7 +9,15 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 
 from handlers import common, laundry, restroom, admin
-from database import init_db
+import text_commands
+from storage import STORAGE_BACKEND, create_storage, set_storage
+from tasks import check_and_send_notifications
+from api_counter import api_call_counter
+from loop_monitor import loop_monitor
+from backup import run_scheduled_backups
+from outbox import outbox_dispatcher
+from tracing_middleware import TracedStorage, TracingMiddleware, TracingRequestMiddleware
+from idempotency import idempotency_middleware
 
 # Инициализация
 load_dotenv()
@@ -21,9 +29,19 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 
-dp = Dispatcher(storage=MemoryStorage())
+# Подсчет исходящих вызовов Bot API
+bot.session.middleware(api_call_counter)
 
-# Включение роутеров
+# Трассировка обновлений: отрезки хранилища FSM, функций БД и вызовов Bot API
+bot.session.middleware(TracingRequestMiddleware())
+dp = Dispatcher(storage=TracedStorage(MemoryStorage()))
+dp.update.outer_middleware(TracingMiddleware())
+
+# Повторно доставленные обновления и двойные нажатия отбрасываются до обработчиков
+dp.update.outer_middleware(idempotency_middleware)
+
+# Включение роутеров: команды reply-клавиатуры разбираются первыми, одним поиском в таблице
+dp.include_router(text_commands.router)
 dp.include_router(common.router)
 dp.include_router(admin.router)
 dp.include_router(laundry.router)
@@ -33,20 +51,40 @@ dp.include_router(restroom.router)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Инициализация БД
-init_db()
+# Инициализация хранилища (DORM_BOT_STORAGE)
+storage = create_storage(STORAGE_BACKEND)
+set_storage(storage)
+storage.init()
+
+# Фоновые задачи бота
+background_tasks = set()
 
 async def on_startup(dispatcher: Dispatcher):
-    asyncio.create_task(check_and_send_notifications())
+    coros = [check_and_send_notifications(bot), outbox_dispatcher.run(bot)]
+    # Резервные копии делаются только для файла БД
+    if STORAGE_BACKEND == 'sqlite':
+        coros.append(run_scheduled_backups())
+    for coro in coros:
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    loop_monitor.start()
     logger.info("Бот запущен")
 
 async def on_shutdown(dispatcher: Dispatcher):
+    for task in background_tasks:
+        task.cancel()
+    loop_monitor.stop()
     await bot.session.close()
+    storage.close()
     logger.info("Бот остановлен")
 
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
 async def main():
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot, on_startup=on_startup, on_shutdown=on_shutdown)
+    await dp.start_polling(bot)
 
 if __name__ == "__main__":
     try:
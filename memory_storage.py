@@ -0,0 +1,859 @@
+import itertools
+import threading
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+import clock
+from database import (
+    DEFAULT_SETTINGS,
+    EXPORT_COLUMNS,
+    LEGACY_SCHEDULE_SETTINGS,
+    OUTBOX_DEAD,
+    OUTBOX_PENDING,
+    OUTBOX_SENT,
+    RESTROOM_OPEN_MIN,
+    RESTROOM_CLOSE_MIN,
+    RESTROOM_SLOT_MIN,
+    as_day,
+    booking_time_values,
+    booking_window_from_settings,
+    default_schedule_rule_rows,
+    booking_week,
+    hash_username,
+    slot_started,
+    split_by_hours
+)
+from schedule import (
+    LAUNDRY_SLOT_MINUTES,
+    BookingWindow,
+    ScheduleRule,
+    SlotTemplateCache,
+    free_slot_starts,
+    occupied_steps
+)
+from storage import Booking, Storage
+from utils import (
+    RESTROOM_RESOURCE,
+    date_to_day_number,
+    date_str_to_day_number,
+    day_number_to_str,
+    get_nearest_available_time,
+    laundry_resource,
+    minutes_to_time,
+    time_to_minutes,
+    to_minute_stamp
+)
+
+# Машинки, создаваемые при запуске (как в init_db)
+DEFAULT_MACHINES = (1, 2, 3)
+
+
+def locked(method):
+    """Выполняет метод под блокировкой хранилища (обработчики, писатель очереди и фоновые задачи)"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class MemoryStorage(Storage):
+    """
+    Хранилище в памяти процесса: один узел без файла БД, тесты и симуляции.
+
+    Методы интерфейса Storage ведут себя так же, как функции database.py. Записи, лист
+    ожидания и правила расписания хранятся словарями в формате строк таблиц, активные
+    записи дополнительно индексируются по номеру дня, поэтому проверки занятости не
+    перебирают всю историю. Статистика загрузки считается по активным записям при запросе.
+    Администраторы назначаются через set_admin.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self.users: Dict[int, Dict[str, Union[int, str]]] = {}
+        self.machines: Dict[int, str] = {machine: 'active' for machine in DEFAULT_MACHINES}
+        self.settings: Dict[str, str] = {
+            name: value for name, value, _ in DEFAULT_SETTINGS if value is not None
+        }
+        rule_rows = default_schedule_rule_rows(self.settings)
+        self.rules: List[ScheduleRule] = [
+            ScheduleRule(rule_id, rule_type, weekday, None, start_min, end_min, description)
+            for rule_id, (rule_type, weekday, start_min, end_min, description, _)
+            in enumerate(rule_rows, start=1)
+        ]
+        # Правила, заданные старыми настройками: {ключ настройки: id правила}
+        self._legacy_rules: Dict[str, int] = {row[5]: rule_id for rule_id, row in enumerate(rule_rows, start=1)}
+        self._rule_ids = itertools.count(len(rule_rows) + 1)
+        self._templates = SlotTemplateCache(lambda: self.rules)
+
+        self.laundry: Dict[int, Dict] = {}
+        self.restroom: Dict[int, Dict] = {}
+        # Активные записи по номеру дня: {день: {id записи, ...}}
+        self._laundry_days: Dict[int, Set[int]] = {}
+        self._restroom_days: Dict[int, Set[int]] = {}
+        self.restroom_limits: Dict[Tuple[int, int, int], int] = {}
+        # Лист ожидания прачечной в формате строк таблицы laundry_waitlist
+        self.waitlist: Dict[int, Dict] = {}
+        self._waitlist_ids = itertools.count(1)
+        # Ключи идемпотентности созданных записей: {(тип записи, ключ): id записи}
+        self._idempotency_keys: Dict[Tuple[str, str], int] = {}
+        # Очередь исходящих уведомлений в формате строк таблицы outbox
+        self.outbox: Dict[int, Dict] = {}
+        self._outbox_ids = itertools.count(1)
+
+    # Служебное
+
+    def _active(self, table: Dict[int, Dict], index: Dict[int, Set[int]], day_number: int) -> List[Dict]:
+        return [table[booking_id] for booking_id in index.get(day_number, ())]
+
+    def _deactivate(self, booking: Dict, index: Dict[int, Set[int]], status: str):
+        booking['status'] = status
+        index[booking['day_number']].discard(booking['id'])
+
+    def _laundry_interval_free(self, day_number: int, machine_number: int, start_min: int, end_min: int) -> bool:
+        return not any(
+            b['machine_number'] == machine_number and b['start_min'] < end_min and b['end_min'] > start_min
+            for b in self._active(self.laundry, self._laundry_days, day_number)
+        )
+
+    def _laundry_count(self, user_id: int, day_number: int) -> int:
+        return sum(1 for b in self._active(self.laundry, self._laundry_days, day_number) if b['user_id'] == user_id)
+
+    def _insert_laundry(self, user_id: int, machine_number: int, booking_date: str, start_time: str,
+                        end_time: str, day_number: int, start_min: int, end_min: int, checked_in: int = 0) -> int:
+        booking_id = next(self._ids)
+        self.laundry[booking_id] = {
+            'id': booking_id, 'user_id': user_id, 'machine_number': machine_number,
+            'booking_date': booking_date, 'start_time': start_time, 'end_time': end_time,
+            'status': 'active', 'notified': checked_in, 'checked_in': checked_in,
+            'day_number': day_number, 'start_min': start_min, 'end_min': end_min
+        }
+        self._laundry_days.setdefault(day_number, set()).add(booking_id)
+        return booking_id
+
+    # Запуск и остановка: данные живут только в памяти процесса
+
+    def init(self):
+        pass
+
+    def close(self):
+        pass
+
+    # Пользователи
+
+    @locked
+    def create_or_update_user(self, user_id: int, username: str) -> bool:
+        self.users.setdefault(user_id, {'username_hash': hash_username(username), 'is_admin': 0})
+        return True
+
+    @locked
+    def is_admin(self, user_id: int) -> bool:
+        user = self.users.get(user_id)
+        return bool(user and user['is_admin'] == 1)
+
+    @locked
+    def set_admin(self, user_id: int, admin: bool = True):
+        """Назначает администратора (в SQLite это делается правкой таблицы users или импортом)"""
+        self.users.setdefault(user_id, {'username_hash': None, 'is_admin': 0})['is_admin'] = int(admin)
+
+    # Машинки
+
+    @locked
+    def get_available_machines(self) -> List[int]:
+        return [machine for machine, status in sorted(self.machines.items()) if status == 'active']
+
+    @locked
+    def get_all_machines(self) -> List[Dict[str, Union[int, str]]]:
+        return [{'machine_number': machine, 'status': status} for machine, status in sorted(self.machines.items())]
+
+    @locked
+    def update_machine_status(self, machine_number: int, status: str) -> bool:
+        if machine_number not in self.machines:
+            return False
+        self.machines[machine_number] = status
+        return True
+
+    @locked
+    def handle_machine_outage(self, machine_number: int, notice: Optional[Callable[[Dict], str]] = None
+                              ) -> Dict[str, List[Booking]]:
+        now_stamp = to_minute_stamp(clock.now())
+        result = {'moved': [], 'cancelled': []}
+        if machine_number in self.machines:
+            self.machines[machine_number] = 'inactive'
+        other_machines = [m for m, status in sorted(self.machines.items()) if status == 'active']
+
+        bookings = sorted(
+            (b for b in self.laundry.values()
+             if b['machine_number'] == machine_number and b['status'] == 'active'
+             and b['day_number'] * 1440 + b['start_min'] > now_stamp),
+            key=lambda b: (b['day_number'], b['start_min'], b['id'])
+        )
+        for stored in bookings:
+            booking = {key: stored[key] for key in ('id', 'user_id', 'machine_number', 'booking_date', 'start_time', 'end_time')}
+            new_machine = next(
+                (m for m in other_machines
+                 if self._laundry_interval_free(stored['day_number'], m, stored['start_min'], stored['end_min'])),
+                None
+            )
+            if new_machine:
+                stored['machine_number'] = new_machine
+                booking['new_machine_number'] = new_machine
+                result['moved'].append(booking)
+            else:
+                self._deactivate(stored, self._laundry_days, 'cancelled')
+                result['cancelled'].append(booking)
+
+        if notice:
+            lines: Dict[int, List[str]] = {}
+            for booking in result['moved'] + result['cancelled']:
+                lines.setdefault(booking['user_id'], []).append(notice(booking))
+            for user_id, user_lines in lines.items():
+                self._enqueue(user_id, "\n\n".join(user_lines), 'outage')
+        return result
+
+    # Настройки
+
+    @locked
+    def get_system_setting(self, setting_name: str) -> Optional[str]:
+        return self.settings.get(setting_name)
+
+    @locked
+    def update_system_setting(self, setting_name: str, setting_value: str) -> bool:
+        self.settings[setting_name] = setting_value
+        return True
+
+    @locked
+    def get_all_settings(self) -> Dict[str, str]:
+        return dict(self.settings)
+
+    def get_booking_window(self) -> BookingWindow:
+        return booking_window_from_settings(self.get_all_settings())
+
+    # Расписание прачечной
+
+    @locked
+    def get_laundry_slot_template(self, date) -> Tuple[int, ...]:
+        return self._templates.template(as_day(date))
+
+    def get_laundry_slot_times(self, date) -> List[str]:
+        return [minutes_to_time(slot) for slot in self.get_laundry_slot_template(date)]
+
+    @locked
+    def get_schedule_rules(self) -> List[ScheduleRule]:
+        # Порядок как в SQLite: сначала правила на даты, затем каждый день, затем дни недели
+        return sorted(self.rules, key=lambda rule: (
+            rule.rule_date is None, rule.rule_date or '',
+            rule.weekday is not None, rule.weekday or 0,
+            rule.rule_type, rule.start_min is not None, rule.start_min or 0
+        ))
+
+    @locked
+    def add_schedule_rule(self, rule_type: str, weekday: Optional[int] = None, rule_date: Optional[str] = None,
+                          start_min: Optional[int] = None, end_min: Optional[int] = None,
+                          description: Optional[str] = None) -> bool:
+        self.rules.append(ScheduleRule(next(self._rule_ids), rule_type, weekday, rule_date, start_min, end_min,
+                                       description))
+        self._templates.invalidate()
+        return True
+
+    @locked
+    def delete_schedule_rule(self, rule_id: int) -> bool:
+        remaining = [rule for rule in self.rules if rule.id != rule_id]
+        deleted = len(remaining) < len(self.rules)
+        self.rules = remaining
+        self._templates.invalidate()
+        return deleted
+
+    @locked
+    def update_schedule_settings(self, setting_name: str, value: str) -> bool:
+        if setting_name in LEGACY_SCHEDULE_SETTINGS:
+            legacy_key, field = LEGACY_SCHEDULE_SETTINGS[setting_name]
+            rule_id = self._legacy_rules.get(legacy_key)
+            minutes = time_to_minutes(value) if value else None
+            self.rules = [rule._replace(**{field: minutes}) if rule.id == rule_id else rule for rule in self.rules]
+            self._templates.invalidate()
+        self.settings[setting_name] = value
+        return True
+
+    # Записи в прачечную
+
+    @locked
+    def check_user_daily_bookings(self, user_id: int, date: str) -> bool:
+        day_bookings = self._active(self.laundry, self._laundry_days, date_str_to_day_number(date))
+        return sum(1 for booking in day_bookings if booking['user_id'] == user_id) < 2
+
+    @locked
+    def get_laundry_booking_counts(self, date: str) -> Dict[int, int]:
+        counts: Dict[int, int] = {}
+        for booking in self._active(self.laundry, self._laundry_days, date_str_to_day_number(date)):
+            counts[booking['user_id']] = counts.get(booking['user_id'], 0) + 1
+        return counts
+
+    @locked
+    def get_available_laundry_slots(self, date, machine_number: int) -> List[str]:
+        booked = self.get_booked_laundry_slots(date).get(machine_number, set())
+        day_number = date_to_day_number(date)
+        return [
+            minutes_to_time(slot) for slot in free_slot_starts(self.get_laundry_slot_template(date), booked)
+            if not slot_started(day_number, slot)
+        ]
+
+    @locked
+    def get_booked_laundry_slots(self, date) -> Dict[int, set]:
+        booked = {}
+        for booking in self._active(self.laundry, self._laundry_days, date_to_day_number(date)):
+            booked.setdefault(booking['machine_number'], set()).update(
+                occupied_steps(booking['start_min'], booking['end_min'])
+            )
+        return booked
+
+    @locked
+    def find_nearest_laundry_slot(self, days: int = 7) -> Optional[Booking]:
+        now = clock.now()
+        window = self.get_booking_window()
+        machines = self.get_available_machines()
+        now_minutes = now.hour * 60 + now.minute
+
+        for offset in range(days):
+            date = now.date() + timedelta(days=offset)
+            if not window.is_open(date, now):
+                break
+            slots = self.get_laundry_slot_template(date)
+            if offset == 0:
+                slots = [slot for slot in slots if slot > now_minutes]
+            booked = self.get_booked_laundry_slots(date)
+
+            best = None
+            for machine_number in machines:
+                free = free_slot_starts(slots, booked.get(machine_number, set()))
+                slot = free[0] if free else None
+                if slot is not None and (best is None or slot < best[1]):
+                    best = (machine_number, slot)
+
+            if best:
+                return {
+                    'machine_number': best[0],
+                    'booking_date': date.strftime('%Y-%m-%d'),
+                    'start_time': minutes_to_time(best[1]),
+                    'end_time': minutes_to_time(best[1] + LAUNDRY_SLOT_MINUTES)
+                }
+
+        return None
+
+    @locked
+    def create_laundry_booking(self, user_id: int, machine_number: int, booking_date: str,
+                               start_time: str, end_time: str, idempotency_key: Optional[str] = None,
+                               notice: Optional[str] = None) -> bool:
+        if ('laundry', idempotency_key) in self._idempotency_keys:
+            return True
+        day_number, start_min, end_min = booking_time_values(booking_date, start_time, end_time)
+        if not self._laundry_interval_free(day_number, machine_number, start_min, end_min):
+            return False
+        if self._laundry_count(user_id, day_number) >= 2:
+            return False
+
+        booking_id = self._insert_laundry(user_id, machine_number, booking_date, start_time, end_time,
+                                          day_number, start_min, end_min)
+        if idempotency_key is not None:
+            self._idempotency_keys[('laundry', idempotency_key)] = booking_id
+        if notice:
+            self._enqueue(user_id, notice, 'booking')
+        return True
+
+    @locked
+    def cancel_laundry_booking(self, booking_id: int) -> bool:
+        booking = self.laundry.get(booking_id)
+        if not booking or booking['status'] != 'active':
+            return False
+        self._deactivate(booking, self._laundry_days, 'cancelled')
+        return True
+
+    @locked
+    def get_laundry_booking(self, booking_id: int) -> Optional[Booking]:
+        booking = self.laundry.get(booking_id)
+        if not booking:
+            return None
+        return {key: booking[key] for key in
+                ('id', 'user_id', 'machine_number', 'booking_date', 'start_time', 'end_time', 'status')}
+
+    @locked
+    def get_user_laundry_bookings(self, user_id: int) -> List[Dict]:
+        today = date_to_day_number(clock.today())
+        bookings = sorted(
+            (b for b in self.laundry.values()
+             if b['user_id'] == user_id and b['status'] == 'active' and b['day_number'] >= today),
+            key=lambda b: (b['day_number'], b['start_min'])
+        )
+        return [{key: b[key] for key in ('id', 'machine_number', 'booking_date', 'start_time', 'end_time')}
+                for b in bookings]
+
+    @locked
+    def check_in_laundry_booking(self, booking_id: int, user_id: int) -> bool:
+        booking = self.laundry.get(booking_id)
+        if not booking or booking['user_id'] != user_id or booking['status'] != 'active':
+            return False
+        booking['checked_in'] = 1
+        return True
+
+    @locked
+    def release_no_show_laundry_bookings(self, grace_minutes: int,
+                                         notice: Optional[Callable[[Booking], str]] = None) -> List[Booking]:
+        deadline = to_minute_stamp(clock.now() - timedelta(minutes=grace_minutes))
+        released = []
+        for day_number in (deadline // 1440 - 1, deadline // 1440):
+            for booking in self._active(self.laundry, self._laundry_days, day_number):
+                if booking['checked_in'] or day_number * 1440 + booking['start_min'] > deadline:
+                    continue
+                self._deactivate(booking, self._laundry_days, 'no_show')
+                booking = {key: booking[key] for key in
+                           ('id', 'user_id', 'machine_number', 'booking_date', 'start_time', 'end_time')}
+                if notice:
+                    self._enqueue(booking['user_id'], notice(booking), 'no_show')
+                released.append(booking)
+        return released
+
+    @locked
+    def create_recurring_laundry_bookings(self, user_id: int, machine_number: int, first_date,
+                                          start_time: str, weeks: int) -> Tuple[List[str], List[Tuple[str, str]]]:
+        now = clock.now()
+        window = self.get_booking_window()
+        start_min = time_to_minutes(start_time)
+        end_min = start_min + LAUNDRY_SLOT_MINUTES
+        end_time = minutes_to_time(end_min)
+        created = []
+        skipped = []
+
+        for week in range(weeks):
+            date = first_date + timedelta(weeks=week)
+            date_str = date.strftime('%Y-%m-%d')
+            day_number = date_str_to_day_number(date_str)
+            if datetime.strptime(f"{date_str} {start_time}", '%Y-%m-%d %H:%M') <= now:
+                skipped.append((date_str, 'past'))
+            elif start_min not in self.get_laundry_slot_template(date):
+                skipped.append((date_str, 'schedule'))
+            elif not window.is_open(date, now):
+                skipped.append((date_str, 'window'))
+            elif not self._laundry_interval_free(day_number, machine_number, start_min, end_min):
+                skipped.append((date_str, 'taken'))
+            elif self._laundry_count(user_id, day_number) >= 2:
+                skipped.append((date_str, 'limit'))
+            else:
+                self._insert_laundry(user_id, machine_number, date_str, start_time, end_time,
+                                     day_number, start_min, end_min)
+                created.append(date_str)
+
+        skipped.sort()
+        return created, skipped
+
+    # Лист ожидания прачечной
+
+    def _waitlist_entries(self, machine_number: int, booking_date: str, start_time: str, status: str) -> List[Dict]:
+        return sorted(
+            (entry for entry in self.waitlist.values()
+             if entry['machine_number'] == machine_number and entry['booking_date'] == booking_date
+             and entry['start_time'] == start_time and entry['status'] == status),
+            key=lambda entry: entry['id']
+        )
+
+    @staticmethod
+    def _waitlist_slot(entry: Dict) -> Booking:
+        return {key: entry[key] for key in ('machine_number', 'booking_date', 'start_time')}
+
+    @locked
+    def add_to_laundry_waitlist(self, user_id: int, machine_number: int, booking_date: str, start_time: str) -> bool:
+        queued = self._waitlist_entries(machine_number, booking_date, start_time, 'waiting') + \
+            self._waitlist_entries(machine_number, booking_date, start_time, 'offered')
+        if any(entry['user_id'] == user_id for entry in queued):
+            return True
+        waitlist_id = next(self._waitlist_ids)
+        self.waitlist[waitlist_id] = {
+            'id': waitlist_id, 'user_id': user_id, 'machine_number': machine_number,
+            'booking_date': booking_date, 'start_time': start_time, 'status': 'waiting', 'offered_at': None
+        }
+        return True
+
+    @locked
+    def offer_laundry_slot_to_next_waiter(self, machine_number: int, booking_date: str, start_time: str,
+                                          allow_started: bool = False) -> Optional[Booking]:
+        day_number = date_str_to_day_number(booking_date)
+        start_min = time_to_minutes(start_time)
+        if slot_started(day_number, start_min + LAUNDRY_SLOT_MINUTES if allow_started else start_min):
+            return None
+        if not self._laundry_interval_free(day_number, machine_number, start_min, start_min + LAUNDRY_SLOT_MINUTES):
+            return None
+        if self._waitlist_entries(machine_number, booking_date, start_time, 'offered'):
+            return None
+        waiting = self._waitlist_entries(machine_number, booking_date, start_time, 'waiting')
+        if not waiting:
+            return None
+
+        entry = waiting[0]
+        entry.update(status='offered', offered_at=clock.now().strftime('%Y-%m-%d %H:%M:%S'))
+        return {'id': entry['id'], 'user_id': entry['user_id'], **self._waitlist_slot(entry)}
+
+    @locked
+    def expire_laundry_waitlist_offer(self, waitlist_id: int) -> Optional[Booking]:
+        entry = self.waitlist.get(waitlist_id)
+        if not entry or entry['status'] != 'offered':
+            return None
+        entry['status'] = 'expired'
+        return self._waitlist_slot(entry)
+
+    @locked
+    def expire_stale_laundry_waitlist_offers(self, claim_minutes: int) -> List[Booking]:
+        deadline = (clock.now() - timedelta(minutes=claim_minutes)).strftime('%Y-%m-%d %H:%M:%S')
+        stale = sorted(
+            (entry for entry in self.waitlist.values()
+             if entry['status'] == 'offered' and entry['offered_at'] <= deadline),
+            key=lambda entry: entry['id']
+        )
+        for entry in stale:
+            entry['status'] = 'expired'
+        return [self._waitlist_slot(entry) for entry in stale]
+
+    @locked
+    def claim_laundry_waitlist_offer(self, waitlist_id: int, user_id: int) -> Tuple[bool, str]:
+        entry = self.waitlist.get(waitlist_id)
+        if not entry or entry['user_id'] != user_id or entry['status'] != 'offered':
+            return False, 'not_found'
+
+        claim_minutes = int(self.settings.get('waitlist_claim_minutes') or 15)
+        offered_dt = datetime.strptime(entry['offered_at'], '%Y-%m-%d %H:%M:%S')
+        day_number = date_str_to_day_number(entry['booking_date'])
+        start_min = time_to_minutes(entry['start_time'])
+        end_min = start_min + LAUNDRY_SLOT_MINUTES
+        started_offer = to_minute_stamp(offered_dt) >= day_number * 1440 + start_min
+        claim_until = end_min if started_offer else start_min
+        if clock.now() > offered_dt + timedelta(minutes=claim_minutes) or slot_started(day_number, claim_until):
+            return False, 'expired'
+        if not self._laundry_interval_free(day_number, entry['machine_number'], start_min, end_min):
+            entry['status'] = 'expired'
+            return False, 'taken'
+        if self._laundry_count(user_id, day_number) >= 2:
+            return False, 'limit'
+
+        self._insert_laundry(user_id, entry['machine_number'], entry['booking_date'], entry['start_time'],
+                             minutes_to_time(end_min), day_number, start_min, end_min, int(started_offer))
+        entry['status'] = 'claimed'
+        return True, 'claimed'
+
+    @locked
+    def get_waitlisted_laundry_slots(self, machine_number: int) -> List[Dict[str, str]]:
+        today = clock.now().strftime('%Y-%m-%d')
+        slots = {
+            (entry['booking_date'], entry['start_time']) for entry in self.waitlist.values()
+            if entry['machine_number'] == machine_number and entry['status'] == 'waiting'
+            and entry['booking_date'] >= today
+        }
+        return [{'booking_date': booking_date, 'start_time': start_time} for booking_date, start_time in sorted(slots)]
+
+    # Записи в комнату отдыха и недельные лимиты
+
+    def _restroom_booked_slots(self, day_number: int) -> Set[int]:
+        return {
+            slot
+            for booking in self._active(self.restroom, self._restroom_days, day_number)
+            for slot in range(booking['start_min'], booking['end_min'], RESTROOM_SLOT_MIN)
+        }
+
+    @locked
+    def get_available_restroom_slots(self, date) -> List[Dict[str, str]]:
+        booked = self._restroom_booked_slots(date_to_day_number(date))
+        return [{'time': minutes_to_time(slot), 'display': minutes_to_time(slot)}
+                for slot in range(RESTROOM_OPEN_MIN, RESTROOM_CLOSE_MIN, RESTROOM_SLOT_MIN)
+                if slot not in booked]
+
+    @locked
+    def find_nearest_restroom_slot(self, days: int = 7, max_duration: int = 120) -> Optional[Booking]:
+        now = clock.now()
+        first_day = date_to_day_number(now.date())
+        slot_minutes = list(range(RESTROOM_OPEN_MIN, RESTROOM_CLOSE_MIN, RESTROOM_SLOT_MIN))
+        now_minutes = now.hour * 60 + now.minute
+
+        for offset in range(days):
+            day_number = first_day + offset
+            slots = slot_minutes if offset else [slot for slot in slot_minutes if slot > now_minutes]
+            day_booked = self._restroom_booked_slots(day_number)
+            start_min = get_nearest_available_time(slots, day_booked)
+            if start_min is None:
+                continue
+
+            duration = 0
+            current = start_min
+            while duration < max_duration and current < RESTROOM_CLOSE_MIN and current not in day_booked:
+                duration += RESTROOM_SLOT_MIN
+                current += RESTROOM_SLOT_MIN
+
+            return {
+                'booking_date': day_number_to_str(day_number),
+                'start_time': minutes_to_time(start_min),
+                'max_duration': duration
+            }
+
+        return None
+
+    @locked
+    def check_restroom_limit(self, user_id: int, booking_date: str, duration: int) -> Tuple[bool, int]:
+        week, year = booking_week(date_str_to_day_number(booking_date))
+        max_minutes = int(self.settings['restroom_max_weekly_minutes'])
+        used_minutes = self.restroom_limits.get((user_id, week, year), 0)
+        return used_minutes + duration <= max_minutes, max_minutes - used_minutes
+
+    @locked
+    def create_restroom_booking(self, user_id: int, booking_date: str, start_time: str, end_time: str,
+                                duration: int, idempotency_key: Optional[str] = None) -> bool:
+        if ('restroom', idempotency_key) in self._idempotency_keys:
+            return True
+        day_number, start_min, end_min = booking_time_values(booking_date, start_time, end_time)
+        week, year = booking_week(day_number)
+        for booking in self._active(self.restroom, self._restroom_days, day_number):
+            if booking['start_min'] < end_min and booking['end_min'] > start_min:
+                return False
+
+        max_minutes = self.settings.get('restroom_max_weekly_minutes')
+        used_minutes = self.restroom_limits.get((user_id, week, year), 0)
+        if max_minutes is not None and used_minutes + duration > int(max_minutes):
+            return False
+
+        booking_id = next(self._ids)
+        self.restroom[booking_id] = {
+            'id': booking_id, 'user_id': user_id, 'booking_date': booking_date,
+            'start_time': start_time, 'end_time': end_time, 'duration': duration,
+            'status': 'active', 'notified': 0, 'created_at': clock.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'day_number': day_number, 'start_min': start_min, 'end_min': end_min
+        }
+        self._restroom_days.setdefault(day_number, set()).add(booking_id)
+        self.restroom_limits[(user_id, week, year)] = used_minutes + duration
+        if idempotency_key is not None:
+            self._idempotency_keys[('restroom', idempotency_key)] = booking_id
+        return True
+
+    @locked
+    def cancel_restroom_booking(self, booking_id: int) -> bool:
+        booking = self.restroom.get(booking_id)
+        if not booking or booking['status'] != 'active':
+            return False
+        self._deactivate(booking, self._restroom_days, 'cancelled')
+
+        # Как и в SQLite, лимит уменьшается для недели даты записи
+        key = (booking['user_id'], *booking_week(booking['day_number']))
+        if key in self.restroom_limits:
+            self.restroom_limits[key] -= booking['duration']
+        return True
+
+    @locked
+    def get_user_restroom_bookings(self, user_id: int) -> List[Dict]:
+        today = date_to_day_number(clock.today())
+        bookings = sorted(
+            (b for b in self.restroom.values()
+             if b['user_id'] == user_id and b['status'] == 'active' and b['day_number'] >= today),
+            key=lambda b: (b['day_number'], b['start_min'])
+        )
+        return [{key: b[key] for key in ('id', 'booking_date', 'start_time', 'end_time', 'duration')}
+                for b in bookings]
+
+    # Общее для обоих типов записей
+
+    def _table(self, booking_type: str) -> Dict[int, Dict]:
+        return self.laundry if booking_type == 'laundry' else self.restroom
+
+    @locked
+    def get_active_bookings(self, booking_type: str) -> List[Booking]:
+        extra = 'machine_number' if booking_type == 'laundry' else 'duration'
+        bookings = sorted(
+            (b for b in self._table(booking_type).values() if b['status'] == 'active' and b['user_id'] in self.users),
+            key=lambda b: (b['booking_date'], b['start_time'])
+        )
+        return [{
+            'id': b['id'],
+            'username_hash': self.users[b['user_id']]['username_hash'],
+            extra: b[extra],
+            'booking_date': b['booking_date'],
+            'start_time': b['start_time'],
+            'end_time': b['end_time']
+        } for b in bookings]
+
+    @locked
+    def get_due_reminders(self, booking_type: str, minutes_before: int, grace_minutes: int = 0) -> List[Booking]:
+        now = clock.now()
+        window_start = to_minute_stamp(now - timedelta(minutes=grace_minutes))
+        window_end = to_minute_stamp(now + timedelta(minutes=minutes_before))
+        table = self._table(booking_type)
+        index = self._laundry_days if booking_type == 'laundry' else self._restroom_days
+        columns = ['id', 'user_id', 'booking_date', 'start_time', 'end_time']
+        if booking_type == 'laundry':
+            columns.append('machine_number')
+
+        due = []
+        for day_number in range(window_start // 1440, window_end // 1440 + 1):
+            for booking in self._active(table, index, day_number):
+                stamp = day_number * 1440 + booking['start_min']
+                if not booking['notified'] and window_start < stamp <= window_end:
+                    due.append(booking)
+        due.sort(key=lambda b: (b['day_number'], b['start_min']))
+        return [{column: b[column] for column in columns} for b in due]
+
+    @locked
+    def mark_booking_notified(self, booking_type: str, booking_id: int, text: Optional[str] = None,
+                              buttons: Optional[List[Tuple[str, str]]] = None) -> bool:
+        booking = self._table(booking_type).get(booking_id)
+        if not booking or booking['notified']:
+            return False
+        booking['notified'] = 1
+        if text:
+            self._enqueue(booking['user_id'], text, 'reminder', buttons)
+        return True
+
+    def iter_bookings_for_export(self, booking_type: str, date_from: Optional[str] = None,
+                                 date_to: Optional[str] = None, status: Optional[str] = None,
+                                 batch_size: int = 500) -> Iterator[Dict]:
+        columns = EXPORT_COLUMNS['laundry' if booking_type == 'laundry' else 'restroom']
+        first_day = date_str_to_day_number(date_from) if date_from else None
+        last_day = date_str_to_day_number(date_to) if date_to else None
+        with self._lock:
+            bookings = [
+                dict(booking) for booking_id, booking in sorted(self._table(booking_type).items())
+                if (first_day is None or booking['day_number'] >= first_day)
+                and (last_day is None or booking['day_number'] <= last_day)
+                and (status is None or booking['status'] == status)
+            ]
+            for booking in bookings:
+                booking['username_hash'] = self.users.get(booking['user_id'], {}).get('username_hash')
+
+        for booking in bookings:
+            yield {column: booking.get(column) for column in columns}
+
+    # Статистика загрузки
+
+    def _utilization_rollup(self) -> Dict[Tuple[str, str, int], Tuple[int, int]]:
+        """Почасовая загрузка активных записей в формате таблицы utilization_rollup"""
+        rollup = {}
+        active = [(laundry_resource(b['machine_number']), b) for b in self.laundry.values() if b['status'] == 'active']
+        active += [(RESTROOM_RESOURCE, b) for b in self.restroom.values() if b['status'] == 'active']
+        for resource, booking in active:
+            for hour, minutes in split_by_hours(booking['start_time'], booking['end_time']):
+                key = (resource, booking['booking_date'], hour)
+                booked_minutes, bookings = rollup.get(key, (0, 0))
+                rollup[key] = (booked_minutes + minutes, bookings + 1)
+        return rollup
+
+    @locked
+    def get_utilization_stats(self, resource: str) -> List[Dict[str, int]]:
+        stats = {}
+        for (row_resource, booking_date, hour), (booked_minutes, bookings) in self._utilization_rollup().items():
+            if row_resource != resource or booked_minutes <= 0:
+                continue
+            weekday = datetime.strptime(booking_date, '%Y-%m-%d').weekday()
+            row = stats.setdefault((weekday, hour), {
+                'weekday': weekday, 'hour': hour, 'booked_minutes': 0, 'bookings': 0, 'days': 0
+            })
+            row['booked_minutes'] += booked_minutes
+            row['bookings'] += bookings
+            row['days'] += 1
+        return [stats[key] for key in sorted(stats)]
+
+    @locked
+    def get_utilization_period(self, resource: str) -> Optional[Tuple[str, str]]:
+        dates = [
+            booking_date for (row_resource, booking_date, _), (booked_minutes, _) in self._utilization_rollup().items()
+            if row_resource == resource and booked_minutes > 0
+        ]
+        return (min(dates), max(dates)) if dates else None
+
+    @locked
+    def rebuild_utilization_rollups(self) -> int:
+        # Загрузка и так считается по активным записям при каждом запросе
+        return len(self._utilization_rollup())
+
+    @locked
+    def get_booking_history(self, booking_type: str, first_day: int, last_day: int,
+                            machine_number: Optional[int] = None) -> List[Tuple[int, int, int, int, int, int]]:
+        return [
+            (b['day_number'], b.get('machine_number', 0), b['start_min'], b['end_min'],
+             int(b['status'] == 'cancelled'), int(b['status'] == 'no_show'))
+            for b in self._table(booking_type).values()
+            if first_day <= b['day_number'] <= last_day
+            and (machine_number is None or booking_type != 'laundry' or b['machine_number'] == machine_number)
+        ]
+
+    # Очередь исходящих уведомлений
+
+    def _enqueue(self, user_id: int, text: str, kind: str, buttons: Optional[List[Tuple[str, str]]] = None):
+        now = clock.now()
+        outbox_id = next(self._outbox_ids)
+        self.outbox[outbox_id] = {
+            'id': outbox_id, 'user_id': user_id, 'kind': kind, 'text': text,
+            'buttons': [list(button) for button in buttons or ()],
+            'status': OUTBOX_PENDING, 'attempts': 0, 'next_attempt_at': now.timestamp(),
+            'last_error': None, 'created_at': now.strftime('%Y-%m-%d %H:%M:%S'), 'sent_at': None
+        }
+
+    @locked
+    def enqueue_notifications(self, notifications: List[Tuple[int, str, str]]) -> int:
+        for user_id, text, kind in notifications:
+            self._enqueue(user_id, text, kind)
+        return len(notifications)
+
+    @locked
+    def has_due_notifications(self) -> bool:
+        now = clock.now().timestamp()
+        return any(item['status'] == OUTBOX_PENDING and item['next_attempt_at'] <= now
+                   for item in self.outbox.values())
+
+    @locked
+    def claim_outbox_batch(self, limit: int, lease_seconds: float) -> List[Dict]:
+        now = clock.now().timestamp()
+        due = sorted(
+            (item for item in self.outbox.values()
+             if item['status'] == OUTBOX_PENDING and item['next_attempt_at'] <= now),
+            key=lambda item: (item['next_attempt_at'], item['id'])
+        )[:limit]
+        for item in due:
+            item['attempts'] += 1
+            item['next_attempt_at'] = now + lease_seconds
+        return [{key: item[key] for key in ('id', 'user_id', 'kind', 'text', 'buttons', 'attempts')}
+                for item in due]
+
+    @locked
+    def record_outbox_results(self, sent: List[int], failed: List[Tuple[int, str, Optional[float]]]) -> bool:
+        sent_at = clock.now().strftime('%Y-%m-%d %H:%M:%S')
+        for outbox_id in sent:
+            self.outbox[outbox_id].update(status=OUTBOX_SENT, sent_at=sent_at, last_error=None)
+        for outbox_id, error, retry_at in failed:
+            item = self.outbox[outbox_id]
+            item['last_error'] = error
+            if retry_at is None:
+                item['status'] = OUTBOX_DEAD
+            else:
+                item['next_attempt_at'] = retry_at
+        return True
+
+    @locked
+    def prune_outbox(self, keep_days: int) -> int:
+        threshold = (clock.now() - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+        stale = [outbox_id for outbox_id, item in self.outbox.items()
+                 if item['status'] == OUTBOX_SENT and item['sent_at'] < threshold]
+        for outbox_id in stale:
+            del self.outbox[outbox_id]
+        return len(stale)
+
+    @locked
+    def get_outbox_stats(self) -> Dict[str, int]:
+        stats = {OUTBOX_PENDING: 0, OUTBOX_SENT: 0, OUTBOX_DEAD: 0, 'retrying': 0}
+        for item in self.outbox.values():
+            stats[item['status']] += 1
+            if item['status'] == OUTBOX_PENDING and item['attempts']:
+                stats['retrying'] += 1
+        return stats
+
+    @locked
+    def get_dead_notifications(self, limit: int = 10) -> List[Dict]:
+        dead = [item for item in self.outbox.values() if item['status'] == OUTBOX_DEAD]
+        return [{key: item[key] for key in ('id', 'user_id', 'kind', 'attempts', 'last_error', 'created_at')}
+                for item in sorted(dead, key=lambda item: item['id'], reverse=True)[:limit]]
+
+    async def write_async(self, func: Callable, *args, **kwargs):
+        # Запись в памяти занимает микросекунды: выполняем сразу, без потока-писателя
+        return func(*args, **kwargs)
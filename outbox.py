@@ -0,0 +1,160 @@
+"""
+Рассылка уведомлений из очереди outbox.
+
+Уведомления о записях (подтверждения очереди открытия, напоминания, снятие неявок,
+поломка машинки) ставятся в таблицу outbox той же транзакцией, что и изменение записи.
+Фоновый рассыльщик забирает их пачками и отправляет с ограничением частоты. Неудачная
+отправка повторяется с экспоненциальной задержкой, а после OUTBOX_MAX_ATTEMPTS попыток
+(или сразу, если пользователь заблокировал бота) уведомление помечается недоставленным
+('dead') и остается в таблице с причиной для администратора.
+
+Доставка «хотя бы один раз»: если бот остановится между отправкой и записью результата,
+уведомление уйдет повторно после OUTBOX_LEASE_SECONDS.
+"""
+import logging
+import os
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+import clock
+from storage import (
+    claim_outbox_batch,
+    has_due_notifications,
+    prune_outbox,
+    record_outbox_results,
+    write_async
+)
+
+logger = logging.getLogger(__name__)
+
+# Telegram допускает около 30 сообщений в секунду, оставляем запас
+NOTIFICATION_RATE_PER_SECOND = 20
+
+# Уведомлений за одну выборку из очереди
+OUTBOX_BATCH_SIZE = int(os.getenv('DORM_BOT_OUTBOX_BATCH', '20'))
+
+# Пауза между проверками пустой очереди (в секундах)
+OUTBOX_POLL_SECONDS = float(os.getenv('DORM_BOT_OUTBOX_POLL_SECONDS', '1'))
+
+# Попыток отправки, после которых уведомление считается недоставленным
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('DORM_BOT_OUTBOX_ATTEMPTS', '6'))
+
+# Задержка перед повтором: OUTBOX_RETRY_BASE_SECONDS * 2^(попытка - 1), не больше OUTBOX_RETRY_MAX_SECONDS
+OUTBOX_RETRY_BASE_SECONDS = 5
+OUTBOX_RETRY_MAX_SECONDS = 3600
+
+# Через сколько секунд выбранное, но не подтвержденное уведомление снова считается ожидающим
+OUTBOX_LEASE_SECONDS = 120
+
+# Сколько дней хранить доставленные уведомления и как часто их чистить
+OUTBOX_KEEP_DAYS = 7
+OUTBOX_PRUNE_INTERVAL_SECONDS = 3600
+
+
+def retry_delay(attempts: int) -> float:
+    """Задержка перед следующей попыткой после attempts неудачных"""
+    return min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+
+
+class OutboxDispatcher:
+    """Фоновый рассыльщик очереди уведомлений со счетчиками результатов с момента запуска"""
+
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.counts = Counter()
+        self._last_prune: Optional[float] = None
+
+    def failure(self, message: Dict, error: Exception, permanent: bool = False,
+                retry_after: Optional[float] = None) -> Tuple[int, str, Optional[float]]:
+        """Результат неудачной отправки: (id, ошибка, время следующей попытки или None)"""
+        if permanent or message['attempts'] >= self.max_attempts:
+            self.counts['dead'] += 1
+            logger.error(
+                f"Уведомление {message['id']} ({message['kind']}) пользователю {message['user_id']} "
+                f"не доставлено после {message['attempts']} попыток: {error}"
+            )
+            return message['id'], str(error), None
+
+        self.counts['retried'] += 1
+        delay = retry_after if retry_after is not None else retry_delay(message['attempts'])
+        return message['id'], str(error), clock.now().timestamp() + delay
+
+    async def deliver(self, bot, batch: List[Dict]) -> Tuple[List[int], List[Tuple[int, str, Optional[float]]]]:
+        """Отправляет пачку уведомлений. Возвращает (id доставленных, неудачные для record_outbox_results)"""
+        sent = []
+        failed = []
+        for message in batch:
+            reply_markup = None
+            if message['buttons']:
+                builder = InlineKeyboardBuilder()
+                for text, callback_data in message['buttons']:
+                    builder.button(text=text, callback_data=callback_data)
+                reply_markup = builder.as_markup()
+
+            try:
+                await bot.send_message(message['user_id'], message['text'], reply_markup=reply_markup)
+                sent.append(message['id'])
+                self.counts['sent'] += 1
+            except TelegramRetryAfter as e:
+                # Лимит Telegram общий для бота: откладываем это уведомление и ждем перед следующими
+                failed.append(self.failure(message, e, retry_after=e.retry_after))
+                await clock.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Бот заблокирован или чат не существует: повтор не поможет
+                failed.append(self.failure(message, e, permanent=True))
+            except Exception as e:
+                failed.append(self.failure(message, e))
+
+            await clock.sleep(1 / NOTIFICATION_RATE_PER_SECOND)
+
+        return sent, failed
+
+    async def dispatch(self, bot) -> int:
+        """
+        Отправляет все уведомления, срок которых наступил. Возвращает число обработанных.
+
+        Пустую очередь проверяет чтением, без задания писателю; выборка и результаты
+        записываются через write_async и не блокируют цикл событий.
+        """
+        processed = 0
+        while has_due_notifications():
+            batch = await write_async(claim_outbox_batch, self.batch_size, OUTBOX_LEASE_SECONDS)
+            if not batch:
+                return processed
+            sent, failed = await self.deliver(bot, batch)
+            await write_async(record_outbox_results, sent, failed)
+            processed += len(batch)
+            if len(batch) < self.batch_size:
+                return processed
+        return processed
+
+    async def prune(self):
+        """Раз в OUTBOX_PRUNE_INTERVAL_SECONDS удаляет старые доставленные уведомления"""
+        now = clock.now().timestamp()
+        if self._last_prune is not None and now - self._last_prune < OUTBOX_PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        removed = await write_async(prune_outbox, OUTBOX_KEEP_DAYS)
+        if removed:
+            logger.info(f"Из очереди уведомлений удалено доставленных: {removed}")
+
+    async def run(self, bot, poll_seconds: float = OUTBOX_POLL_SECONDS):
+        """Фоновая задача бота: рассылка очереди уведомлений"""
+        while True:
+            try:
+                await self.dispatch(bot)
+                await self.prune()
+            except Exception as e:
+                logger.error(f"Ошибка рассылки уведомлений: {e}")
+            await clock.sleep(poll_seconds)
+
+    def stats(self) -> Dict[str, int]:
+        """Результаты отправки с момента запуска: доставлено, отложено для повтора, недоставлено"""
+        return {'sent': self.counts['sent'], 'retried': self.counts['retried'], 'dead': self.counts['dead']}
+
+
+outbox_dispatcher = OutboxDispatcher()
@@ -0,0 +1,231 @@
+import threading
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# Длительность слота прачечной (в минутах)
+LAUNDRY_SLOT_MINUTES = 120
+
+# Шаг занятости: запись занимает все 30-минутные шаги своего интервала
+OCCUPANCY_STEP_MINUTES = 30
+
+# Типы правил расписания
+RULE_HOURS = 'hours'
+RULE_BREAK = 'break'
+RULE_CLOSED = 'closed'
+
+# Значения по умолчанию, если ни одно правило не задает часы работы
+DEFAULT_OPEN_MIN = 8 * 60
+DEFAULT_CLOSE_MIN = 23 * 60
+
+
+class ScheduleRule(NamedTuple):
+    """
+    Правило расписания прачечной.
+
+    Область действия: конкретная дата (rule_date), день недели (weekday, 0 — понедельник)
+    или каждый день (оба поля пустые). Для правил часов работы пустые start_min/end_min
+    наследуются из менее конкретного правила.
+    """
+    id: int
+    rule_type: str
+    weekday: Optional[int]
+    rule_date: Optional[str]
+    start_min: Optional[int]
+    end_min: Optional[int]
+    description: Optional[str] = None
+
+
+class DaySchedule(NamedTuple):
+    """Итоговое расписание дня"""
+    closed: bool
+    open_min: int
+    close_min: int
+    breaks: Tuple[Tuple[int, int], ...]
+
+
+def rule_level(rule: ScheduleRule, day: date) -> int:
+    """
+    Возвращает специфичность правила для даты: 2 — дата, 1 — день недели, 0 — каждый день,
+    -1 — правило к дате не относится.
+    """
+    if rule.rule_date is not None:
+        return 2 if rule.rule_date == day.strftime('%Y-%m-%d') else -1
+    if rule.weekday is not None:
+        return 1 if rule.weekday == day.weekday() else -1
+    return 0
+
+
+def resolve_day_schedule(rules: List[ScheduleRule], day: date) -> DaySchedule:
+    """
+    Применяет правила к дате.
+
+    Закрытие действует на любом уровне. Часы работы берутся из самого конкретного правила,
+    незаданные границы наследуются от менее конкретных; из нескольких правил часов одного
+    уровня действует добавленное последним (с большим id). Перерывы берутся с самого конкретного
+    уровня, на котором они заданы (так перерыв среды заменяет обычный перерыв).
+    """
+    open_min, close_min = DEFAULT_OPEN_MIN, DEFAULT_CLOSE_MIN
+    hours_by_level: Dict[int, ScheduleRule] = {}
+    breaks_by_level: Dict[int, List[Tuple[int, int]]] = {}
+
+    for rule in rules:
+        level = rule_level(rule, day)
+        if level < 0:
+            continue
+        if rule.rule_type == RULE_CLOSED:
+            return DaySchedule(True, open_min, close_min, ())
+        if rule.rule_type == RULE_HOURS:
+            if level not in hours_by_level or rule.id > hours_by_level[level].id:
+                hours_by_level[level] = rule
+        elif rule.rule_type == RULE_BREAK and rule.start_min is not None and rule.end_min is not None:
+            breaks_by_level.setdefault(level, []).append((rule.start_min, rule.end_min))
+
+    for level in sorted(hours_by_level):
+        rule = hours_by_level[level]
+        if rule.start_min is not None:
+            open_min = rule.start_min
+        if rule.end_min is not None:
+            close_min = rule.end_min
+
+    breaks = breaks_by_level[max(breaks_by_level)] if breaks_by_level else []
+    return DaySchedule(False, open_min, close_min, tuple(sorted(breaks)))
+
+
+def occupied_steps(start_min: int, end_min: int) -> List[int]:
+    """Минуты 30-минутных шагов, которые занимает интервал [start_min, end_min)"""
+    return list(range(start_min - start_min % OCCUPANCY_STEP_MINUTES, end_min, OCCUPANCY_STEP_MINUTES))
+
+
+def free_slot_starts(template: Iterable[int], occupied: Set[int]) -> List[int]:
+    """
+    Минуты начала слотов шаблона, интервал которых не пересекается с занятыми шагами.
+
+    Сравнивается весь интервал, а не минута начала: после изменения часов работы сетка
+    слотов может сдвинуться относительно уже сделанных записей.
+    """
+    return [
+        slot for slot in template
+        if occupied.isdisjoint(occupied_steps(slot, slot + LAUNDRY_SLOT_MINUTES))
+    ]
+
+
+def compile_slot_template(schedule: DaySchedule) -> Tuple[int, ...]:
+    """Превращает расписание дня в неизменяемый набор минут начала 2-часовых слотов"""
+    if schedule.closed:
+        return ()
+
+    slots = []
+    current = schedule.open_min
+    while current + LAUNDRY_SLOT_MINUTES <= schedule.close_min:
+        # Слот не может начинаться во время перерыва
+        if not any(start <= current < end for start, end in schedule.breaks):
+            slots.append(current)
+        current += LAUNDRY_SLOT_MINUTES
+
+    return tuple(slots)
+
+
+class SlotTemplateCache:
+    """
+    Кэш скомпилированных шаблонов слотов по датам.
+
+    Правила загружаются через loader один раз до следующей инвалидации. Кэш читают
+    обработчики и поток-писатель одновременно: состояние меняется под блокировкой,
+    а расчет идет вне ее. Инвалидация увеличивает поколение, и результат, посчитанный
+    по правилам предыдущего поколения, возвращается вызывающему, но в кэш не попадает.
+    """
+
+    def __init__(self, loader: Callable[[], List[ScheduleRule]], max_dates: int = 366):
+        self._loader = loader
+        self._max_dates = max_dates
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._rules: Optional[List[ScheduleRule]] = None
+        self._schedules: Dict[date, DaySchedule] = {}
+        self._templates: Dict[date, Tuple[int, ...]] = {}
+
+    def _store(self, cache: Dict, day: date, value, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            if len(cache) >= self._max_dates:
+                cache.clear()
+            cache[day] = value
+
+    def _current_rules(self) -> Tuple[int, List[ScheduleRule]]:
+        with self._lock:
+            generation, rules = self._generation, self._rules
+        if rules is None:
+            rules = self._loader()
+            with self._lock:
+                if generation == self._generation:
+                    self._rules = rules
+        return generation, rules
+
+    def _schedule(self, day: date) -> Tuple[int, DaySchedule]:
+        with self._lock:
+            generation, schedule = self._generation, self._schedules.get(day)
+        if schedule is None:
+            generation, rules = self._current_rules()
+            schedule = resolve_day_schedule(rules, day)
+            self._store(self._schedules, day, schedule, generation)
+        return generation, schedule
+
+    def rules(self) -> List[ScheduleRule]:
+        return self._current_rules()[1]
+
+    def schedule(self, day: date) -> DaySchedule:
+        return self._schedule(day)[1]
+
+    def template(self, day: date) -> Tuple[int, ...]:
+        with self._lock:
+            template = self._templates.get(day)
+        if template is None:
+            generation, schedule = self._schedule(day)
+            template = compile_slot_template(schedule)
+            self._store(self._templates, day, template, generation)
+        return template
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._rules = None
+            self._schedules.clear()
+            self._templates.clear()
+
+
+# Порядок обработки очереди допуска при открытии записи
+ADMISSION_FIFO = 'fifo'
+ADMISSION_LOTTERY = 'lottery'
+
+
+class BookingWindow(NamedTuple):
+    """
+    Окно открытия записи в прачечную.
+
+    Дата становится доступной за days дней в open_min (минута суток). Первые
+    surge_seconds после открытия запросы собираются в очередь допуска и
+    обрабатываются по порядку (mode: 'fifo') или в случайном порядке ('lottery').
+    days = 0 — окно не ограничено.
+    """
+    days: int
+    open_min: int
+    mode: str
+    surge_seconds: int
+
+    @property
+    def enabled(self) -> bool:
+        return self.days > 0
+
+    def opens_at(self, day: date) -> datetime:
+        opening_day = day - timedelta(days=self.days)
+        return datetime.combine(opening_day, datetime.min.time()) + timedelta(minutes=self.open_min)
+
+    def is_open(self, day: date, now: datetime) -> bool:
+        return not self.enabled or now >= self.opens_at(day)
+
+    def in_surge(self, day: date, now: datetime) -> bool:
+        if not self.enabled or self.surge_seconds <= 0:
+            return False
+        opening = self.opens_at(day)
+        return opening <= now < opening + timedelta(seconds=self.surge_seconds)
@@ -0,0 +1,406 @@
+"""
+Ускоренная симуляция недели работы бота на отдельной БД.
+
+Воспроизводит записанный (JSONL) или синтетический поток действий пользователей,
+параллельно гоняя фоновый цикл напоминаний и снятия неявок по ускоренным часам,
+и выводит отчет: пропущенные и опоздавшие напоминания, дрейф планировщика
+и нагрузку на БД по часам симуляции.
+
+Использование:
+    python simulate.py [--days 7] [--speed 1000] [--users 150] [--events events.jsonl]
+                       [--start ГГГГ-ММ-ДД] [--db scratch.db [--force]] [--report report.json] [--seed 1]
+
+Формат строки events.jsonl:
+    {"at": "2026-10-19 09:15", "action": "laundry|restroom|cancel_laundry|cancel_restroom",
+     "user_id": 1, "date": "2026-10-20", "machine": 1, "start_time": "10:00", "duration": 60}
+Поля кроме at, action и user_id необязательны — недостающее выбирается случайно.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import clock
+import database
+from database import (
+    init_db,
+    create_or_update_user,
+    get_available_machines,
+    get_laundry_slot_times,
+    get_available_laundry_slots,
+    check_user_daily_bookings,
+    create_laundry_booking,
+    cancel_laundry_booking,
+    add_to_laundry_waitlist,
+    claim_laundry_waitlist_offer,
+    check_in_laundry_booking,
+    get_available_restroom_slots,
+    check_restroom_limit,
+    create_restroom_booking,
+    cancel_restroom_booking,
+    get_system_setting,
+    RESTROOM_CLOSE_MIN
+)
+from outbox import outbox_dispatcher
+from schedule import LAUNDRY_SLOT_MINUTES
+from tasks import CHECK_INTERVAL_SECONDS, run_scheduled_checks
+from utils import time_to_minutes, minutes_to_time
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ('laundry', 'restroom', 'cancel_laundry', 'cancel_restroom')
+
+# Доля пользователей, приходящих на стирку после напоминания
+SHOW_UP_RATE = 0.85
+# Доля пользователей, занимающих слот, предложенный из листа ожидания
+CLAIM_RATE = 0.7
+# Минимальный запас до начала записи при синтетическом бронировании (в минутах)
+MIN_LEAD_MINUTES = 60
+
+
+class SimulationReport:
+    """Накопитель метрик симуляции"""
+
+    def __init__(self):
+        self.statements = Counter()
+        self.actions = Counter()
+        self.outcomes = Counter()
+        self.ticks = 0
+        self.tick_lateness: List[float] = []
+        self.grid_drift = 0.0
+        self.reminders: Dict[int, datetime] = {}
+        self.messages = Counter()
+
+    def record_statement(self, statement: str):
+        self.statements[clock.now().strftime('%Y-%m-%d %H:00')] += 1
+
+    def as_dict(self, missed: List[Dict], late: List[Dict]) -> Dict:
+        lateness = sorted(self.tick_lateness) or [0.0]
+        return {
+            'ticks': self.ticks,
+            'tick_lateness_avg_s': round(sum(lateness) / len(lateness), 2),
+            'tick_lateness_p95_s': round(lateness[int(len(lateness) * 0.95) - 1 if len(lateness) > 1 else 0], 2),
+            'tick_lateness_max_s': round(lateness[-1], 2),
+            'scheduler_drift_s': round(self.grid_drift, 2),
+            'missed_reminders': missed,
+            'late_reminders': late,
+            'actions': dict(self.actions),
+            'outcomes': dict(self.outcomes),
+            'messages': dict(self.messages),
+            'statements_per_hour': dict(sorted(self.statements.items()))
+        }
+
+
+class SimulatedBot:
+    """Заглушка Bot API: запоминает отправленные сообщения и имитирует реакцию пользователей"""
+
+    def __init__(self, report: SimulationReport, rng: random.Random):
+        self.report = report
+        self.rng = rng
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None, **kwargs):
+        callbacks = [
+            button.callback_data
+            for row in (reply_markup.inline_keyboard if reply_markup else [])
+            for button in row
+        ]
+        for callback_data in callbacks:
+            if callback_data.startswith('checkin_laundry_'):
+                booking_id = int(callback_data.split('_')[2])
+                self.report.messages['laundry_reminder'] += 1
+                self.report.reminders[booking_id] = clock.now()
+                if self.rng.random() < SHOW_UP_RATE:
+                    check_in_laundry_booking(booking_id, chat_id)
+                return
+            if callback_data.startswith('waitlist_claim_'):
+                self.report.messages['waitlist_offer'] += 1
+                if self.rng.random() < CLAIM_RATE:
+                    success, reason = claim_laundry_waitlist_offer(int(callback_data.split('_')[2]), chat_id)
+                    self.report.outcomes[f'waitlist_claim_{reason}'] += 1
+                return
+
+        if text.startswith('⏰ Напоминание: комната'):
+            self.report.messages['restroom_reminder'] += 1
+        elif text.startswith('❌ Ваша запись'):
+            self.report.messages['no_show_release'] += 1
+        else:
+            self.report.messages['other'] += 1
+
+
+def synthetic_events(start: datetime, days: int, users: int, rng: random.Random) -> List[Dict]:
+    """Синтетический поток действий: днем больше, ночью почти ничего"""
+    events = []
+    for hour in range(days * 24):
+        moment = start + timedelta(hours=hour)
+        rate = 12 if 8 <= moment.hour < 23 else 1
+        for _ in range(rng.randint(0, rate)):
+            at = moment + timedelta(minutes=rng.randrange(60))
+            events.append({
+                'at': at.strftime('%Y-%m-%d %H:%M'),
+                'action': rng.choices(ACTIONS, weights=(55, 30, 10, 5))[0],
+                'user_id': rng.randint(1, users)
+            })
+    events.sort(key=lambda event: event['at'])
+    return events
+
+
+def load_events(path: str) -> List[Dict]:
+    """Читает записанный поток действий из JSONL"""
+    with open(path, encoding='utf-8') as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    events.sort(key=lambda event: event['at'])
+    return events
+
+
+def apply_event(event: Dict, rng: random.Random, report: SimulationReport):
+    """Выполняет одно действие пользователя через функции БД, как это сделали бы обработчики"""
+    user_id = event['user_id']
+    action = event['action']
+    now = clock.now()
+    report.actions[action] += 1
+    create_or_update_user(user_id, f"sim_user_{user_id}")
+
+    if action == 'laundry':
+        machines = get_available_machines()
+        if not machines:
+            report.outcomes['laundry_no_machines'] += 1
+            return
+        booking_date = event.get('date') or (now.date() + timedelta(days=rng.randint(0, 3))).strftime('%Y-%m-%d')
+        date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
+        machine = event.get('machine') or rng.choice(machines)
+        slots = [
+            slot for slot in get_laundry_slot_times(date_obj)
+            if datetime.strptime(f"{booking_date} {slot}", '%Y-%m-%d %H:%M') > now + timedelta(minutes=MIN_LEAD_MINUTES)
+        ]
+        start_time = event.get('start_time') or (rng.choice(slots) if slots else None)
+        if not start_time:
+            report.outcomes['laundry_no_slots'] += 1
+            return
+        if start_time not in get_available_laundry_slots(date_obj, machine):
+            add_to_laundry_waitlist(user_id, machine, booking_date, start_time)
+            report.outcomes['laundry_waitlisted'] += 1
+            return
+        if not check_user_daily_bookings(user_id, booking_date):
+            report.outcomes['laundry_daily_limit'] += 1
+            return
+        end_time = minutes_to_time(time_to_minutes(start_time) + LAUNDRY_SLOT_MINUTES)
+        created = create_laundry_booking(user_id, machine, booking_date, start_time, end_time)
+        report.outcomes['laundry_booked' if created else 'laundry_error'] += 1
+
+    elif action == 'restroom':
+        booking_date = event.get('date') or (now.date() + timedelta(days=rng.randint(0, 3))).strftime('%Y-%m-%d')
+        date_obj = datetime.strptime(booking_date, '%Y-%m-%d').date()
+        slots = [
+            slot['time'] for slot in get_available_restroom_slots(date_obj)
+            if datetime.strptime(f"{booking_date} {slot['time']}", '%Y-%m-%d %H:%M') > now + timedelta(minutes=MIN_LEAD_MINUTES)
+        ]
+        start_time = event.get('start_time') or (rng.choice(slots) if slots else None)
+        if not start_time or start_time not in slots:
+            report.outcomes['restroom_no_slots'] += 1
+            return
+        duration = event.get('duration') or rng.choice((30, 60, 90, 120))
+        duration = min(duration, RESTROOM_CLOSE_MIN - time_to_minutes(start_time))
+        can_book, _ = check_restroom_limit(user_id, booking_date, duration)
+        if not can_book:
+            report.outcomes['restroom_weekly_limit'] += 1
+            return
+        end_time = minutes_to_time(time_to_minutes(start_time) + duration)
+        created = create_restroom_booking(user_id, booking_date, start_time, end_time, duration)
+        report.outcomes['restroom_booked' if created else 'restroom_error'] += 1
+
+    elif action in ('cancel_laundry', 'cancel_restroom'):
+        table = 'laundry_bookings' if action == 'cancel_laundry' else 'restroom_bookings'
+        booking_id = active_booking_of(table, user_id, now)
+        if booking_id is None:
+            report.outcomes[f'{action}_nothing'] += 1
+            return
+        cancel = cancel_laundry_booking if action == 'cancel_laundry' else cancel_restroom_booking
+        report.outcomes[f'{action}_done' if cancel(booking_id) else f'{action}_error'] += 1
+
+
+def active_booking_of(table: str, user_id: int, now: datetime) -> Optional[int]:
+    """Ближайшая будущая активная запись пользователя (без кэша сессий — он живет в реальном времени)"""
+    conn = database.get_db_connection()
+    try:
+        row = conn.execute(f'''
+            SELECT id FROM {table}
+            WHERE user_id = ? AND status = 'active' AND day_number * 1440 + start_min > ?
+            ORDER BY day_number, start_min LIMIT 1
+        ''', (user_id, now.toordinal() * 1440 + now.hour * 60 + now.minute)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+async def run_scheduler(bot: SimulatedBot, report: SimulationReport, end: datetime):
+    """Фоновый цикл бота с замером опоздания каждого прохода"""
+    started = clock.now()
+    expected = started
+    while clock.now() < end:
+        actual = clock.now()
+        report.ticks += 1
+        report.tick_lateness.append(max((actual - expected).total_seconds(), 0.0))
+        report.grid_drift = (actual - started).total_seconds() - (report.ticks - 1) * CHECK_INTERVAL_SECONDS
+        await run_scheduled_checks(bot)
+        # Напоминания и снятия неявок уходят через очередь уведомлений
+        await outbox_dispatcher.dispatch(bot)
+        expected = actual + timedelta(seconds=CHECK_INTERVAL_SECONDS)
+        await clock.sleep(CHECK_INTERVAL_SECONDS)
+
+
+async def replay(events: List[Dict], end: datetime, rng: random.Random, report: SimulationReport):
+    """Выполняет действия в их моменты по ускоренным часам"""
+    for event in events:
+        at = datetime.strptime(event['at'], '%Y-%m-%d %H:%M')
+        if at >= end:
+            break
+        delay = (at - clock.now()).total_seconds()
+        if delay > 0:
+            await clock.sleep(delay)
+        try:
+            apply_event(event, rng, report)
+        except Exception as e:
+            logger.error(f"Ошибка при воспроизведении {event}: {e}")
+            report.outcomes['event_error'] += 1
+    delay = (end - clock.now()).total_seconds()
+    if delay > 0:
+        await clock.sleep(delay)
+
+
+def collect_reminder_misses(start: datetime, end: datetime, report: SimulationReport):
+    """Записи, начавшиеся за время симуляции без напоминания, и напоминания, пришедшие после начала"""
+    start_stamp = start.toordinal() * 1440 + start.hour * 60 + start.minute
+    end_stamp = end.toordinal() * 1440 + end.hour * 60 + end.minute
+    missed = []
+    conn = database.get_db_connection()
+    try:
+        for booking_type, table in (('laundry', 'laundry_bookings'), ('restroom', 'restroom_bookings')):
+            rows = conn.execute(f'''
+                SELECT id, booking_date, start_time FROM {table}
+                WHERE status != 'cancelled' AND notified = 0
+                      AND day_number * 1440 + start_min BETWEEN ? AND ?
+            ''', (start_stamp, end_stamp)).fetchall()
+            missed.extend(
+                {'type': booking_type, 'id': row[0], 'date': row[1], 'start_time': row[2]} for row in rows
+            )
+
+        late = []
+        for booking_id, sent_at in report.reminders.items():
+            row = conn.execute(
+                'SELECT booking_date, start_time FROM laundry_bookings WHERE id = ?', (booking_id,)
+            ).fetchone()
+            starts_at = datetime.strptime(f"{row[0]} {row[1]}", '%Y-%m-%d %H:%M')
+            if sent_at > starts_at:
+                late.append({
+                    'type': 'laundry', 'id': booking_id,
+                    'late_by_s': round((sent_at - starts_at).total_seconds())
+                })
+    finally:
+        conn.close()
+    return missed, late
+
+
+async def simulate(start: datetime, days: int, speed: float, events: List[Dict], seed: int) -> Dict:
+    rng = random.Random(seed)
+    report = SimulationReport()
+    bot = SimulatedBot(report, rng)
+    end = start + timedelta(days=days)
+
+    previous_clock = clock.set_clock(clock.SimulatedClock(start, speed))
+    database.set_trace_callback(report.record_statement)
+    try:
+        scheduler = asyncio.create_task(run_scheduler(bot, report, end))
+        await replay(events, end, rng, report)
+        await scheduler
+    finally:
+        database.set_trace_callback(None)
+        clock.set_clock(previous_clock)
+
+    missed, late = collect_reminder_misses(start, end, report)
+    return report.as_dict(missed, late)
+
+
+def print_report(result: Dict, speed: float):
+    print(f"Проходов планировщика: {result['ticks']}")
+    print(
+        f"Опоздание прохода (сим. сек): среднее {result['tick_lateness_avg_s']}, "
+        f"p95 {result['tick_lateness_p95_s']}, макс {result['tick_lateness_max_s']}"
+    )
+    print(f"Накопленный дрейф планировщика: {result['scheduler_drift_s']} сим. сек (ускорение {speed:g}×)")
+    print(f"Пропущенные напоминания: {len(result['missed_reminders'])}")
+    for miss in result['missed_reminders'][:20]:
+        print(f"  {miss['type']} #{miss['id']} {miss['date']} {miss['start_time']}")
+    print(f"Напоминания после начала записи: {len(result['late_reminders'])}")
+    print("\nДействия: " + ", ".join(f"{k}={v}" for k, v in sorted(result['actions'].items())))
+    print("Результаты: " + ", ".join(f"{k}={v}" for k, v in sorted(result['outcomes'].items())))
+    print("Сообщения: " + ", ".join(f"{k}={v}" for k, v in sorted(result['messages'].items())))
+
+    print("\nЗапросов к БД по часам:")
+    per_day = defaultdict(list)
+    for hour, count in result['statements_per_hour'].items():
+        per_day[hour[:10]].append((hour[11:13], count))
+    for day, hours in per_day.items():
+        peak_hour, peak = max(hours, key=lambda item: item[1])
+        total = sum(count for _, count in hours)
+        print(f"  {day}: всего {total}, пик {peak} в {peak_hour}:00")
+        print("    " + " ".join(f"{hour}:{count}" for hour, count in hours))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ускоренная симуляция недели работы бота")
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--speed', type=float, default=1000.0)
+    parser.add_argument('--users', type=int, default=150)
+    parser.add_argument('--events', help="JSONL с записанным потоком действий")
+    parser.add_argument('--start', help="Начало симуляции (ГГГГ-ММ-ДД), по умолчанию ближайший понедельник")
+    parser.add_argument('--db', help="Файл временной БД (по умолчанию создается во временном каталоге)")
+    parser.add_argument('--force', action='store_true', help="Перезаписать существующий файл --db")
+    parser.add_argument('--report', help="Сохранить отчет в JSON")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.start:
+        start = datetime.strptime(args.start, '%Y-%m-%d')
+    else:
+        today = clock.today()
+        start = datetime.combine(today + timedelta(days=(7 - today.weekday()) % 7), datetime.min.time())
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='dorm_bot_sim_'), 'simulation.db')
+    if os.path.exists(db_path):
+        if not args.force:
+            parser.error(f"файл {db_path} уже существует; укажите другой --db или --force, чтобы перезаписать его")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    database.set_db_path(db_path)
+    init_db()
+
+    rng = random.Random(args.seed)
+    events = load_events(args.events) if args.events else synthetic_events(start, args.days, args.users, rng)
+
+    print(
+        f"Симуляция {args.days} дн. с {start:%d.%m.%Y}, {len(events)} действий, "
+        f"ускорение {args.speed:g}×, БД {db_path}"
+    )
+    print(
+        f"Напоминания: прачечная за {get_system_setting('laundry_notification_minutes')} мин, "
+        f"комната отдыха за {get_system_setting('restroom_notification_minutes')} мин\n"
+    )
+    result = asyncio.run(simulate(start, args.days, args.speed, events, args.seed))
+    print_report(result, args.speed)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,12 @@ class LaundryStates(StatesGroup):
     choosing_machine = State()
     choosing_time = State()
 
+class RecurringLaundryStates(StatesGroup):
+    choosing_machine = State()
+    choosing_weekday = State()
+    choosing_time = State()
+    choosing_weeks = State()
+
 class RestroomStates(StatesGroup):
     choosing_date = State()
     choosing_start = State()
@@ -12,4 +18,5 @@ class RestroomStates(StatesGroup):
 
 class AdminStates(StatesGroup):
     editing_setting = State()
+    editing_schedule_time = State()
     managing_machines = State()
\ No newline at end of file
@@ -0,0 +1,463 @@
+"""
+Хранилище данных бота: пользователи, машинки, записи, лимиты, лист ожидания, правила
+расписания, статистика загрузки и настройки.
+
+Обработчики и фоновые задачи работают с данными через функции этого модуля, а они
+передают вызов текущей реализации хранилища (DORM_BOT_STORAGE), выбранной при запуске:
+    sqlite — файл БД через database.py (по умолчанию);
+    memory — все данные в памяти процесса: один узел без файла БД, тесты и симуляции.
+Данные в памяти теряются при перезапуске, резервные копии делаются только для sqlite.
+"""
+import os
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import database
+from schedule import BookingWindow, ScheduleRule
+
+# Реализация хранилища по умолчанию
+STORAGE_BACKEND = os.getenv('DORM_BOT_STORAGE', 'sqlite')
+
+Booking = Dict[str, Union[int, str]]
+
+
+class Storage(ABC):
+    """
+    Интерфейс хранилища.
+
+    Семантика методов совпадает с одноименными функциями database.py: те же проверки
+    занятости и лимитов, те же форматы дат ('%Y-%m-%d'), времени ('HH:MM') и словарей.
+    """
+
+    # Запуск и остановка
+    @abstractmethod
+    def init(self):
+        """Готовит хранилище к работе (создает таблицы и правила по умолчанию)"""
+
+    @abstractmethod
+    def close(self):
+        """Освобождает ресурсы хранилища при остановке бота"""
+
+    # Пользователи
+    @abstractmethod
+    def create_or_update_user(self, user_id: int, username: str) -> bool:
+        ...
+
+    @abstractmethod
+    def is_admin(self, user_id: int) -> bool:
+        ...
+
+    # Машинки
+    @abstractmethod
+    def get_available_machines(self) -> List[int]:
+        ...
+
+    @abstractmethod
+    def get_all_machines(self) -> List[Dict[str, Union[int, str]]]:
+        ...
+
+    @abstractmethod
+    def update_machine_status(self, machine_number: int, status: str) -> bool:
+        ...
+
+    @abstractmethod
+    def handle_machine_outage(self, machine_number: int, notice: Optional[Callable[[Dict], str]] = None
+                              ) -> Dict[str, List[Booking]]:
+        ...
+
+    # Настройки
+    @abstractmethod
+    def get_system_setting(self, setting_name: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def update_system_setting(self, setting_name: str, setting_value: str) -> bool:
+        ...
+
+    @abstractmethod
+    def get_all_settings(self) -> Dict[str, str]:
+        ...
+
+    @abstractmethod
+    def get_booking_window(self) -> BookingWindow:
+        ...
+
+    # Расписание прачечной
+    @abstractmethod
+    def get_laundry_slot_template(self, date) -> Tuple[int, ...]:
+        ...
+
+    @abstractmethod
+    def get_laundry_slot_times(self, date) -> List[str]:
+        ...
+
+    @abstractmethod
+    def get_schedule_rules(self) -> List[ScheduleRule]:
+        ...
+
+    @abstractmethod
+    def add_schedule_rule(self, rule_type: str, weekday: Optional[int] = None, rule_date: Optional[str] = None,
+                          start_min: Optional[int] = None, end_min: Optional[int] = None,
+                          description: Optional[str] = None) -> bool:
+        ...
+
+    @abstractmethod
+    def delete_schedule_rule(self, rule_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def update_schedule_settings(self, setting_name: str, value: str) -> bool:
+        ...
+
+    # Записи в прачечную
+    @abstractmethod
+    def check_user_daily_bookings(self, user_id: int, date: str) -> bool:
+        ...
+
+    @abstractmethod
+    def get_laundry_booking_counts(self, date: str) -> Dict[int, int]:
+        ...
+
+    @abstractmethod
+    def get_available_laundry_slots(self, date, machine_number: int) -> List[str]:
+        ...
+
+    @abstractmethod
+    def get_booked_laundry_slots(self, date) -> Dict[int, set]:
+        ...
+
+    @abstractmethod
+    def find_nearest_laundry_slot(self, days: int = 7) -> Optional[Booking]:
+        ...
+
+    @abstractmethod
+    def create_laundry_booking(self, user_id: int, machine_number: int, booking_date: str,
+                               start_time: str, end_time: str, idempotency_key: Optional[str] = None,
+                               notice: Optional[str] = None) -> bool:
+        ...
+
+    @abstractmethod
+    def cancel_laundry_booking(self, booking_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def get_laundry_booking(self, booking_id: int) -> Optional[Booking]:
+        ...
+
+    @abstractmethod
+    def get_user_laundry_bookings(self, user_id: int) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def check_in_laundry_booking(self, booking_id: int, user_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def release_no_show_laundry_bookings(self, grace_minutes: int,
+                                         notice: Optional[Callable[[Booking], str]] = None) -> List[Booking]:
+        ...
+
+    @abstractmethod
+    def create_recurring_laundry_bookings(self, user_id: int, machine_number: int, first_date,
+                                          start_time: str, weeks: int) -> Tuple[List[str], List[Tuple[str, str]]]:
+        ...
+
+    # Лист ожидания прачечной
+    @abstractmethod
+    def add_to_laundry_waitlist(self, user_id: int, machine_number: int, booking_date: str, start_time: str) -> bool:
+        ...
+
+    @abstractmethod
+    def offer_laundry_slot_to_next_waiter(self, machine_number: int, booking_date: str, start_time: str,
+                                          allow_started: bool = False) -> Optional[Booking]:
+        ...
+
+    @abstractmethod
+    def expire_laundry_waitlist_offer(self, waitlist_id: int) -> Optional[Booking]:
+        ...
+
+    @abstractmethod
+    def expire_stale_laundry_waitlist_offers(self, claim_minutes: int) -> List[Booking]:
+        ...
+
+    @abstractmethod
+    def claim_laundry_waitlist_offer(self, waitlist_id: int, user_id: int) -> Tuple[bool, str]:
+        ...
+
+    @abstractmethod
+    def get_waitlisted_laundry_slots(self, machine_number: int) -> List[Dict[str, str]]:
+        ...
+
+    # Записи в комнату отдыха и недельные лимиты
+    @abstractmethod
+    def get_available_restroom_slots(self, date) -> List[Dict[str, str]]:
+        ...
+
+    @abstractmethod
+    def find_nearest_restroom_slot(self, days: int = 7, max_duration: int = 120) -> Optional[Booking]:
+        ...
+
+    @abstractmethod
+    def check_restroom_limit(self, user_id: int, booking_date: str, duration: int) -> Tuple[bool, int]:
+        ...
+
+    @abstractmethod
+    def create_restroom_booking(self, user_id: int, booking_date: str, start_time: str, end_time: str,
+                                duration: int, idempotency_key: Optional[str] = None) -> bool:
+        ...
+
+    @abstractmethod
+    def cancel_restroom_booking(self, booking_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def get_user_restroom_bookings(self, user_id: int) -> List[Dict]:
+        ...
+
+    # Общее для обоих типов записей
+    @abstractmethod
+    def get_active_bookings(self, booking_type: str) -> List[Booking]:
+        ...
+
+    @abstractmethod
+    def get_due_reminders(self, booking_type: str, minutes_before: int, grace_minutes: int = 0) -> List[Booking]:
+        ...
+
+    @abstractmethod
+    def mark_booking_notified(self, booking_type: str, booking_id: int, text: Optional[str] = None,
+                              buttons: Optional[List[Tuple[str, str]]] = None) -> bool:
+        ...
+
+    @abstractmethod
+    def iter_bookings_for_export(self, booking_type: str, date_from: Optional[str] = None,
+                                 date_to: Optional[str] = None, status: Optional[str] = None,
+                                 batch_size: int = 500) -> Iterator[Dict]:
+        ...
+
+    # Статистика загрузки
+    @abstractmethod
+    def get_utilization_stats(self, resource: str) -> List[Dict[str, int]]:
+        ...
+
+    @abstractmethod
+    def get_utilization_period(self, resource: str) -> Optional[Tuple[str, str]]:
+        ...
+
+    @abstractmethod
+    def rebuild_utilization_rollups(self) -> int:
+        ...
+
+    @abstractmethod
+    def get_booking_history(self, booking_type: str, first_day: int, last_day: int,
+                            machine_number: Optional[int] = None) -> List[Tuple[int, int, int, int, int, int]]:
+        ...
+
+    # Очередь исходящих уведомлений
+    @abstractmethod
+    def enqueue_notifications(self, notifications: List[Tuple[int, str, str]]) -> int:
+        ...
+
+    @abstractmethod
+    def has_due_notifications(self) -> bool:
+        ...
+
+    @abstractmethod
+    def claim_outbox_batch(self, limit: int, lease_seconds: float) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def record_outbox_results(self, sent: List[int], failed: List[Tuple[int, str, Optional[float]]]) -> bool:
+        ...
+
+    @abstractmethod
+    def prune_outbox(self, keep_days: int) -> int:
+        ...
+
+    @abstractmethod
+    def get_outbox_stats(self) -> Dict[str, int]:
+        ...
+
+    @abstractmethod
+    def get_dead_notifications(self, limit: int = 10) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    async def write_async(self, func: Callable, *args, **kwargs):
+        """Выполняет функцию записи, не блокируя цикл событий"""
+
+
+class SQLiteStorage(Storage):
+    """Хранилище в файле SQLite: текущий код database.py"""
+
+    init = staticmethod(database.init_db)
+    close = staticmethod(database.close_connections)
+
+    create_or_update_user = staticmethod(database.create_or_update_user)
+    is_admin = staticmethod(database.is_admin)
+
+    get_available_machines = staticmethod(database.get_available_machines)
+    get_all_machines = staticmethod(database.get_all_machines)
+    update_machine_status = staticmethod(database.update_machine_status)
+    handle_machine_outage = staticmethod(database.handle_machine_outage)
+
+    get_system_setting = staticmethod(database.get_system_setting)
+    update_system_setting = staticmethod(database.update_system_setting)
+    get_all_settings = staticmethod(database.get_all_settings)
+    get_booking_window = staticmethod(database.get_booking_window)
+
+    get_laundry_slot_template = staticmethod(database.get_laundry_slot_template)
+    get_laundry_slot_times = staticmethod(database.get_laundry_slot_times)
+    get_schedule_rules = staticmethod(database.get_schedule_rules)
+    add_schedule_rule = staticmethod(database.add_schedule_rule)
+    delete_schedule_rule = staticmethod(database.delete_schedule_rule)
+    update_schedule_settings = staticmethod(database.update_schedule_settings)
+
+    check_user_daily_bookings = staticmethod(database.check_user_daily_bookings)
+    get_laundry_booking_counts = staticmethod(database.get_laundry_booking_counts)
+    get_available_laundry_slots = staticmethod(database.get_available_laundry_slots)
+    get_booked_laundry_slots = staticmethod(database.get_booked_laundry_slots)
+    find_nearest_laundry_slot = staticmethod(database.find_nearest_laundry_slot)
+    create_laundry_booking = staticmethod(database.create_laundry_booking)
+    cancel_laundry_booking = staticmethod(database.cancel_laundry_booking)
+    get_laundry_booking = staticmethod(database.get_laundry_booking)
+    get_user_laundry_bookings = staticmethod(database.get_user_laundry_bookings)
+    check_in_laundry_booking = staticmethod(database.check_in_laundry_booking)
+    release_no_show_laundry_bookings = staticmethod(database.release_no_show_laundry_bookings)
+    create_recurring_laundry_bookings = staticmethod(database.create_recurring_laundry_bookings)
+
+    add_to_laundry_waitlist = staticmethod(database.add_to_laundry_waitlist)
+    offer_laundry_slot_to_next_waiter = staticmethod(database.offer_laundry_slot_to_next_waiter)
+    expire_laundry_waitlist_offer = staticmethod(database.expire_laundry_waitlist_offer)
+    expire_stale_laundry_waitlist_offers = staticmethod(database.expire_stale_laundry_waitlist_offers)
+    claim_laundry_waitlist_offer = staticmethod(database.claim_laundry_waitlist_offer)
+    get_waitlisted_laundry_slots = staticmethod(database.get_waitlisted_laundry_slots)
+
+    get_available_restroom_slots = staticmethod(database.get_available_restroom_slots)
+    find_nearest_restroom_slot = staticmethod(database.find_nearest_restroom_slot)
+    check_restroom_limit = staticmethod(database.check_restroom_limit)
+    create_restroom_booking = staticmethod(database.create_restroom_booking)
+    cancel_restroom_booking = staticmethod(database.cancel_restroom_booking)
+    get_user_restroom_bookings = staticmethod(database.get_user_restroom_bookings)
+
+    get_active_bookings = staticmethod(database.get_active_bookings)
+    get_due_reminders = staticmethod(database.get_due_reminders)
+    mark_booking_notified = staticmethod(database.mark_booking_notified)
+    iter_bookings_for_export = staticmethod(database.iter_bookings_for_export)
+
+    get_utilization_stats = staticmethod(database.get_utilization_stats)
+    get_utilization_period = staticmethod(database.get_utilization_period)
+    rebuild_utilization_rollups = staticmethod(database.rebuild_utilization_rollups)
+    get_booking_history = staticmethod(database.get_booking_history)
+
+    enqueue_notifications = staticmethod(database.enqueue_notifications)
+    has_due_notifications = staticmethod(database.has_due_notifications)
+    claim_outbox_batch = staticmethod(database.claim_outbox_batch)
+    record_outbox_results = staticmethod(database.record_outbox_results)
+    prune_outbox = staticmethod(database.prune_outbox)
+    get_outbox_stats = staticmethod(database.get_outbox_stats)
+    get_dead_notifications = staticmethod(database.get_dead_notifications)
+
+    write_async = staticmethod(database.write_async)
+
+
+def create_storage(name: str = STORAGE_BACKEND) -> Storage:
+    """Создает хранилище по имени реализации"""
+    if name == 'sqlite':
+        return SQLiteStorage()
+    if name == 'memory':
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище: {name}")
+
+
+_storage: Storage = SQLiteStorage()
+
+
+def get_storage() -> Storage:
+    """Возвращает текущее хранилище"""
+    return _storage
+
+
+def set_storage(new_storage: Storage) -> Storage:
+    """Подменяет хранилище (при запуске, в тестах и симуляциях); возвращает предыдущее"""
+    global _storage
+    previous, _storage = _storage, new_storage
+    return previous
+
+
+def _forward(name: str):
+    def call(*args, **kwargs):
+        return getattr(_storage, name)(*args, **kwargs)
+    call.__name__ = name
+    return call
+
+
+async def write_async(func: Callable, *args, **kwargs):
+    """Выполняет функцию записи текущего хранилища, не блокируя цикл событий"""
+    return await _storage.write_async(func, *args, **kwargs)
+
+
+create_or_update_user = _forward('create_or_update_user')
+is_admin = _forward('is_admin')
+
+get_available_machines = _forward('get_available_machines')
+get_all_machines = _forward('get_all_machines')
+update_machine_status = _forward('update_machine_status')
+handle_machine_outage = _forward('handle_machine_outage')
+
+get_system_setting = _forward('get_system_setting')
+update_system_setting = _forward('update_system_setting')
+get_all_settings = _forward('get_all_settings')
+get_booking_window = _forward('get_booking_window')
+
+get_laundry_slot_template = _forward('get_laundry_slot_template')
+get_laundry_slot_times = _forward('get_laundry_slot_times')
+get_schedule_rules = _forward('get_schedule_rules')
+add_schedule_rule = _forward('add_schedule_rule')
+delete_schedule_rule = _forward('delete_schedule_rule')
+update_schedule_settings = _forward('update_schedule_settings')
+
+check_user_daily_bookings = _forward('check_user_daily_bookings')
+get_laundry_booking_counts = _forward('get_laundry_booking_counts')
+get_available_laundry_slots = _forward('get_available_laundry_slots')
+get_booked_laundry_slots = _forward('get_booked_laundry_slots')
+find_nearest_laundry_slot = _forward('find_nearest_laundry_slot')
+create_laundry_booking = _forward('create_laundry_booking')
+cancel_laundry_booking = _forward('cancel_laundry_booking')
+get_laundry_booking = _forward('get_laundry_booking')
+get_user_laundry_bookings = _forward('get_user_laundry_bookings')
+check_in_laundry_booking = _forward('check_in_laundry_booking')
+release_no_show_laundry_bookings = _forward('release_no_show_laundry_bookings')
+create_recurring_laundry_bookings = _forward('create_recurring_laundry_bookings')
+
+add_to_laundry_waitlist = _forward('add_to_laundry_waitlist')
+offer_laundry_slot_to_next_waiter = _forward('offer_laundry_slot_to_next_waiter')
+expire_laundry_waitlist_offer = _forward('expire_laundry_waitlist_offer')
+expire_stale_laundry_waitlist_offers = _forward('expire_stale_laundry_waitlist_offers')
+claim_laundry_waitlist_offer = _forward('claim_laundry_waitlist_offer')
+get_waitlisted_laundry_slots = _forward('get_waitlisted_laundry_slots')
+
+get_available_restroom_slots = _forward('get_available_restroom_slots')
+find_nearest_restroom_slot = _forward('find_nearest_restroom_slot')
+check_restroom_limit = _forward('check_restroom_limit')
+create_restroom_booking = _forward('create_restroom_booking')
+cancel_restroom_booking = _forward('cancel_restroom_booking')
+get_user_restroom_bookings = _forward('get_user_restroom_bookings')
+
+get_active_bookings = _forward('get_active_bookings')
+get_due_reminders = _forward('get_due_reminders')
+mark_booking_notified = _forward('mark_booking_notified')
+iter_bookings_for_export = _forward('iter_bookings_for_export')
+
+get_utilization_stats = _forward('get_utilization_stats')
+get_utilization_period = _forward('get_utilization_period')
+rebuild_utilization_rollups = _forward('rebuild_utilization_rollups')
+get_booking_history = _forward('get_booking_history')
+
+enqueue_notifications = _forward('enqueue_notifications')
+has_due_notifications = _forward('has_due_notifications')
+claim_outbox_batch = _forward('claim_outbox_batch')
+record_outbox_results = _forward('record_outbox_results')
+prune_outbox = _forward('prune_outbox')
+get_outbox_stats = _forward('get_outbox_stats')
+get_dead_notifications = _forward('get_dead_notifications')
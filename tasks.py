@@ -0,0 +1,94 @@
+import asyncio
+import logging
+
+import clock
+from storage import (
+    get_system_setting,
+    get_due_reminders,
+    get_booking_window,
+    mark_booking_notified,
+    expire_stale_laundry_waitlist_offers,
+    release_no_show_laundry_bookings,
+    write_async
+)
+from handlers.laundry import offer_freed_laundry_slot
+from admission import admission_queue
+
+logger = logging.getLogger(__name__)
+
+# Интервал проверки напоминаний и неявок (в секундах)
+CHECK_INTERVAL_SECONDS = 60
+
+
+async def queue_due_reminders():
+    """
+    Ставит в очередь уведомлений напоминания о ближайших записях.
+
+    Отметки пишутся через write_async одновременно и фиксируются писателем одной пачкой.
+    """
+    laundry_minutes = int(get_system_setting('laundry_notification_minutes') or 30)
+    grace_minutes = int(get_system_setting('laundry_grace_period') or 15)
+    marks = []
+
+    for booking in get_due_reminders('laundry', laundry_minutes, grace_minutes):
+        marks.append(write_async(
+            mark_booking_notified, 'laundry', booking['id'],
+            f"⏰ Напоминание: стирка на машинке №{booking['machine_number']} "
+            f"в {booking['start_time']}-{booking['end_time']}.\n\n"
+            f"Подтвердите, что вы пришли, в течение {grace_minutes} минут после начала, "
+            f"иначе запись будет снята.",
+            [("🙋 Я на месте", f"checkin_laundry_{booking['id']}")]
+        ))
+
+    restroom_minutes = int(get_system_setting('restroom_notification_minutes') or 15)
+    for booking in get_due_reminders('restroom', restroom_minutes):
+        marks.append(write_async(
+            mark_booking_notified, 'restroom', booking['id'],
+            f"⏰ Напоминание: комната отдыха в {booking['start_time']}-{booking['end_time']}."
+        ))
+
+    await asyncio.gather(*marks)
+
+
+async def release_no_shows(bot):
+    """Снимает неподтвержденные записи в прачечную и предлагает слоты листу ожидания"""
+    grace_minutes = int(get_system_setting('laundry_grace_period') or 15)
+
+    def notice(booking):
+        return (
+            f"❌ Ваша запись на машинку №{booking['machine_number']} "
+            f"{booking['booking_date']} {booking['start_time']} снята: "
+            f"приход не подтвержден в течение {grace_minutes} минут."
+        )
+
+    for booking in await write_async(release_no_show_laundry_bookings, grace_minutes, notice):
+        # Слот уже идет: листу ожидания предлагается его оставшееся время
+        await offer_freed_laundry_slot(
+            bot, booking['machine_number'], booking['booking_date'], booking['start_time'], allow_started=True
+        )
+
+
+async def expire_waitlist_offers(bot):
+    """Снимает просроченные предложения из листа ожидания и передает слоты следующим"""
+    claim_minutes = int(get_system_setting('waitlist_claim_minutes') or 15)
+    for slot in await write_async(expire_stale_laundry_waitlist_offers, claim_minutes):
+        await offer_freed_laundry_slot(bot, slot['machine_number'], slot['booking_date'], slot['start_time'])
+
+
+async def run_scheduled_checks(bot):
+    """Один проход фоновой проверки: напоминания, снятие неявок и просроченных предложений листа ожидания"""
+    try:
+        # Снимок свободных слотов готовим заранее, до открытия записи
+        admission_queue.prewarm(get_booking_window(), clock.now(), 2 * CHECK_INTERVAL_SECONDS)
+        await queue_due_reminders()
+        await release_no_shows(bot)
+        await expire_waitlist_offers(bot)
+    except Exception as e:
+        logger.error(f"Ошибка фоновой проверки записей: {e}")
+
+
+async def check_and_send_notifications(bot):
+    """Фоновый цикл: напоминания о записях и снятие неявок"""
+    while True:
+        await run_scheduled_checks(bot)
+        await clock.sleep(CHECK_INTERVAL_SECONDS)
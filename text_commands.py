@@ -0,0 +1,65 @@
+import inspect
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from aiogram import Router, types
+from aiogram.filters import BaseFilter
+
+
+class TextCommandRegistry:
+    """
+    Таблица текстовых команд reply-клавиатуры.
+
+    Каждая надпись кнопки отображается на обработчик; сообщение маршрутизируется одним
+    поиском в словаре вместо перебора фильтров F.text == "..." по всем роутерам.
+    Команды клавиатуры имеют приоритет над вводом в состояниях FSM: нажатие кнопки меню
+    посреди диалога открывает меню, а не принимается за дату или время.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {}
+
+    def command(self, *labels: str):
+        """Декоратор: регистрирует обработчик для одной или нескольких надписей кнопок"""
+        def decorator(handler):
+            # Обработчику передаются только те данные (state, bot, ...), которые он принимает
+            params = tuple(inspect.signature(handler).parameters)[1:]
+            for label in labels:
+                if label in self._handlers:
+                    raise ValueError(f"Текстовая команда '{label}' уже зарегистрирована")
+                self._handlers[label] = (handler, params)
+            return handler
+        return decorator
+
+    def resolve(self, text: Optional[str]) -> Optional[Tuple[Callable, Tuple[str, ...]]]:
+        if text is None:
+            return None
+        return self._handlers.get(text)
+
+    def labels(self):
+        return self._handlers.keys()
+
+
+text_commands = TextCommandRegistry()
+
+
+class TextCommandFilter(BaseFilter):
+    """Пропускает сообщения с зарегистрированной надписью и передает найденный обработчик"""
+
+    def __init__(self, registry: TextCommandRegistry):
+        self.registry = registry
+
+    async def __call__(self, message: types.Message):
+        entry = self.registry.resolve(message.text)
+        if entry is None:
+            return False
+        return {'text_command': entry}
+
+
+router = Router()
+
+
+@router.message(TextCommandFilter(text_commands))
+async def dispatch_text_command(message: types.Message, text_command, **data: Any):
+    """Вызывает обработчик команды reply-клавиатуры"""
+    handler, params = text_command
+    await handler(message, **{name: data[name] for name in params if name in data})
@@ -0,0 +1,160 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Обновления дольше порога всегда пишутся в журнал с уровнем INFO и попадают в файл выгрузки
+TRACE_SLOW_MS = float(os.getenv('DORM_BOT_TRACE_SLOW_MS', '1000'))
+
+# Файл выгрузки трасс (JSON Lines); пустое значение — выгрузка отключена
+TRACE_EXPORT_PATH = os.getenv('DORM_BOT_TRACE_FILE', '')
+
+# Доля обычных (не медленных) обновлений, попадающих в файл выгрузки
+TRACE_SAMPLE_RATE = float(os.getenv('DORM_BOT_TRACE_SAMPLE', '0.01'))
+
+# Записывать ли в трассу данные нажатой кнопки (по умолчанию только тип события)
+TRACE_CALLBACK_DATA = os.getenv('DORM_BOT_TRACE_CALLBACK_DATA', '') == '1'
+
+
+class Trace:
+    """Трасса обработки одного обновления: идентификатор, атрибуты и список отрезков"""
+
+    def __init__(self, attributes: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[Dict[str, Any]] = []
+        self._stack: List[int] = []
+
+    def open_span(self, name: str) -> int:
+        index = len(self.spans)
+        self.spans.append({
+            'name': name,
+            'parent': self._stack[-1] if self._stack else None,
+            'start_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'duration_ms': None,
+        })
+        self._stack.append(index)
+        return index
+
+    def close_span(self, index: int, started: float, error: Optional[BaseException] = None):
+        span = self.spans[index]
+        span['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        if error is not None:
+            span['error'] = type(error).__name__
+        if self._stack and self._stack[-1] == index:
+            self._stack.pop()
+        elif index in self._stack:
+            self._stack.remove(index)
+
+    def duration_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'started_at': round(self.started_at, 3),
+            'duration_ms': round(self.duration_ms(), 3),
+            **self.attributes,
+            'spans': self.spans,
+        }
+
+
+# Трасса текущего обновления; в потоке-писателе и фоновых задачах ее нет
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('trace', default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def trace_span(name: str):
+    """Отрезок трассы текущего обновления; вне трассы ничего не записывает"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    index = trace.open_span(name)
+    try:
+        yield
+    except BaseException as e:
+        trace.close_span(index, started, e)
+        raise
+    trace.close_span(index, started)
+
+
+def traced(kind: str):
+    """Декоратор: вызов функции записывается отрезком трассы с именем kind.имя_функции"""
+    def decorator(func):
+        name = f"{kind}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with trace_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TraceExporter:
+    """
+    Запись завершенных трасс в JSON-журнал и выборочная выгрузка в файл.
+
+    Медленные обновления выгружаются всегда, остальные — с вероятностью sample_rate.
+    """
+
+    def __init__(self, path: str = TRACE_EXPORT_PATH, sample_rate: float = TRACE_SAMPLE_RATE,
+                 slow_ms: float = TRACE_SLOW_MS):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self.exported = 0
+
+    def finish(self, trace: Trace):
+        record = trace.to_dict()
+        line = json.dumps(record, ensure_ascii=False)
+        slow = record['duration_ms'] >= self.slow_ms
+        logger.log(logging.INFO if slow else logging.DEBUG, line)
+
+        if self.path and (slow or random.random() < self.sample_rate):
+            try:
+                with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+                self.exported += 1
+            except OSError as e:
+                logger.error(f"Не удалось выгрузить трассу {trace.trace_id}: {e}")
+
+
+trace_exporter = TraceExporter()
+
+
+def start_trace(attributes: Dict[str, Any]) -> Tuple[Trace, contextvars.Token]:
+    """Начинает трассу обновления в текущем контексте"""
+    trace = Trace(attributes)
+    return trace, _current_trace.set(trace)
+
+
+def finish_trace(trace: Trace, token: contextvars.Token, exporter: Optional[TraceExporter] = None):
+    """Завершает трассу и передает ее в журнал и выгрузку"""
+    _current_trace.reset(token)
+    (exporter or trace_exporter).finish(trace)
@@ -0,0 +1,86 @@
+from typing import Any, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.storage.base import BaseStorage
+
+from tracing import TRACE_CALLBACK_DATA, TraceExporter, finish_trace, start_trace, trace_exporter, trace_span
+
+
+def update_attributes(update) -> Dict[str, Any]:
+    """
+    Атрибуты трассы по обновлению: номер, тип события и пользователь.
+
+    Текст сообщения в трассу не попадает, только его длина; данные кнопки записываются
+    лишь при DORM_BOT_TRACE_CALLBACK_DATA=1.
+    """
+    attributes: Dict[str, Any] = {'update_id': update.update_id}
+    event_type = getattr(update, 'event_type', None)
+    attributes['event'] = event_type
+    event = getattr(update, event_type, None) if event_type else None
+    user = getattr(event, 'from_user', None)
+    if user is not None:
+        attributes['user_id'] = user.id
+    if event_type == 'callback_query' and TRACE_CALLBACK_DATA:
+        attributes['callback'] = event.data
+    elif event_type == 'message':
+        attributes['text_length'] = len(event.text or '')
+    return attributes
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    Присваивает каждому обновлению идентификатор трассы и измеряет его обработку.
+
+    Регистрируется как внешний middleware обновлений; отрезки внутри добавляют хранилище FSM,
+    функции database.py и исходящие вызовы Bot API.
+    """
+
+    def __init__(self, exporter: TraceExporter = trace_exporter):
+        self.exporter = exporter
+
+    async def __call__(self, handler, event, data):
+        trace, token = start_trace(update_attributes(event))
+        try:
+            with trace_span('handler'):
+                return await handler(event, data)
+        finally:
+            finish_trace(trace, token, self.exporter)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Записывает исходящие вызовы Bot API отрезками api.<Метод>"""
+
+    async def __call__(self, make_request, bot, method):
+        with trace_span(f"api.{type(method).__name__}"):
+            return await make_request(bot, method)
+
+
+class TracedStorage(BaseStorage):
+    """Обертка хранилища FSM, записывающая чтение и запись состояния отрезками fsm.*"""
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+
+    async def set_state(self, key, state=None):
+        with trace_span('fsm.set_state'):
+            await self.storage.set_state(key, state)
+
+    async def get_state(self, key):
+        with trace_span('fsm.get_state'):
+            return await self.storage.get_state(key)
+
+    async def set_data(self, key, data):
+        with trace_span('fsm.set_data'):
+            await self.storage.set_data(key, data)
+
+    async def get_data(self, key):
+        with trace_span('fsm.get_data'):
+            return await self.storage.get_data(key)
+
+    async def update_data(self, key, data):
+        with trace_span('fsm.update_data'):
+            return await self.storage.update_data(key, data)
+
+    async def close(self):
+        await self.storage.close()
@@ -1,7 +1,9 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import List, Dict, Tuple, Optional
 import re
 
+import clock
+
 
 def is_valid_date(date_str: str, date_format: str = '%d.%m.%Y') -> bool:
     """Проверяет, является ли строка корректной датой в указанном формате"""
@@ -54,9 +56,34 @@ def add_minutes_to_time(time_str: str, minutes: int) -> str:
     return minutes_to_time(total_minutes % 1440)  # Обрабатываем переход через полночь
 
 
+def date_to_day_number(date_obj: date) -> int:
+    """Конвертирует дату в целый номер дня, в котором даты хранятся в БД"""
+    return date_obj.toordinal()
+
+
+def day_number_to_date(day_number: int) -> date:
+    """Конвертирует номер дня из БД обратно в дату"""
+    return date.fromordinal(day_number)
+
+
+def date_str_to_day_number(date_str: str, date_format: str = '%Y-%m-%d') -> int:
+    """Конвертирует строку с датой в номер дня"""
+    return datetime.strptime(date_str, date_format).toordinal()
+
+
+def day_number_to_str(day_number: int, date_format: str = '%Y-%m-%d') -> str:
+    """Форматирует номер дня из БД в строку"""
+    return date.fromordinal(day_number).strftime(date_format)
+
+
+def to_minute_stamp(dt: datetime) -> int:
+    """Возвращает абсолютный номер минуты (день * 1440 + минута дня) для сравнений в SQL"""
+    return dt.toordinal() * 1440 + dt.hour * 60 + dt.minute
+
+
 def get_current_datetime() -> datetime:
     """Возвращает текущие дату и время"""
-    return datetime.now()
+    return clock.now()
 
 
 def format_date(date_obj: datetime, date_format: str = '%d.%m.%Y') -> str:
@@ -157,7 +184,7 @@ def split_duration(duration_minutes: int, max_chunk: int = 120) -> List[int]:
 
 def get_current_week() -> Tuple[int, int]:
     """Возвращает номер текущей недели и год"""
-    today = datetime.now()
+    today = clock.now()
     year, week, _ = today.isocalendar()
     return week, year
 
@@ -178,6 +205,15 @@ def is_time_in_future(time_str: str, date_str: str) -> bool:
     """Проверяет, является ли время будущим относительно текущего момента"""
     try:
         booking_dt = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
-        return booking_dt > datetime.now()
+        return booking_dt > clock.now()
     except ValueError:
-        return False
\ No newline at end of file
+        return False
+
+
+# Имена ресурсов в статистике загрузки
+RESTROOM_RESOURCE = 'restroom'
+
+
+def laundry_resource(machine_number: int) -> str:
+    """Возвращает имя ресурса машинки в таблице загрузки"""
+    return f"laundry_{machine_number}"